@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Proxy Load Test - added latency and per-core throughput of the metering proxy
+Drives a local stub upstream directly and then through meterr_proxy with the
+same keep-alive load, and reports the latency the proxy adds (p50/p99 of
+time to first byte and to the last byte) and the requests/sec it sustains
+per core of proxy CPU. Metering and telemetry run for real: the proxy ships
+its records to the stub's /sdk/usage route.
+Usage: python benchmarks/proxy_load.py [--concurrency 64] [--duration 10] [--stream]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from typing import Any, Dict, List, Sequence, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import StubUpstream, free_port, payload, start_in_process
+
+def _request_bytes(port: int, body: Dict[str, Any]) -> bytes:
+    data = json.dumps(body).encode()
+    return (
+        f"POST /v1/chat/completions HTTP/1.1\r\nhost: 127.0.0.1:{port}\r\n"
+        f"authorization: Bearer sk-stub\r\ncontent-type: application/json\r\n"
+        f"x-meterr-team: load\r\ncontent-length: {len(data)}\r\n\r\n"
+    ).encode("latin-1") + data
+
+async def _read_response(reader: asyncio.StreamReader) -> float:
+    """Consume one response; returns when its head arrived (perf_counter)"""
+    head = await reader.readuntil(b"\r\n\r\n")
+    first = time.perf_counter()
+    lowered = head.lower()
+    if b"transfer-encoding: chunked" in lowered:
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        start = lowered.index(b"content-length:") + 15
+        await reader.readexactly(int(lowered[start:lowered.index(b"\r\n", start)]))
+    return first
+
+async def _connection(port: int, request: bytes, warmup_end: float, end: float, samples: List[Tuple[float, float]]):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        while True:
+            started = time.perf_counter()
+            if started >= end:
+                break
+            writer.write(request)
+            first = await _read_response(reader)
+            if started >= warmup_end:
+                samples.append((first - started, time.perf_counter() - started))
+    finally:
+        writer.close()
+
+async def _drive(port: int, body: Dict[str, Any], connections: int, warmup: float, duration: float) -> List[Tuple[float, float]]:
+    samples: List[Tuple[float, float]] = []
+    request = _request_bytes(port, body)
+    now = time.perf_counter()
+    await asyncio.gather(*(
+        _connection(port, request, now + warmup, now + warmup + duration, samples)
+        for _ in range(connections)
+    ))
+    return samples
+
+def _load_worker(args: Tuple[int, Dict[str, Any], int, float, float]) -> List[Tuple[float, float]]:
+    return asyncio.run(_drive(*args))
+
+def run_load(port: int, body: Dict[str, Any], concurrency: int, warmup: float, duration: float, processes: int) -> List[Tuple[float, float]]:
+    """(first byte, total) latency samples in seconds from `processes` load generators"""
+    per_process = [concurrency // processes + (i < concurrency % processes) for i in range(processes)]
+    jobs = [(port, body, n, warmup, duration) for n in per_process if n]
+    with multiprocessing.Pool(len(jobs)) as pool:
+        results = pool.map(_load_worker, jobs)
+    return [sample for samples in results for sample in samples]
+
+def _proxy_worker(port: int, upstream_port: int, ready: Any, control: Any):
+    """Run the proxy; on 'mark' snapshot CPU and counters, on 'stop' report the deltas"""
+    from meterr import MeterrClient
+    from meterr_proxy import MeteringProxy
+
+    async def main():
+        offline_db = os.path.join(tempfile.mkdtemp(), "queue.db")
+        meterr = MeterrClient(
+            api_key="mk-load", endpoint=f"http://127.0.0.1:{upstream_port}/sdk/usage",
+            flush_interval=1.0, offline_db=offline_db
+        )
+        proxy = MeteringProxy(f"http://127.0.0.1:{upstream_port}", meterr=meterr)
+        await proxy.start("127.0.0.1", port)
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        baseline = {}
+
+        def listen():
+            while True:
+                command = control.recv()
+                if command == "mark":
+                    baseline.update(cpu=time.process_time(), requests=proxy.requests)
+                    control.send("ok")
+                elif command == "stop":
+                    loop.call_soon_threadsafe(stopped.set)
+                    return
+
+        threading.Thread(target=listen, daemon=True).start()
+        ready.set()
+        await stopped.wait()
+        # Pending metering and telemetry count against the proxy's CPU
+        await proxy.close()
+        control.send({
+            "cpu_seconds": time.process_time() - baseline.get("cpu", 0.0),
+            "requests": proxy.requests - baseline.get("requests", 0),
+            "metered": proxy.metered,
+            "dropped": proxy.dropped,
+        })
+        meterr.close()
+
+    asyncio.run(main())
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of unsorted values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+def percentiles(samples: List[Tuple[float, float]]) -> Dict[str, float]:
+    first = [s[0] * 1000 for s in samples]
+    total = [s[1] * 1000 for s in samples]
+    return {
+        "first_p50_ms": percentile(first, 50), "first_p99_ms": percentile(first, 99),
+        "p50_ms": percentile(total, 50), "p99_ms": percentile(total, 99),
+    }
+
+def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    stub = StubUpstream(latency=args.upstream_latency, chunks=args.chunks, chunk_delay=args.chunk_delay)
+    stub_process, upstream_port = start_in_process(stub)
+
+    proxy_port = free_port()
+    ready = multiprocessing.Event()
+    control, child = multiprocessing.Pipe()
+    proxy_process = multiprocessing.Process(target=_proxy_worker, args=(proxy_port, upstream_port, ready, child), daemon=True)
+    proxy_process.start()
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("Proxy did not start")
+        body = payload(stream=args.stream)
+
+        direct = run_load(upstream_port, body, args.concurrency, args.warmup, args.duration, args.processes)
+        # Warm the proxy's upstream pool before measuring
+        run_load(proxy_port, body, args.concurrency, 0.0, args.warmup, args.processes)
+        control.send("mark")
+        control.recv()
+        proxied = run_load(proxy_port, body, args.concurrency, 0.0, args.duration, args.processes)
+        control.send("stop")
+        usage = control.recv()
+    finally:
+        proxy_process.join(30)
+        proxy_process.terminate()
+        stub_process.terminate()
+
+    direct_stats = percentiles(direct)
+    proxied_stats = percentiles(proxied)
+    return {
+        "mode": "stream" if args.stream else "json",
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "direct": dict(direct_stats, rps=len(direct) / args.duration),
+        "proxied": dict(proxied_stats, rps=len(proxied) / args.duration),
+        "added": {key: proxied_stats[key] - direct_stats[key] for key in direct_stats},
+        "proxy_cpu_seconds": usage["cpu_seconds"],
+        "rps_per_core": usage["requests"] / usage["cpu_seconds"] if usage["cpu_seconds"] else 0.0,
+        "metered": usage["metered"],
+        "dropped": usage["dropped"],
+    }
+
+def print_report(report: Dict[str, Any]):
+    print(f"\nMode: {report['mode']}, {report['concurrency']} connections, {report['duration_s']:.0f}s")
+    print(f"{'':10} {'ttfb p50':>10} {'ttfb p99':>10} {'p50 ms':>10} {'p99 ms':>10} {'req/s':>10}")
+    for name in ("direct", "proxied"):
+        row = report[name]
+        print(f"{name:10} {row['first_p50_ms']:10.2f} {row['first_p99_ms']:10.2f} {row['p50_ms']:10.2f} {row['p99_ms']:10.2f} {row['rps']:10.0f}")
+    added = report["added"]
+    print(f"{'added':10} {added['first_p50_ms']:+10.2f} {added['first_p99_ms']:+10.2f} {added['p50_ms']:+10.2f} {added['p99_ms']:+10.2f}")
+    print(f"\nProxy CPU: {report['proxy_cpu_seconds']:.2f}s -> {report['rps_per_core']:.0f} req/s per core")
+    print(f"Metered records: {report['metered']} ({report['dropped']} dropped)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Metering proxy load test')
+    parser.add_argument('--concurrency', type=int, default=64, help='Keep-alive client connections')
+    parser.add_argument('--duration', type=float, default=10.0, help='Measured seconds per phase')
+    parser.add_argument('--warmup', type=float, default=2.0, help='Unmeasured seconds before each phase')
+    parser.add_argument('--processes', type=int, default=2, help='Load generator processes')
+    parser.add_argument('--stream', action='store_true', help='Request SSE streams instead of JSON')
+    parser.add_argument('--chunks', type=int, default=20, help='Content chunks per streamed response')
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help='Seconds between streamed chunks')
+    parser.add_argument('--upstream-latency', type=float, default=0.0, help='Stub time to first byte in seconds')
+    parser.add_argument('--json', type=str, default=None, help='Also write the report to this file')
+
+    args = parser.parse_args()
+
+    report = benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
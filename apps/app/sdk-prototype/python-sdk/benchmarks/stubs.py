@@ -0,0 +1,220 @@
+"""
+Benchmark stubs - local OpenAI-compatible upstream and Meterr ingest servers
+StubUpstream answers chat completions (JSON or SSE), completions and
+embeddings with canned bodies after a configurable delay, and accepts
+telemetry batches on /sdk/usage. StubIngest accepts telemetry while
+following a timed script of slowdowns, errors and outages. Each runs in its
+own process so its CPU does not count against the system under test.
+Used by: python benchmarks/proxy_load.py, python benchmarks/telemetry_load.py
+"""
+
+import json
+import time
+import random
+import socket
+import asyncio
+import multiprocessing
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+STUB_MODEL = "gpt-4o-mini"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _http_response(status: int, body: bytes, content_type: str = "application/json") -> bytes:
+    reason = {200: "OK", 404: "Not Found", 500: "Internal Server Error", 503: "Service Unavailable"}.get(status, "OK")
+    return (
+        f"HTTP/1.1 {status} {reason}\r\ncontent-type: {content_type}\r\n"
+        f"content-length: {len(body)}\r\n\r\n"
+    ).encode("latin-1") + body
+
+class StubServer:
+    """Minimal keep-alive HTTP/1.1 server; subclasses write responses in handle()"""
+
+    async def handle(self, path: str, body: bytes, writer: asyncio.StreamWriter) -> None:
+        raise NotImplementedError
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                path = lines[0].split(" ")[1]
+                length = 0
+                for line in lines[1:]:
+                    if line[:15].lower() == "content-length:":
+                        length = int(line[15:])
+                body = await reader.readexactly(length) if length else b""
+                await self.handle(path, body, writer)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port: int, ready: Optional[Any] = None):
+        server = await asyncio.start_server(self._serve_connection, "127.0.0.1", port, backlog=4096)
+        if ready is not None:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+
+class StubUpstream(StubServer):
+    """Canned OpenAI-style responses with a fixed time to first byte
+
+    `latency` is waited before the response head; streamed chat
+    completions then send `chunks` content chunks `chunk_delay` apart.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        chunks: int = 20,
+        chunk_delay: float = 0.0,
+        completion_tokens: int = 20
+    ):
+        self.latency = latency
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.completion_tokens = completion_tokens
+        self.requests = 0
+        self.records = 0
+
+        usage = {"prompt_tokens": 12, "completion_tokens": completion_tokens, "total_tokens": 12 + completion_tokens}
+        self._completion = json.dumps({
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": 0, "model": STUB_MODEL,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok " * completion_tokens}, "finish_reason": "stop"}],
+            "usage": usage,
+        }).encode()
+        chunk = json.dumps({
+            "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0, "model": STUB_MODEL,
+            "choices": [{"index": 0, "delta": {"content": "ok "}, "finish_reason": None}],
+        }).encode()
+        self._chunk = b"data: " + chunk + b"\n\n"
+        self._usage_chunk = b"data: " + json.dumps({
+            "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0, "model": STUB_MODEL,
+            "choices": [], "usage": usage,
+        }).encode() + b"\n\n"
+
+    async def handle(self, path: str, body: bytes, writer: asyncio.StreamWriter) -> None:
+        """Write the response for one request"""
+        self.requests += 1
+        if path.endswith("/usage"):
+            # Telemetry batches; counted without a full parse
+            self.records += body.count(b'"request_id"')
+            writer.write(_http_response(200, b'{"ok": true}'))
+            return
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if path.endswith("/embeddings"):
+            request = json.loads(body or b"{}")
+            inputs = request.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            writer.write(_http_response(200, json.dumps({
+                "object": "list", "model": request.get("model", "text-embedding-3-small"),
+                "data": [{"object": "embedding", "index": i, "embedding": [0.0] * 8} for i in range(len(inputs))],
+                "usage": {"prompt_tokens": 8 * len(inputs), "total_tokens": 8 * len(inputs)},
+            }).encode()))
+        elif b'"stream": true' in body or b'"stream":true' in body:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\n"
+                b"transfer-encoding: chunked\r\n\r\n"
+            )
+            for _ in range(self.chunks):
+                writer.write(b"%x\r\n%s\r\n" % (len(self._chunk), self._chunk))
+                if self.chunk_delay:
+                    await writer.drain()
+                    await asyncio.sleep(self.chunk_delay)
+            tail = (self._usage_chunk if b"include_usage" in body else b"") + b"data: [DONE]\n\n"
+            writer.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(tail), tail))
+        elif path.endswith("/completions"):
+            writer.write(_http_response(200, self._completion))
+        else:
+            writer.write(_http_response(404, b'{"error": {"message": "not found"}}'))
+
+class StubIngest(StubServer):
+    """Telemetry endpoint whose behaviour follows a timed script
+
+    Each phase is a dict with `seconds` and optionally `latency` (seconds
+    before answering), `error_rate` (share of batches answered 503) and
+    `down` (new connections refused, open ones dropped). The script starts
+    at wall-clock time `start` and its last phase holds once it ends.
+    Records in accepted batches are counted in the shared `accepted` value.
+    """
+
+    def __init__(self, script: List[Dict[str, Any]], start: float):
+        self.script = script
+        self.start = start
+        self.accepted = multiprocessing.RawValue("q", 0)
+        self.batches = multiprocessing.RawValue("q", 0)
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    def phase(self, now: float) -> Dict[str, Any]:
+        elapsed = now - self.start
+        for phase in self.script:
+            if elapsed < phase["seconds"]:
+                return phase
+            elapsed -= phase["seconds"]
+        return self.script[-1] if self.script else {}
+
+    async def handle(self, path: str, body: bytes, writer: asyncio.StreamWriter) -> None:
+        phase = self.phase(time.time())
+        if phase.get("latency"):
+            await asyncio.sleep(phase["latency"])
+        if random.random() < phase.get("error_rate", 0.0):
+            writer.write(_http_response(503, b'{"error": "unavailable"}'))
+            return
+        self.accepted.value += body.count(b'"request_id"')
+        self.batches.value += 1
+        writer.write(_http_response(200, b'{"ok": true}'))
+
+    async def _track(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            await self._serve_connection(reader, writer)
+        finally:
+            self._writers.discard(writer)
+
+    async def serve(self, port: int, ready: Optional[Any] = None):
+        server = None
+        while True:
+            down = self.phase(time.time()).get("down", False)
+            if down and server is not None:
+                server.close()
+                server = None
+                for writer in list(self._writers):
+                    writer.transport.abort()
+            elif not down and server is None:
+                server = await asyncio.start_server(self._track, "127.0.0.1", port, backlog=4096)
+            if ready is not None:
+                ready.set()
+                ready = None
+            await asyncio.sleep(0.02)
+
+def _run_stub(stub: StubServer, port: int, ready: Any):
+    try:
+        asyncio.run(stub.serve(port, ready))
+    except KeyboardInterrupt:
+        pass
+
+def start_in_process(stub: StubServer, port: Optional[int] = None, timeout: float = 10.0) -> Tuple[multiprocessing.Process, int]:
+    """Run a stub's serve() in a daemon process; returns (process, port) once it is listening"""
+    port = port or free_port()
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=_run_stub, args=(stub, port, ready), daemon=True)
+    process.start()
+    if not ready.wait(timeout):
+        process.terminate()
+        raise RuntimeError("Stub server did not start")
+    return process, port
+
+def payload(stream: bool = False, model: str = STUB_MODEL, content: str = "Say hello in one short sentence.") -> Dict[str, Any]:
+    """A small chat completion request body"""
+    body: Dict[str, Any] = {"model": model, "messages": [{"role": "user", "content": content}]}
+    if stream:
+        body["stream"] = True
+    return body
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Telemetry Load Test - how the SDK's telemetry path degrades under ingest trouble
+Drives sync threads and asyncio coroutines through tracked OpenAI clients
+against a stub LLM backend while a stub ingest server follows a script of
+healthy, slow, erroring and down phases. Samples shipped records, the
+in-memory queue, the offline queue and its disk size over time, and reports
+per-phase added caller latency (against an untracked baseline run),
+records/sec shipped, peak backlog, and how long the backlog takes to drain
+once ingest recovers. The report can be saved as, or checked against, a
+stored baseline; latency and throughput are checked as ratios to the same
+run's untracked calls so a baseline holds on other machines.
+Usage: python benchmarks/telemetry_load.py [--baseline benchmarks/telemetry_baseline.json] [--save-baseline]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import StubIngest, StubUpstream, payload, start_in_process
+
+import openai
+from meterr import MeterrClient
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "telemetry_baseline.json")
+
+DEFAULT_SCENARIO = [
+    {"name": "healthy", "seconds": 5},
+    {"name": "slow", "seconds": 5, "latency": 0.5},
+    {"name": "flaky", "seconds": 5, "error_rate": 0.3},
+    {"name": "outage", "seconds": 10, "down": True},
+    {"name": "recovery", "seconds": 10},
+]
+
+# Report values compared against the baseline: (path, better direction, absolute slack)
+CHECKS = [
+    ("phases.*.p50_ratio", "lower", 0.05),
+    ("phases.*.p99_ratio", "lower", 0.1),
+    ("phases.healthy.shipped_ratio", "higher", 0.05),
+    ("phases.recovery.shipped_ratio", "higher", 0.05),
+    ("drain_after_recovery_s", "lower", 1.0),
+    ("final_drain_s", "lower", 1.0),
+    ("records.lost", "lower", 0.0),
+]
+
+SAMPLE_INTERVAL = 0.25
+WARMUP = 1.0
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of unsorted values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+def _disk_bytes(db_path: str) -> int:
+    return sum(os.path.getsize(p) for p in (db_path, db_path + "-wal", db_path + "-journal") if os.path.exists(p))
+
+class LoadRun:
+    """Sync worker threads plus coroutines on one event-loop thread, all calling chat completions
+
+    Each finished call appends (start offset from `t0`, latency) to `calls`
+    and each failed one counts in `failures`; calls started before `t0` warm
+    the clients and have negative offsets.
+    """
+
+    def __init__(self, sync_client: Any, async_client: Any, threads: int, coroutines: int, t0: float):
+        self.sync_client = sync_client
+        self.async_client = async_client
+        self.threads = threads
+        self.coroutines = coroutines
+        self.t0 = t0
+        self.calls: List[Tuple[float, float]] = []
+        self.failures = 0
+        self._failures_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._workers: List[threading.Thread] = []
+
+    def attempted(self) -> int:
+        """Calls made so far; a tracked client records failed calls too"""
+        return len(self.calls) + self.failures
+
+    def _failed(self):
+        with self._failures_lock:
+            self.failures += 1
+
+    def _sync_worker(self):
+        body = payload()
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.sync_client.chat.completions.create(**body)
+            except openai.OpenAIError:
+                self._failed()
+                continue
+            self.calls.append((started - self.t0, time.time() - started))
+
+    async def _async_worker(self):
+        body = payload()
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                await self.async_client.chat.completions.create(**body)
+            except openai.OpenAIError:
+                self._failed()
+                continue
+            self.calls.append((started - self.t0, time.time() - started))
+
+    def _event_loop(self):
+        async def main():
+            await asyncio.gather(*(self._async_worker() for _ in range(self.coroutines)))
+        asyncio.run(main())
+
+    def start(self):
+        self._workers = [threading.Thread(target=self._sync_worker, daemon=True) for _ in range(self.threads)]
+        if self.coroutines:
+            self._workers.append(threading.Thread(target=self._event_loop, daemon=True))
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        self._stop.set()
+        for worker in self._workers:
+            worker.join(30)
+
+class Sampler:
+    """Background sampling of shipped records, queue depths and offline-queue disk size"""
+
+    def __init__(self, meterr: MeterrClient, ingest: StubIngest, produced: Callable[[], int], t0: float):
+        self.meterr = meterr
+        self.ingest = ingest
+        self.produced = produced
+        self.t0 = t0
+        self.samples: List[Dict[str, float]] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self) -> Dict[str, float]:
+        sample = {
+            "t": time.time() - self.t0,
+            "produced": self.produced(),
+            "shipped": self.ingest.accepted.value,
+            "queue_depth": self.meterr.batcher.queue_depth(),
+            "offline_rows": self.meterr.offline_queue.size(),
+            "disk_bytes": _disk_bytes(self.meterr.offline_queue.db_path),
+        }
+        self.samples.append(sample)
+        return sample
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self.sample()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+def _phase_bounds(scenario: List[Dict[str, Any]]) -> List[Tuple[str, float, float]]:
+    bounds, start = [], 0.0
+    for i, phase in enumerate(scenario):
+        bounds.append((phase.get("name", f"phase{i}"), start, start + phase["seconds"]))
+        start += phase["seconds"]
+    return bounds
+
+def summarize(
+    scenario: List[Dict[str, Any]],
+    baseline_calls: List[Tuple[float, float]],
+    calls: List[Tuple[float, float]],
+    samples: List[Dict[str, float]],
+    drain_after_recovery: Optional[float],
+    final_drain: Optional[float],
+    initial_disk: int
+) -> Dict[str, Any]:
+    base = [latency * 1000 for offset, latency in baseline_calls if offset >= 0]
+    base_p50, base_p99 = percentile(base, 50), percentile(base, 99)
+
+    phases = {}
+    for name, start, end in _phase_bounds(scenario):
+        latencies = [latency * 1000 for offset, latency in calls if start <= offset < end]
+        window = [s for s in samples if start <= s["t"] < end]
+        shipped = (window[-1]["shipped"] - window[0]["shipped"]) / max(window[-1]["t"] - window[0]["t"], 1e-9) if len(window) > 1 else 0.0
+        calls_per_s = len(latencies) / (end - start)
+        p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+        phases[name] = {
+            "calls_per_s": calls_per_s,
+            "p50_ms": p50,
+            "p99_ms": p99,
+            "added_p50_ms": p50 - base_p50,
+            "added_p99_ms": p99 - base_p99,
+            "p50_ratio": p50 / base_p50 if base_p50 else 0.0,
+            "p99_ratio": p99 / base_p99 if base_p99 else 0.0,
+            "shipped_per_s": shipped,
+            # Above 1 while a backlog is catching up, below it while one builds
+            "shipped_ratio": shipped / calls_per_s if calls_per_s else 0.0,
+            "max_queue_depth": max((s["queue_depth"] for s in window), default=0),
+            "max_offline_rows": max((s["offline_rows"] for s in window), default=0),
+            "max_disk_bytes": max((s["disk_bytes"] for s in window), default=0),
+        }
+
+    last = samples[-1] if samples else {"produced": 0, "shipped": 0, "disk_bytes": initial_disk}
+    return {
+        "baseline": {"calls": len(base), "p50_ms": base_p50, "p99_ms": base_p99},
+        "phases": phases,
+        "drain_after_recovery_s": drain_after_recovery,
+        "final_drain_s": final_drain,
+        "disk_growth_bytes": max((s["disk_bytes"] for s in samples), default=initial_disk) - initial_disk,
+        "records": {
+            "produced": last["produced"],
+            "shipped": last["shipped"],
+            "lost": max(0, last["produced"] - last["shipped"]),
+            "duplicated": max(0, last["shipped"] - last["produced"]),
+        },
+    }
+
+def _drained(sample: Dict[str, float]) -> bool:
+    return sample["offline_rows"] == 0 and sample["queue_depth"] == 0 and sample["shipped"] >= sample["produced"]
+
+def benchmark(args: argparse.Namespace, scenario: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Dict[str, float]]]:
+    llm_process, llm_port = start_in_process(StubUpstream(latency=args.llm_latency))
+    base_url = f"http://127.0.0.1:{llm_port}/v1"
+
+    def clients():
+        return (
+            openai.OpenAI(api_key="sk-bench", base_url=base_url, max_retries=0),
+            openai.AsyncOpenAI(api_key="sk-bench", base_url=base_url, max_retries=0),
+        )
+
+    # Untracked run for the latency the caller would see without Meterr
+    baseline = LoadRun(*clients(), args.threads, args.coroutines, time.time() + WARMUP)
+    baseline.start()
+    time.sleep(WARMUP + args.baseline_seconds)
+    baseline.stop()
+
+    t0 = time.time() + WARMUP
+    ingest = StubIngest(scenario, t0)
+    ingest_process, ingest_port = start_in_process(ingest)
+
+    offline_db = os.path.join(tempfile.mkdtemp(), "queue.db")
+    meterr = MeterrClient(
+        api_key="mk-bench",
+        endpoint=f"http://127.0.0.1:{ingest_port}/sdk/usage",
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+        offline_db=offline_db
+    )
+    sync_client, async_client = clients()
+    run = LoadRun(meterr.track_costs(sync_client, team="bench"), meterr.track_costs(async_client, team="bench"),
+                  args.threads, args.coroutines, t0)
+    sampler = Sampler(meterr, ingest, run.attempted, t0)
+    initial_disk = _disk_bytes(offline_db)
+
+    try:
+        run.start()
+        time.sleep(max(0.0, t0 - time.time()))
+        sampler.start()
+        total = sum(phase["seconds"] for phase in scenario)
+        time.sleep(max(0.0, t0 + total - time.time()))
+        run.stop()
+
+        # Load is off; give the backlog up to drain_timeout to reach ingest
+        stopped = time.time() - t0
+        final_drain = None
+        while time.time() - t0 - stopped < args.drain_timeout:
+            if _drained(sampler.samples[-1] if sampler.samples else sampler.sample()) and sampler.samples[-1]["t"] > stopped:
+                final_drain = sampler.samples[-1]["t"] - stopped
+                break
+            time.sleep(SAMPLE_INTERVAL)
+        sampler.stop()
+    finally:
+        meterr.close()
+        ingest_process.terminate()
+        llm_process.terminate()
+
+    # Recovery starts where the last outage phase ends; the drain may finish after load stops
+    drain_after_recovery = None
+    outages = [end for (name, _, end), phase in zip(_phase_bounds(scenario), scenario) if phase.get("down")]
+    if outages:
+        for sample in sampler.samples:
+            if sample["t"] >= outages[-1] and sample["offline_rows"] == 0:
+                drain_after_recovery = sample["t"] - outages[-1]
+                break
+
+    report = summarize(scenario, baseline.calls, run.calls, sampler.samples, drain_after_recovery, final_drain, initial_disk)
+    report["config"] = {
+        "threads": args.threads, "coroutines": args.coroutines, "llm_latency_s": args.llm_latency,
+        "batch_size": args.batch_size, "flush_interval_s": args.flush_interval,
+    }
+    return report, sampler.samples
+
+def _lookup(report: Dict[str, Any], path: str) -> List[Tuple[str, Any]]:
+    """Values at a dotted path; `*` matches every key at that level"""
+    found = [("", report)]
+    for part in path.split("."):
+        step = []
+        for prefix, node in found:
+            if not isinstance(node, dict):
+                continue
+            keys = list(node) if part == "*" else [part]
+            step += [(f"{prefix}.{k}".lstrip("."), node[k]) for k in keys if k in node]
+        found = step
+    return found
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions beyond `tolerance` (relative) plus each check's absolute slack"""
+    failures = []
+    for path, better, slack in CHECKS:
+        current = dict(_lookup(report, path))
+        for key, expected in _lookup(baseline, path):
+            actual = current.get(key)
+            if expected is None:
+                continue
+            if actual is None:
+                failures.append(f"{key}: baseline {expected:.2f}, now never reached")
+                continue
+            if better == "lower":
+                limit = expected + abs(expected) * tolerance + slack
+                if actual > limit:
+                    failures.append(f"{key}: {actual:.2f} > {limit:.2f} (baseline {expected:.2f})")
+            else:
+                limit = expected - abs(expected) * tolerance - slack
+                if actual < limit:
+                    failures.append(f"{key}: {actual:.2f} < {limit:.2f} (baseline {expected:.2f})")
+    return failures
+
+def _seconds(value: Optional[float]) -> str:
+    return f"{value:.2f}s" if value is not None else "not drained"
+
+def print_report(report: Dict[str, Any]):
+    base = report["baseline"]
+    print(f"\nBaseline (untracked): p50 {base['p50_ms']:.2f} ms, p99 {base['p99_ms']:.2f} ms over {base['calls']} calls")
+    print(f"{'phase':10} {'calls/s':>8} {'+p50 ms':>8} {'+p99 ms':>8} {'p99 x':>6} {'shipped/s':>10} {'queue':>7} {'offline':>8} {'disk KB':>8}")
+    for name, p in report["phases"].items():
+        print(
+            f"{name:10} {p['calls_per_s']:8.0f} {p['added_p50_ms']:+8.2f} {p['added_p99_ms']:+8.2f} {p['p99_ratio']:6.2f} "
+            f"{p['shipped_per_s']:10.0f} {p['max_queue_depth']:7.0f} {p['max_offline_rows']:8.0f} {p['max_disk_bytes'] / 1024:8.0f}"
+        )
+    records = report["records"]
+    print(f"\nDrain after recovery: {_seconds(report['drain_after_recovery_s'])}, after load stopped: {_seconds(report['final_drain_s'])}")
+    print(f"Offline queue disk growth: {report['disk_growth_bytes'] / 1024:.0f} KB")
+    print(f"Records: {records['produced']} produced, {records['shipped']} shipped, {records['lost']} lost, {records['duplicated']} duplicated")
+
+def main():
+    parser = argparse.ArgumentParser(description='SDK telemetry load and outage benchmark')
+    parser.add_argument('--threads', type=int, default=8, help='Sync worker threads')
+    parser.add_argument('--coroutines', type=int, default=32, help='Async workers on one event loop')
+    parser.add_argument('--llm-latency', type=float, default=0.02, help='Stub LLM response time in seconds')
+    parser.add_argument('--batch-size', type=int, default=100, help='Telemetry batch size')
+    parser.add_argument('--flush-interval', type=float, default=1.0, help='Telemetry flush interval in seconds')
+    parser.add_argument('--baseline-seconds', type=float, default=5.0, help='Length of the untracked baseline run')
+    parser.add_argument('--drain-timeout', type=float, default=60.0, help='Seconds to wait for the backlog after load stops')
+    parser.add_argument('--scenario', type=str, default=None, help='JSON file with a list of ingest phases')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='Multiply every phase length')
+    parser.add_argument('--timeline', type=str, default=None, help='Write sampled queue/ship timeline as JSON lines')
+    parser.add_argument('--json', type=str, default=None, help='Write the report to this file')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE, help='Stored baseline report')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative regression against the baseline')
+
+    args = parser.parse_args()
+    # Rejected and failed batches are the point of the exercise
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("meterr").setLevel(logging.ERROR)
+
+    scenario = DEFAULT_SCENARIO
+    if args.scenario:
+        with open(args.scenario) as f:
+            scenario = json.load(f)
+    scenario = [dict(phase, seconds=phase["seconds"] * args.time_scale) for phase in scenario]
+
+    report, timeline = benchmark(args, scenario)
+    print_report(report)
+
+    if args.timeline:
+        with open(args.timeline, 'w') as f:
+            for sample in timeline:
+                f.write(json.dumps(sample) + "\n")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            failures = compare(report, json.load(f), args.tolerance)
+        if failures:
+            print(f"\nRegressions against {args.baseline}:")
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,33 @@
-```python
 """
 Meterr.ai Python SDK
 A drop-in replacement for OpenAI SDK with automatic cost tracking and analytics
 """
 
 import os
+import copy
 import json
 import time
+import uuid
 import queue
+import bisect
+import atexit
+import socket
 import sqlite3
 import hashlib
 import asyncio
+import inspect
+import itertools
 import threading
 import functools
-from typing import Dict, Any, Optional, List, Union, Callable
-from datetime import datetime, timedelta
+import importlib
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Dict, Any, Optional, List, Union, Callable, Tuple
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
 from dataclasses import dataclass, asdict
 from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import logging
 
 try:
@@ -64,6 +75,65 @@ MODEL_COSTS = {
     "text-embedding-3-large": {"input": 0.00013, "output": 0},
 }
 
+# Per-request limits of embedding models: inputs per request, tokens summed over
+# the inputs, and tokens in any one input
+DEFAULT_EMBEDDING_LIMITS = {"max_inputs": 2048, "max_tokens": 300000, "max_input_tokens": 8191}
+EMBEDDING_LIMITS = {
+    "text-embedding-ada-002": DEFAULT_EMBEDDING_LIMITS,
+    "text-embedding-3-small": DEFAULT_EMBEDDING_LIMITS,
+    "text-embedding-3-large": DEFAULT_EMBEDDING_LIMITS,
+}
+
+# Meterr ingest endpoint for batched usage records
+DEFAULT_ENDPOINT = os.getenv("METERR_ENDPOINT", "https://api.meterr.ai/sdk/usage")
+
+# Client methods that are metered, by attribute path, and the endpoint they are recorded under
+TRACKED_METHODS = {
+    "chat.completions.create": "chat.completions",
+    "completions.create": "completions",
+    "embeddings.create": "embeddings",
+    "messages.create": "messages",
+}
+_TRACKED_PREFIXES = {
+    ".".join(path.split(".")[:i])
+    for path in TRACKED_METHODS
+    for i in range(1, path.count(".") + 1)
+}
+
+# Output tokens assumed by pre-flight estimates when a call sets no max_tokens
+DEFAULT_OUTPUT_ESTIMATE = 256
+
+# Slots per rolling spend window; spend expires one slot at a time
+WINDOW_SLOTS = 60
+
+# Request fields that never change the response and are left out of cache keys
+NON_SEMANTIC_FIELDS = {"timeout", "extra_headers", "extra_query"}
+
+# Response types the cache rebuilds from stored JSON; anything else comes back as a dict
+CACHEABLE_RESPONSE_TYPES = frozenset({
+    "openai.types.chat.chat_completion:ChatCompletion",
+    "openai.types.chat.chat_completion_chunk:ChatCompletionChunk",
+    "openai.types.completion:Completion",
+    "openai.types.create_embedding_response:CreateEmbeddingResponse",
+    "anthropic.types.message:Message",
+    "anthropic.types.raw_message_start_event:RawMessageStartEvent",
+    "anthropic.types.raw_message_delta_event:RawMessageDeltaEvent",
+    "anthropic.types.raw_message_stop_event:RawMessageStopEvent",
+    "anthropic.types.raw_content_block_start_event:RawContentBlockStartEvent",
+    "anthropic.types.raw_content_block_delta_event:RawContentBlockDeltaEvent",
+    "anthropic.types.raw_content_block_stop_event:RawContentBlockStopEvent",
+})
+
+# UsageRecord status for a response served from the response cache (cost is 0)
+CACHE_HIT_STATUS = "cache_hit"
+
+# UsageRecord status for a request that shared another caller's upstream call (cost is 0)
+COALESCED_STATUS = "coalesced"
+
+# Histogram upper bounds for call latency (seconds) and tokens per call
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 262144)
+
 @dataclass
 class UsageRecord:
     """Represents a single API usage record"""
@@ -97,7 +167,11 @@ class TokenCounter:
                 else:
                     cls._encoders[model] = tiktoken.get_encoding("cl100k_base")
             except Exception:
-                cls._encoders[model] = tiktoken.get_encoding("cl100k_base")
+                try:
+                    cls._encoders[model] = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    # Remember the failure so later calls fall back without retrying the download
+                    cls._encoders[model] = None
         return cls._encoders[model]
     
     @classmethod
@@ -105,14 +179,32 @@ class TokenCounter:
         """Count tokens in text for given model"""
         try:
             encoder = cls.get_encoder(model)
+            if encoder is None:
+                return cls.estimate_tokens(text)
             return len(encoder.encode(text))
         except Exception as e:
-            # Fallback: estimate 1 token per 4 characters
-            return len(text) // 4
+            return cls.estimate_tokens(text)
+
+    @classmethod
+    def count_tokens_batch(cls, texts: List[str], model: str = "gpt-3.5-turbo") -> List[int]:
+        """Count tokens in many texts at once; tiktoken encodes them on several threads"""
+        encoder = cls.get_encoder(model)
+        if encoder is not None:
+            try:
+                return [len(tokens) for tokens in encoder.encode_ordinary_batch(texts)]
+            except Exception:
+                pass
+        return [cls.estimate_tokens(text) for text in texts]
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Fast estimate without an encoder: 1 token per 4 characters"""
+        return len(text) // 4
 
     @classmethod
-    def count_messages_tokens(cls, messages: List[Dict], model: str = "gpt-3.5-turbo") -> int:
-        """Count tokens in chat messages"""
+    def count_messages_tokens(cls, messages: List[Dict], model: str = "gpt-3.5-turbo", exact: bool = True) -> int:
+        """Count tokens in chat messages; `exact=False` uses estimate_tokens instead of encoding"""
+        count = cls.count_tokens if exact else (lambda text, model: cls.estimate_tokens(text))
         total = 0
         for message in messages:
             # Each message has overhead tokens
@@ -120,16 +212,16 @@ class TokenCounter:
             
             if isinstance(message, dict):
                 if "role" in message:
-                    total += cls.count_tokens(message["role"], model)
+                    total += count(message["role"], model)
                 if "content" in message:
                     if isinstance(message["content"], str):
-                        total += cls.count_tokens(message["content"], model)
+                        total += count(message["content"], model)
                     elif isinstance(message["content"], list):
                         for item in message["content"]:
                             if isinstance(item, dict) and "text" in item:
-                                total += cls.count_tokens(item["text"], model)
+                                total += count(item["text"], model)
                 if "name" in message:
-                    total += cls.count_tokens(message["name"], model)
+                    total += count(message["name"], model)
                     
         total += 2  # reply overhead
         return total
@@ -156,10 +248,16 @@ class OfflineQueue:
     
     def add(self, record: UsageRecord):
         """Add record to queue"""
+        self.add_many([record])
+
+    def add_many(self, records: List[UsageRecord]):
+        """Add records to queue in one transaction"""
+        if not records:
+            return
         with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
+            conn.executemany(
                 "INSERT INTO queue (data) VALUES (?)",
-                (json.dumps(asdict(record)),)
+                [(json.dumps(asdict(record)),) for record in records]
             )
             conn.commit()
     
@@ -181,6 +279,11 @@ class OfflineQueue:
             conn.execute(f"DELETE FROM queue WHERE id IN ({placeholders})", ids)
             conn.commit()
     
+    def size(self) -> int:
+        """Number of records waiting to be retried"""
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+
     def update_retry(self, id: int):
         """Update retry count for failed record"""
         with sqlite3.connect(self.db_path) as conn:
@@ -190,5 +293,2230 @@ class OfflineQueue:
             )
             conn.commit()
 
+
 class TelemetryBatcher:
-    
\ No newline at end of file
+    """Buffers usage records and ships them to the Meterr API from a background thread
+
+    Records are sent every `flush_interval` seconds or once `batch_size` are
+    waiting, whichever comes first. Batches that cannot be delivered (or that
+    overflow the in-memory buffer) go to the OfflineQueue; one queued batch is
+    retried after each live batch, so a backlog drains even under steady load.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        endpoint: str = DEFAULT_ENDPOINT,
+        batch_size: int = 100,
+        flush_interval: float = 5.0,
+        offline_queue: Optional[OfflineQueue] = None,
+        max_buffer: int = 10000,
+        timeout: float = 10.0
+    ):
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.offline_queue = offline_queue or OfflineQueue()
+
+        self._buffer: "queue.Queue[UsageRecord]" = queue.Queue(maxsize=max_buffer)
+        self._http = httpx.Client(timeout=timeout)
+        self._stop = threading.Event()
+        self._retry_after = 0.0
+        self._thread = threading.Thread(target=self._run, name="meterr-telemetry", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, record: UsageRecord):
+        """Queue a record without blocking the caller"""
+        try:
+            self._buffer.put_nowait(record)
+        except queue.Full:
+            self.offline_queue.add(record)
+
+    def queue_depth(self) -> int:
+        """Records buffered in memory that have not been shipped or queued offline"""
+        return self._buffer.unfinished_tasks
+
+    def _next_batch(self) -> List[UsageRecord]:
+        """Wait up to flush_interval for records, returning at most batch_size"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self._buffer.get(timeout=min(remaining, 0.5)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _send(self, payload: List[Dict[str, Any]]) -> bool:
+        """POST one batch; False means the caller should keep the records"""
+        try:
+            response = self._http.post(
+                self.endpoint,
+                json={"records": payload},
+                headers={"Authorization": f"Bearer {self.api_key}"}
+            )
+            if response.status_code < 300:
+                return True
+            logger.warning(f"Telemetry rejected with HTTP {response.status_code}")
+        except httpx.HTTPError as e:
+            logger.debug(f"Telemetry send failed: {e}")
+        return False
+
+    def _ship(self, batch: List[UsageRecord]):
+        try:
+            if self._send([asdict(r) for r in batch]):
+                # The API is reachable again; start on the backlog right away
+                self._retry_after = 0.0
+            else:
+                self.offline_queue.add_many(batch)
+                self._back_off()
+        finally:
+            for _ in batch:
+                self._buffer.task_done()
+
+    def _retry_offline(self):
+        """Resend one batch of queued records, backing off while the API is unreachable"""
+        if time.monotonic() < self._retry_after:
+            return
+        rows = self.offline_queue.get_batch(self.batch_size)
+        if not rows:
+            return
+        if self._send([json.loads(data) for _, data in rows]):
+            self.offline_queue.remove([row_id for row_id, _ in rows])
+            self._retry_after = 0.0
+        else:
+            for row_id, _ in rows:
+                self.offline_queue.update_retry(row_id)
+            self._back_off()
+
+    def _back_off(self):
+        """Hold off offline retries after a failed send"""
+        self._retry_after = time.monotonic() + min(300.0, self.flush_interval * 6)
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._ship(batch)
+            try:
+                self._retry_offline()
+            except sqlite3.Error as e:
+                logger.debug(f"Offline queue retry failed: {e}")
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Block until buffered records have been shipped or queued offline"""
+        deadline = time.monotonic() + timeout
+        while self._buffer.unfinished_tasks:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self):
+        """Flush and stop the background thread; remaining records go offline"""
+        if self._stop.is_set():
+            return
+        self.flush()
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 1)
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        self.offline_queue.add_many(remaining)
+        self._http.close()
+
+@functools.lru_cache(maxsize=1024)
+def model_costs(model: str) -> Optional[Dict[str, float]]:
+    """Per-1K pricing for a model, matching dated or versioned names by longest prefix"""
+    if model in MODEL_COSTS:
+        return MODEL_COSTS[model]
+    matches = [name for name in MODEL_COSTS if model.startswith(name)]
+    if not matches:
+        return None
+    return MODEL_COSTS[max(matches, key=len)]
+
+def calculate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """Cost in USD of a call; unknown models cost 0"""
+    costs = model_costs(model)
+    if costs is None:
+        return 0.0
+    return input_tokens / 1000 * costs["input"] + output_tokens / 1000 * costs["output"]
+
+def _field(obj: Any, name: str, default: Any = None) -> Any:
+    """Read a field from an SDK response object or a plain dict"""
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+def extract_usage(response: Any) -> Optional[Tuple[int, int]]:
+    """(input, output) tokens reported by an OpenAI- or Anthropic-style response"""
+    usage = _field(response, "usage")
+    if usage is None:
+        return None
+    input_tokens = _field(usage, "prompt_tokens")
+    if input_tokens is None:
+        input_tokens = _field(usage, "input_tokens", 0)
+    output_tokens = _field(usage, "completion_tokens")
+    if output_tokens is None:
+        output_tokens = _field(usage, "output_tokens", 0)
+    return int(input_tokens or 0), int(output_tokens or 0)
+
+def estimate_input_tokens(request: Dict[str, Any], model: str, exact: bool = True) -> int:
+    """Prompt tokens of a request, counted locally with TokenCounter
+
+    `exact=False` uses the length-based estimate instead of encoding the
+    prompt, which keeps the budget pre-flight in microseconds.
+    """
+    count = TokenCounter.count_tokens if exact else (lambda text, model: TokenCounter.estimate_tokens(text))
+    total = 0
+    if isinstance(request.get("system"), str):
+        total += count(request["system"], model)
+    if "messages" in request:
+        return total + TokenCounter.count_messages_tokens(request["messages"], model, exact=exact)
+
+    prompt = request.get("prompt", request.get("input"))
+    if isinstance(prompt, str):
+        prompt = [prompt]
+    if isinstance(prompt, list):
+        total += sum(count(p, model) for p in prompt if isinstance(p, str))
+    return total
+
+def _chunk_text(chunk: Any) -> str:
+    """Text carried by one streamed chunk (OpenAI chat/completions or Anthropic events)"""
+    choices = _field(chunk, "choices")
+    if choices:
+        choice = choices[0]
+        delta = _field(choice, "delta")
+        if delta is not None:
+            return _field(delta, "content") or ""
+        return _field(choice, "text") or ""
+    delta = _field(chunk, "delta")
+    if delta is not None:
+        return _field(delta, "text") or ""
+    return ""
+
+class _StreamMeter:
+    """Accumulates streamed text and any usage the provider reports mid-stream"""
+
+    __slots__ = ("parts", "input_tokens", "output_tokens", "response_id", "chunks")
+
+    def __init__(self, keep_chunks: bool = False):
+        self.parts: List[str] = []
+        self.input_tokens: Optional[int] = None
+        self.output_tokens: Optional[int] = None
+        self.response_id: Optional[str] = None
+        self.chunks: Optional[List[Any]] = [] if keep_chunks else None
+
+    def feed(self, chunk: Any):
+        if self.chunks is not None:
+            self.chunks.append(chunk)
+        text = _chunk_text(chunk)
+        if text:
+            self.parts.append(text)
+        if self.response_id is None:
+            self.response_id = _field(chunk, "id") or _field(_field(chunk, "message"), "id")
+
+        usage = _field(chunk, "usage") or _field(_field(chunk, "message"), "usage")
+        if usage is not None:
+            input_tokens = _field(usage, "prompt_tokens", _field(usage, "input_tokens"))
+            output_tokens = _field(usage, "completion_tokens", _field(usage, "output_tokens"))
+            if input_tokens:
+                self.input_tokens = int(input_tokens)
+            if output_tokens:
+                self.output_tokens = int(output_tokens)
+
+class _Call:
+    """Per-request state carried from pre-flight to the final UsageRecord"""
+
+    __slots__ = (
+        "endpoint", "model", "request", "scope", "started", "finished", "reservation", "estimated_input", "cache_key"
+    )
+
+    def __init__(self, endpoint: str, request: Dict[str, Any], scope: "_Scope"):
+        self.endpoint = endpoint
+        self.model = str(request.get("model", "unknown"))
+        self.request = request
+        self.scope = scope
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.reservation: Optional["Reservation"] = None
+        self.estimated_input: Optional[int] = None
+        self.cache_key: Optional[str] = None
+
+    @property
+    def stream(self) -> bool:
+        return bool(self.request.get("stream"))
+
+    def input_estimate(self) -> int:
+        if self.estimated_input is None:
+            self.estimated_input = estimate_input_tokens(self.request, self.model)
+        return self.estimated_input
+
+class MeteredStream:
+    """Passes a provider stream through unchanged and records usage when it ends
+
+    Works for both sync and async streams. The record is written once, when
+    the stream is exhausted, fails, or is closed early by the caller; only
+    streams read to the end are cached.
+    """
+
+    def __init__(self, stream: Any, meterr: "MeterrClient", call: _Call):
+        self._stream = stream
+        self._meterr = meterr
+        self._call = call
+        self._meter = _StreamMeter(keep_chunks=call.cache_key is not None)
+        self._exhausted = False
+        self._done = False
+        self.record: Optional[UsageRecord] = None
+
+    def _finish(self, error: Optional[BaseException] = None):
+        if self._done:
+            return
+        self._done = True
+        if error is not None and not isinstance(error, GeneratorExit):
+            self.record = self._meterr._fail(self._call, error)
+        else:
+            self.record = self._meterr._complete_stream(self._call, self._meter, self._exhausted)
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                self._meter.feed(chunk)
+                yield chunk
+        except BaseException as e:
+            self._finish(e)
+            raise
+        self._exhausted = True
+        self._finish()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                self._meter.feed(chunk)
+                yield chunk
+        except BaseException as e:
+            self._finish(e)
+            raise
+        self._exhausted = True
+        self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        self._finish()
+
+    def close(self):
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+        self._finish()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+class _FlightAbandoned(RuntimeError):
+    """A coalesced call stopped because a reader was interrupted, not because the call failed"""
+
+    def __init__(self, sent: int):
+        super().__init__(f"coalesced call was interrupted after {sent} chunks")
+        self.sent = sent
+
+class _Flight:
+    """One upstream call shared by identical concurrent requests from threads
+
+    A non-streamed result is handed over with finish(). A stream is attached
+    to the flight and every reader, leader included, replays its chunks from
+    the start; a reader that runs out pulls the next chunk from upstream
+    itself. The stream advances whichever reader is active, so followers
+    never wait on a leader that stops reading or shares their thread.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks: List[Any] = []
+        self.done = False
+        self.abandoned = False
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.usage: Tuple[int, int] = (0, 0)
+        self.followers = 0
+        # Readers that stopped early, and whether new callers can still join
+        self.left = 0
+        self.released = False
+        self.stream: Optional[MeteredStream] = None
+        self._source: Any = None
+        self._release: Optional[Callable[[], int]] = None
+        self._pulling = threading.Lock()
+
+    def attach(self, stream: MeteredStream, release: Callable[[], int]):
+        with self.cond:
+            self.stream = stream
+            self._source = iter(stream)
+            self._release = release
+            self.cond.notify_all()
+
+    def release(self) -> int:
+        """Stop new callers joining; returns how many followers the flight has"""
+        followers = self._release()
+        with self.cond:
+            self.released = True
+        return followers
+
+    def publish(self, chunk: Any):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, result: Any = None, usage: Tuple[int, int] = (0, 0), error: Optional[BaseException] = None):
+        with self.cond:
+            self.result = result
+            self.usage = usage
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+    def abandon(self):
+        """End the flight without a result; followers send their own requests"""
+        with self.cond:
+            self.abandoned = True
+            self.done = True
+            self.cond.notify_all()
+
+    def wait(self) -> Any:
+        with self.cond:
+            self.cond.wait_for(lambda: self.done)
+        if self.abandoned:
+            raise _FlightAbandoned(0)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _end(self, error: Optional[BaseException] = None):
+        """Finish a stream flight with the usage its upstream recorded"""
+        self.release()
+        record = self.stream.record
+        usage = (record.input_tokens, record.output_tokens) if record is not None else (0, 0)
+        self.finish(usage=usage, error=error)
+
+    def pull(self, sent: int):
+        """Read the next chunk from upstream unless another reader already has"""
+        with self._pulling:
+            if sent < len(self.chunks) or self.done:
+                return
+            try:
+                chunk = next(self._source)
+            except StopIteration:
+                self._end()
+            except Exception as e:
+                self._end(e)
+            except BaseException:
+                # Interrupted, not failed: the other readers send their own requests
+                self.release()
+                self.abandon()
+                raise
+            else:
+                self.publish(chunk)
+
+    def follow(self):
+        sent = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self._source is not None or self.done)
+                batch = self.chunks[sent:]
+                done = self.done
+            if batch:
+                sent += len(batch)
+                yield from batch
+            elif not done:
+                self.pull(sent)
+            elif self.abandoned:
+                raise _FlightAbandoned(sent)
+            elif self.error is not None:
+                raise self.error
+            else:
+                return
+
+    def leave(self):
+        """A reader stopped early; close upstream once every reader has"""
+        with self.cond:
+            self.left += 1
+            last = self.released and self.left > self.followers
+        if last:
+            self.close()
+
+    def close(self):
+        """Close the upstream stream, ending the flight with whatever was read"""
+        with self._pulling:
+            if self.done:
+                return
+            self._source.close()
+            self.stream.close()
+            self._end()
+
+class _AsyncFlight:
+    """_Flight for coroutines on one event loop
+
+    Each upstream chunk is read in its own task that readers await through
+    a shield, so cancelling the leader (or any reader) leaves the read
+    running for the others.
+    """
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.abandoned = False
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.usage: Tuple[int, int] = (0, 0)
+        self.followers = 0
+        self.left = 0
+        self.released = False
+        self.stream: Optional[MeteredStream] = None
+        self._source: Any = None
+        self._release: Optional[Callable[[], int]] = None
+        self._next: Optional[asyncio.Future] = None
+        self._closing: Optional[asyncio.Future] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def attach(self, stream: MeteredStream, release: Callable[[], int]):
+        self.stream = stream
+        self._source = stream.__aiter__()
+        self._release = release
+        self._notify()
+
+    def release(self) -> int:
+        self.released = True
+        return self._release()
+
+    def publish(self, chunk: Any):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, result: Any = None, usage: Tuple[int, int] = (0, 0), error: Optional[BaseException] = None):
+        self.result = result
+        self.usage = usage
+        self.error = error
+        self.done = True
+        self._notify()
+
+    def abandon(self):
+        self.abandoned = True
+        self.done = True
+        self._notify()
+
+    async def wait(self) -> Any:
+        while not self.done:
+            await self._changed.wait()
+        if self.abandoned:
+            raise _FlightAbandoned(0)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _end(self, error: Optional[BaseException] = None):
+        self.release()
+        record = self.stream.record
+        usage = (record.input_tokens, record.output_tokens) if record is not None else (0, 0)
+        self.finish(usage=usage, error=error)
+
+    async def _read(self) -> Tuple[bool, Any]:
+        try:
+            return True, await self._source.__anext__()
+        except StopAsyncIteration:
+            return False, None
+
+    async def pull(self, sent: int):
+        if sent < len(self.chunks) or self.done:
+            return
+        if self._next is None:
+            self._next = asyncio.ensure_future(self._read())
+        read = self._next
+        try:
+            more, chunk = await asyncio.shield(read)
+        except asyncio.CancelledError:
+            if not read.cancelled():
+                # Only this reader was cancelled; the read carries on for the others
+                raise
+            if self._next is read:
+                self._next = None
+                self.release()
+                self.abandon()
+            return
+        except Exception as e:
+            if self._next is read:
+                self._next = None
+                self._end(e)
+            return
+        # Every reader awaiting the same read wakes up; only the first publishes it
+        if self._next is read:
+            self._next = None
+            if more:
+                self.publish(chunk)
+            else:
+                self._end()
+
+    async def follow(self):
+        sent = 0
+        while True:
+            if sent < len(self.chunks):
+                sent += 1
+                yield self.chunks[sent - 1]
+            elif not self.done and self._source is None:
+                await self._changed.wait()
+            elif not self.done:
+                await self.pull(sent)
+            elif self.abandoned:
+                raise _FlightAbandoned(sent)
+            elif self.error is not None:
+                raise self.error
+            else:
+                return
+
+    def leave(self):
+        self.left += 1
+        if self.released and self.left > self.followers and not self.done:
+            self._closing = asyncio.ensure_future(self.close())
+
+    async def close(self):
+        if self.done:
+            return
+        if self._next is not None:
+            read, self._next = self._next, None
+            read.cancel()
+            await asyncio.wait([read])
+        await self._source.aclose()
+        await self.stream.__aexit__(None, None, None)
+        if not self.done:
+            self._end()
+
+class Coalescer:
+    """Single-flight registry: concurrent requests with the same key share one upstream call
+
+    Like the response cache, only deterministic requests are coalesced
+    unless `coalesce_nondeterministic` is set (identical sampled requests
+    would then all get the same sample).
+    """
+
+    def __init__(self, coalesce_nondeterministic: bool = False):
+        self.coalesce_nondeterministic = coalesce_nondeterministic
+        self.leaders = 0
+        self.followers = 0
+        self._flights: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def eligible(self, endpoint: str, request: Dict[str, Any]) -> bool:
+        return self.coalesce_nondeterministic or is_deterministic(endpoint, request)
+
+    def join(self, key: str, factory: Callable[[], Any]) -> Tuple[Any, bool]:
+        """The flight for a key and whether the caller leads it"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.followers += 1
+                return flight, False
+            flight = self._flights[key] = factory()
+            self.leaders += 1
+            return flight, True
+
+    def release(self, key: str, flight: Any) -> int:
+        """Stop new callers joining a flight; returns how many followers it has"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            return flight.followers
+
+class _LeaderStream:
+    """The leader's copy of a coalesced stream
+
+    It reads through the flight like a follower. Stopping early leaves the
+    rest to any followers, who pull it themselves; with none left, the
+    upstream stream is closed.
+    """
+
+    def __init__(self, meterr: "MeterrClient", stream: MeteredStream, flight: Any):
+        self._meterr = meterr
+        self._stream = stream
+        self._flight = flight
+        self._done = False
+
+    def _finish(self):
+        if self._done:
+            return
+        self._done = True
+        self._flight.release()
+        if not self._flight.done:
+            self._flight.leave()
+        # A follower may have read the last chunk and written the record on its thread
+        if self._stream.record is not None:
+            self._meterr._last_record.set(self._stream.record)
+
+    def __iter__(self):
+        try:
+            yield from self._flight.follow()
+        finally:
+            self._finish()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._flight.follow():
+                yield chunk
+        finally:
+            self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._finish()
+
+    def close(self):
+        self._finish()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+class _FollowerStream:
+    """A follower's copy of a coalesced stream, replaying the flight's chunks as they arrive
+
+    If the flight is abandoned before anything was replayed, the follower
+    sends its request on its own instead.
+    """
+
+    def __init__(self, meterr: "MeterrClient", call: _Call, flight: Any, resend: Callable[[], Any]):
+        self._meterr = meterr
+        self._call = call
+        self._flight = flight
+        self._resend = resend
+        self._done = False
+
+    def _finish(self, error: Optional[BaseException] = None):
+        if self._done:
+            return
+        self._done = True
+        if not self._flight.done:
+            self._flight.leave()
+        if error is not None and not isinstance(error, GeneratorExit):
+            self._meterr._fail(self._call, error)
+        else:
+            self._meterr._finish(self._call, *self._flight.usage, status=COALESCED_STATUS)
+
+    def __iter__(self):
+        try:
+            yield from self._flight.follow()
+        except _FlightAbandoned as e:
+            if e.sent:
+                self._finish(e)
+                raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+        else:
+            self._finish()
+            return
+        # The resent request records itself
+        self._done = True
+        yield from self._resend()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._flight.follow():
+                yield chunk
+        except _FlightAbandoned as e:
+            if e.sent:
+                self._finish(e)
+                raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+        else:
+            self._finish()
+            return
+        self._done = True
+        async for chunk in await self._resend():
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._finish()
+
+    def close(self):
+        self._finish()
+
+class BudgetExceeded(Exception):
+    """Raised before a request is sent when it would break a budget or rate limit"""
+
+    def __init__(self, budget: str, reason: str):
+        super().__init__(f"Budget '{budget}' exceeded: {reason}")
+        self.budget = budget
+        self.reason = reason
+
+@dataclass
+class Budget:
+    """Spend cap and/or token rate limit for calls matching a team, project and model
+
+    `limit` is USD over a rolling `window_seconds`; `tokens_per_minute` is a
+    token bucket holding up to `burst_tokens` (one minute's worth by default).
+    Fields left as None match any value; `model` matches by prefix.
+    """
+    name: str
+    limit: Optional[float] = None
+    window_seconds: float = 86400.0
+    tokens_per_minute: Optional[float] = None
+    burst_tokens: Optional[float] = None
+    team: Optional[str] = None
+    project: Optional[str] = None
+    model: Optional[str] = None
+
+    def matches(self, team: Optional[str], project: Optional[str], model: str) -> bool:
+        return (
+            (self.team is None or self.team == team)
+            and (self.project is None or self.project == project)
+            and (self.model is None or model.startswith(self.model))
+        )
+
+class _Stripe:
+    """One shard of a budget's counters, guarded by its own lock"""
+
+    __slots__ = ("lock", "tokens", "refilled", "slots", "head", "spent", "unsynced")
+
+    def __init__(self, capacity: float):
+        self.lock = threading.Lock()
+        self.tokens = capacity
+        self.refilled = time.monotonic()
+        self.slots = [0.0] * WINDOW_SLOTS
+        self.head = 0
+        self.spent = 0.0
+        self.unsynced = 0.0
+
+    def advance(self, slot: int):
+        """Expire window slots older than `slot` (caller holds the lock)"""
+        if slot <= self.head:
+            return
+        if slot - self.head >= WINDOW_SLOTS:
+            self.slots = [0.0] * WINDOW_SLOTS
+            self.spent = 0.0
+        else:
+            for s in range(self.head + 1, slot + 1):
+                i = s % WINDOW_SLOTS
+                self.spent -= self.slots[i]
+                self.slots[i] = 0.0
+        self.head = slot
+
+    def refill(self, now: float, rate: float, capacity: float):
+        self.tokens = min(capacity, self.tokens + (now - self.refilled) * rate)
+        self.refilled = now
+
+class _BudgetState:
+    """A Budget's counters, striped so that concurrent threads update different locks
+
+    Each stripe holds 1/N of the token bucket and its own slice of the spend
+    window. A thread updates only its own stripe; reading total spend sums
+    the stripes without locking, and a thread whose stripe runs dry borrows
+    tokens from the others.
+    """
+
+    def __init__(self, budget: Budget, stripes: int):
+        self.budget = budget
+        self.slot_seconds = budget.window_seconds / WINDOW_SLOTS
+        self.rate = None
+        self.capacity = 0.0
+        if budget.tokens_per_minute is not None:
+            self.rate = budget.tokens_per_minute / 60.0 / stripes
+            self.capacity = (budget.burst_tokens or budget.tokens_per_minute) / stripes
+        self.stripes = [_Stripe(self.capacity) for _ in range(stripes)]
+        # Spend recorded by other processes, refreshed on each store sync
+        self.remote = 0.0
+
+    def spent(self, now: float) -> float:
+        slot = int(now / self.slot_seconds)
+        total = self.remote
+        for stripe in self.stripes:
+            if stripe.head < slot:
+                with stripe.lock:
+                    stripe.advance(slot)
+            total += stripe.spent
+        return total
+
+    def take(self, index: int, tokens: float, now: float) -> Optional[List[Tuple[_Stripe, float]]]:
+        """Take tokens from the thread's stripe, borrowing from the others if short
+
+        Returns what was drawn from each stripe, for `refund()`, or None
+        (with nothing drawn) if the stripes together can't cover the request.
+        """
+        if self.rate is None:
+            return []
+        # A request bigger than the whole bucket passes once the bucket is full
+        needed = min(tokens, self.capacity * len(self.stripes))
+        stripe = self.stripes[index]
+        with stripe.lock:
+            stripe.refill(now, self.rate, self.capacity)
+            if stripe.tokens >= needed:
+                stripe.tokens -= tokens
+                return [(stripe, tokens)]
+            have = max(stripe.tokens, 0.0)
+            stripe.tokens -= have
+
+        borrowed = [(stripe, have)]
+        needed -= have
+        count = len(self.stripes)
+        for offset in range(1, count):
+            other = self.stripes[(index + offset) % count]
+            with other.lock:
+                other.refill(now, self.rate, self.capacity)
+                grab = min(max(other.tokens, 0.0), needed)
+                other.tokens -= grab
+            borrowed.append((other, grab))
+            needed -= grab
+            if needed <= 0:
+                # The thread's own stripe carries anything past what was borrowed
+                rest = tokens - sum(amount for _, amount in borrowed)
+                with stripe.lock:
+                    stripe.tokens -= rest
+                borrowed[0] = (stripe, have + rest)
+                return borrowed
+
+        self.refund(borrowed)
+        return None
+
+    def refund(self, draws: List[Tuple[_Stripe, float]]):
+        """Return tokens to the stripes `take()` drew them from"""
+        for stripe, amount in draws:
+            if amount:
+                with stripe.lock:
+                    stripe.tokens = min(self.capacity, stripe.tokens + amount)
+
+    def adjust(self, index: int, tokens: float, cost: float, now: float):
+        """Apply a token and spend delta to one stripe (negative values refund)
+
+        The spend lands in the window slot for wall time `now`, so pass the
+        original charge's time when correcting it.
+        """
+        stripe = self.stripes[index]
+        slot = int(now / self.slot_seconds)
+        with stripe.lock:
+            if self.rate is not None and tokens:
+                stripe.tokens = min(self.capacity, stripe.tokens - tokens)
+            if cost:
+                stripe.advance(slot)
+                # A slot that has left the window no longer counts toward spend
+                if slot > stripe.head - WINDOW_SLOTS:
+                    stripe.slots[slot % WINDOW_SLOTS] += cost
+                    stripe.spent += cost
+                stripe.unsynced += cost
+
+class Reservation:
+    """Tokens and spend held by a pre-flight check until the call is reconciled"""
+
+    __slots__ = ("states", "stripe", "tokens", "cost", "draws", "charged")
+
+    def __init__(
+        self,
+        states: List[_BudgetState],
+        stripe: int,
+        tokens: float,
+        cost: float,
+        draws: List[List[Tuple[_Stripe, float]]],
+        charged: float
+    ):
+        self.states = states
+        self.stripe = stripe
+        self.tokens = tokens
+        self.cost = cost
+        # Per state, the tokens taken from each stripe
+        self.draws = draws
+        # Wall time the spend was charged at; corrections go to the same window slot
+        self.charged = charged
+
+class SQLiteBudgetStore:
+    """Spend ledger shared by processes on one host
+
+    Any object with the same `sync()` signature (e.g. one backed by Redis or
+    the Meterr API) can be passed to BudgetEngine instead.
+    """
+
+    def __init__(self, db_path: str = ".meterr_budgets.db"):
+        self.db_path = db_path
+        self._init_db()
+
+    def _init_db(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS spend (
+                    budget TEXT NOT NULL,
+                    node TEXT NOT NULL,
+                    minute INTEGER NOT NULL,
+                    amount REAL NOT NULL,
+                    PRIMARY KEY (budget, node, minute)
+                )
+            """)
+            conn.commit()
+
+    def sync(self, node: str, deltas: Dict[str, float], windows: Dict[str, float], now: float) -> Dict[str, float]:
+        """Add this node's spend since the last sync; return other nodes' spend per budget window"""
+        minute = int(now // 60)
+        with sqlite3.connect(self.db_path, timeout=5) as conn:
+            conn.executemany(
+                """
+                INSERT INTO spend (budget, node, minute, amount) VALUES (?, ?, ?, ?)
+                ON CONFLICT (budget, node, minute) DO UPDATE SET amount = amount + excluded.amount
+                """,
+                [(name, node, minute, amount) for name, amount in deltas.items()]
+            )
+            remote = {}
+            for name, window in windows.items():
+                row = conn.execute(
+                    "SELECT COALESCE(SUM(amount), 0) FROM spend WHERE budget = ? AND node != ? AND minute >= ?",
+                    (name, node, int((now - window) // 60))
+                ).fetchone()
+                remote[name] = row[0]
+            if windows:
+                conn.execute("DELETE FROM spend WHERE minute < ?", (int((now - max(windows.values())) // 60) - 1,))
+            conn.commit()
+        return remote
+
+class BudgetEngine:
+    """In-process budget and rate enforcement on the request path
+
+    `reserve()` runs before a call with TokenCounter estimates and raises
+    BudgetExceeded if any matching budget would be broken; `reconcile()`
+    corrects the counters with actual usage afterwards. Only lock-striped
+    in-memory counters are touched per call. When a `store` is given, spend
+    is pushed to it and other processes' spend pulled back every
+    `sync_interval` seconds by a background thread. Token rate limits are
+    per process.
+    """
+
+    def __init__(
+        self,
+        budgets: List[Budget],
+        stripes: Optional[int] = None,
+        store: Optional[Any] = None,
+        sync_interval: float = 5.0,
+        node_id: Optional[str] = None
+    ):
+        names = [b.name for b in budgets]
+        if len(set(names)) != len(names):
+            raise ValueError("Budget names must be unique")
+
+        self.stripes = stripes or min(32, (os.cpu_count() or 4) * 2)
+        self.states = [_BudgetState(b, self.stripes) for b in budgets]
+        self.store = store
+        self.sync_interval = sync_interval
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        self._matching: Dict[Tuple[Optional[str], Optional[str], str], List[_BudgetState]] = {}
+        self._local = threading.local()
+        self._next_stripe = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+        if store is not None:
+            self._thread = threading.Thread(target=self._run, name="meterr-budgets", daemon=True)
+            self._thread.start()
+
+    def _stripe(self) -> int:
+        """Stripe owned by the calling thread, assigned round-robin on first use"""
+        index = getattr(self._local, "stripe", None)
+        if index is None:
+            index = self._local.stripe = next(self._next_stripe) % self.stripes
+        return index
+
+    def _states_for(self, team: Optional[str], project: Optional[str], model: str) -> List[_BudgetState]:
+        key = (team, project, model)
+        states = self._matching.get(key)
+        if states is None:
+            if len(self._matching) > 4096:
+                self._matching.clear()
+            states = self._matching[key] = [s for s in self.states if s.budget.matches(team, project, model)]
+        return states
+
+    def reserve(
+        self,
+        team: Optional[str],
+        project: Optional[str],
+        model: str,
+        tokens: float,
+        cost: float
+    ) -> Optional[Reservation]:
+        """Check and hold estimated tokens/spend, raising BudgetExceeded if over"""
+        states = self._states_for(team, project, model)
+        if not states:
+            return None
+
+        wall = time.time()
+        for state in states:
+            budget = state.budget
+            if budget.limit is not None:
+                spent = state.spent(wall)
+                if spent + cost > budget.limit:
+                    raise BudgetExceeded(
+                        budget.name,
+                        f"${spent:.4f} of ${budget.limit:.2f} spent in the last {budget.window_seconds:.0f}s"
+                    )
+
+        index = self._stripe()
+        now = time.monotonic()
+        draws = []
+        for state in states:
+            drawn = state.take(index, tokens, now)
+            if drawn is None:
+                for held, held_draws in zip(states, draws):
+                    held.refund(held_draws)
+                raise BudgetExceeded(
+                    state.budget.name,
+                    f"rate limit of {state.budget.tokens_per_minute:.0f} tokens/minute"
+                )
+            draws.append(drawn)
+
+        for state in states:
+            state.adjust(index, 0.0, cost, wall)
+        # Concurrent callers can all pass the check above before any of them
+        # is charged; with every charge applied, the one that tipped a cap over backs out
+        if cost > 0:
+            for state in states:
+                budget = state.budget
+                if budget.limit is None:
+                    continue
+                spent = state.spent(wall)
+                if spent > budget.limit:
+                    for held, held_draws in zip(states, draws):
+                        held.refund(held_draws)
+                        held.adjust(index, 0.0, -cost, wall)
+                    raise BudgetExceeded(
+                        budget.name,
+                        f"${spent - cost:.4f} of ${budget.limit:.2f} spent in the last {budget.window_seconds:.0f}s"
+                    )
+        return Reservation(states, index, tokens, cost, draws, wall)
+
+    def reconcile(self, reservation: Optional[Reservation], tokens: float, cost: float):
+        """Replace a reservation's estimates with the call's actual usage"""
+        if reservation is None:
+            return
+        for state in reservation.states:
+            state.adjust(reservation.stripe, tokens - reservation.tokens, cost - reservation.cost, reservation.charged)
+
+    def release(self, reservation: Optional[Reservation]):
+        """Return everything a reservation held, e.g. after a failed call"""
+        if reservation is None:
+            return
+        for state, draws in zip(reservation.states, reservation.draws):
+            state.refund(draws)
+            state.adjust(reservation.stripe, 0.0, -reservation.cost, reservation.charged)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Current spend and available tokens per budget"""
+        wall = time.time()
+        now = time.monotonic()
+        result = {}
+        for state in self.states:
+            tokens = None
+            if state.rate is not None:
+                tokens = 0.0
+                for stripe in state.stripes:
+                    with stripe.lock:
+                        stripe.refill(now, state.rate, state.capacity)
+                        tokens += stripe.tokens
+            result[state.budget.name] = {
+                "spent": state.spent(wall),
+                "limit": state.budget.limit,
+                "remote_spent": state.remote,
+                "tokens_available": tokens,
+            }
+        return result
+
+    def sync(self):
+        """Push local spend since the last sync to the store and pull other nodes' spend"""
+        if self.store is None:
+            return
+        deltas = {}
+        for state in self.states:
+            delta = 0.0
+            for stripe in state.stripes:
+                with stripe.lock:
+                    delta += stripe.unsynced
+                    stripe.unsynced = 0.0
+            if delta:
+                deltas[state.budget.name] = delta
+        windows = {s.budget.name: s.budget.window_seconds for s in self.states if s.budget.limit is not None}
+
+        try:
+            remote = self.store.sync(self.node_id, deltas, windows, time.time())
+        except Exception:
+            # Keep the deltas for the next attempt
+            for state in self.states:
+                delta = deltas.get(state.budget.name)
+                if delta:
+                    with state.stripes[0].lock:
+                        state.stripes[0].unsynced += delta
+            raise
+
+        for state in self.states:
+            state.remote = float(remote.get(state.budget.name, 0.0))
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning(f"Budget sync failed: {e}")
+
+    def close(self):
+        """Stop background syncing after a final sync"""
+        if self._thread is None or self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=self.sync_interval + 1)
+        try:
+            self.sync()
+        except Exception as e:
+            logger.warning(f"Budget sync failed: {e}")
+
+def _json_default(obj: Any) -> Any:
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    return str(obj)
+
+def _is_given(value: Any) -> bool:
+    """False for None and the SDKs' NOT_GIVEN/Omit sentinels"""
+    return value is not None and type(value).__name__ not in ("NotGiven", "Omit")
+
+def is_deterministic(endpoint: str, request: Dict[str, Any]) -> bool:
+    """Embeddings, or completions with temperature 0 and a single choice"""
+    if endpoint == "embeddings":
+        return True
+    n = request.get("n")
+    return request.get("temperature") == 0 and (not _is_given(n) or n == 1)
+
+def request_key(endpoint: str, request: Dict[str, Any]) -> str:
+    """Canonical SHA-256 of an endpoint call: model, messages/input and every semantic parameter"""
+    canonical = {k: v for k, v in request.items() if k not in NON_SEMANTIC_FIELDS and _is_given(v)}
+    payload = json.dumps([endpoint, canonical], sort_keys=True, separators=(",", ":"), default=_json_default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _dump(obj: Any) -> Dict[str, Any]:
+    """JSON-safe form of a response object that _load can rebuild into the same type"""
+    if hasattr(obj, "model_dump"):
+        cls = type(obj)
+        return {"type": f"{cls.__module__}:{cls.__qualname__}", "data": obj.model_dump(mode="json")}
+    return {"type": None, "data": obj}
+
+def _load(item: Dict[str, Any]) -> Any:
+    """Rebuild a _dump()ed response; only CACHEABLE_RESPONSE_TYPES are imported"""
+    path = item.get("type")
+    if path in CACHEABLE_RESPONSE_TYPES:
+        module, _, name = path.partition(":")
+        try:
+            return getattr(importlib.import_module(module), name).model_validate(item["data"])
+        except Exception as e:
+            logger.debug(f"Cached {path} returned as a dict: {e}")
+    elif path:
+        logger.debug(f"Cached {path} is not a known response type; returned as a dict")
+    return item["data"]
+
+@dataclass
+class CachedResponse:
+    """A stored response, or the chunks of a streamed one, plus its token usage"""
+    stream: bool
+    payload: Any
+    input_tokens: int
+    output_tokens: int
+
+    def to_json(self) -> str:
+        payload = [_dump(c) for c in self.payload] if self.stream else _dump(self.payload)
+        return json.dumps({
+            "stream": self.stream,
+            "payload": payload,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+        }, default=_json_default)
+
+    @classmethod
+    def from_json(cls, data: str) -> "CachedResponse":
+        raw = json.loads(data)
+        payload = [_load(c) for c in raw["payload"]] if raw["stream"] else _load(raw["payload"])
+        return cls(raw["stream"], payload, raw["input_tokens"], raw["output_tokens"])
+
+class _ReplayStream:
+    """Replays cached stream chunks to sync or async iteration"""
+
+    def __init__(self, chunks: List[Any]):
+        self._chunks = chunks
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def close(self):
+        pass
+
+class LRUCache:
+    """Thread-safe in-memory LRU with per-entry expiry"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, expires: float = 0.0):
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class SQLiteResponseCache:
+    """Disk tier for cached responses with expiry and a total size cap
+
+    Unlike OfflineQueue this keeps one connection open, since lookups sit
+    on the request path. Least recently read entries are evicted first.
+    """
+
+    def __init__(self, db_path: str = ".meterr_cache.db", max_bytes: int = 256 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._init_db()
+
+    def _init_db(self):
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires and expires < now:
+                self._delete(key)
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return value
+
+    def _delete(self, key: str):
+        row = self._conn.execute("DELETE FROM responses WHERE key = ? RETURNING size", (key,)).fetchone()
+        if row is not None:
+            self._bytes -= row[0]
+
+    def put(self, key: str, value: str, expires: float = 0.0):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._delete(key)
+            self._conn.execute(
+                "INSERT INTO responses (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, expires, now)
+            )
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        """Drop expired entries, then least recently read ones, down to 90% of the cap"""
+        self._conn.execute("DELETE FROM responses WHERE expires > 0 AND expires < ?", (now,))
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = self.max_bytes * 0.9
+        while self._bytes > target:
+            rows = self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT 64) RETURNING size"
+            ).fetchall()
+            if not rows:
+                break
+            self._bytes -= sum(r[0] for r in rows)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ResponseCache:
+    """Exact-match cache of deterministic responses for the tracked client
+
+    Keys are `request_key()` hashes. Lookups hit the in-memory LRU first,
+    then the optional SQLite tier (promoting hits into memory). Only
+    embeddings and chat/completion calls with temperature 0 and a single
+    choice are cached unless `cache_nondeterministic` is set.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: Optional[float] = 3600.0,
+        db_path: Optional[str] = None,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        cache_nondeterministic: bool = False
+    ):
+        self.ttl = ttl
+        self.cache_nondeterministic = cache_nondeterministic
+        self.memory = LRUCache(max_entries)
+        self.disk = SQLiteResponseCache(db_path, max_disk_bytes) if db_path else None
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, endpoint: str, request: Dict[str, Any]) -> bool:
+        return self.cache_nondeterministic or is_deterministic(endpoint, request)
+
+    def key(self, endpoint: str, request: Dict[str, Any]) -> str:
+        return request_key(endpoint, request)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            try:
+                data = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.debug(f"Response cache read failed: {e}")
+                data = None
+            if data is not None:
+                entry = CachedResponse.from_json(data)
+                self.memory.put(key, entry, self._expires())
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def _expires(self) -> float:
+        return time.time() + self.ttl if self.ttl else 0.0
+
+    def put(self, key: str, entry: CachedResponse):
+        expires = self._expires()
+        self.memory.put(key, entry, expires)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, entry.to_json(), expires)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logger.debug(f"Response cache write failed: {e}")
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Counter families: (name, help, index into a series' values)
+_METRIC_COUNTERS = (
+    ("requests", "Calls made through the SDK", 0),
+    ("errors", "Calls that failed", 1),
+    ("input_tokens", "Prompt tokens", 2),
+    ("output_tokens", "Completion tokens", 3),
+    ("cost_usd", "Cost in USD", 4),
+)
+
+def _label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _metric_number(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+class _MetricShard:
+    """Series values for the threads assigned to one shard"""
+
+    __slots__ = ("lock", "series")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series: Dict[Tuple[str, str, str, str], List[float]] = {}
+
+class UsageMetrics:
+    """Cumulative usage counters and histograms for pull-based scraping
+
+    Every published UsageRecord is folded into one series per (model, team,
+    project, status): request, error, token and cost counters plus latency
+    and tokens-per-call histograms with fixed buckets. Threads update the
+    shard assigned to them round-robin, so an observation takes a lock no
+    other thread is usually holding. `render()` sums the shards into
+    Prometheus text or OpenMetrics, and `serve()` exposes that on a local
+    HTTP endpoint for scrapers.
+    """
+
+    def __init__(
+        self,
+        shards: Optional[int] = None,
+        latency_buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+        token_buckets: Tuple[float, ...] = TOKEN_BUCKETS,
+        namespace: str = "meterr"
+    ):
+        self.latency_buckets = tuple(sorted(latency_buckets))
+        self.token_buckets = tuple(sorted(token_buckets))
+        self.namespace = namespace
+        self.shards = [_MetricShard() for _ in range(shards or min(32, (os.cpu_count() or 4) * 2))]
+
+        # Values: requests, errors, input, output, cost, latency sum, token sum,
+        # then per-bucket latency counts and per-bucket token counts (each with +Inf)
+        self._latency_offset = 7
+        self._token_offset = self._latency_offset + len(self.latency_buckets) + 1
+        self._width = self._token_offset + len(self.token_buckets) + 1
+        self._local = threading.local()
+        self._next_shard = itertools.count()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def _shard(self) -> _MetricShard:
+        """Shard owned by the calling thread, assigned round-robin on first use"""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = self.shards[next(self._next_shard) % len(self.shards)]
+        return shard
+
+    def observe(self, record: UsageRecord):
+        """Add one finished call to its series"""
+        key = (record.model, record.team or "", record.project or "", record.status)
+        latency = record.latency_ms / 1000
+        latency_slot = self._latency_offset + bisect.bisect_left(self.latency_buckets, latency)
+        token_slot = self._token_offset + bisect.bisect_left(self.token_buckets, record.total_tokens)
+
+        shard = self._shard()
+        with shard.lock:
+            values = shard.series.get(key)
+            if values is None:
+                values = shard.series[key] = [0.0] * self._width
+            values[0] += 1
+            if record.status == "error":
+                values[1] += 1
+            values[2] += record.input_tokens
+            values[3] += record.output_tokens
+            values[4] += record.cost
+            values[5] += latency
+            values[6] += record.total_tokens
+            values[latency_slot] += 1
+            values[token_slot] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, str, str, str], List[float]]:
+        """Series values summed across shards"""
+        totals: Dict[Tuple[str, str, str, str], List[float]] = {}
+        for shard in self.shards:
+            with shard.lock:
+                series = [(key, values[:]) for key, values in shard.series.items()]
+            for key, values in series:
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = values
+                else:
+                    for i, value in enumerate(values):
+                        total[i] += value
+        return totals
+
+    def render(self, openmetrics: bool = False) -> str:
+        """Current values in Prometheus text format, or OpenMetrics when asked"""
+        series = sorted(self.snapshot().items())
+        labels = [
+            (f'model="{_label_value(model)}",team="{_label_value(team)}",'
+             f'project="{_label_value(project)}",status="{_label_value(status)}"', values)
+            for (model, team, project, status), values in series
+        ]
+        lines = []
+
+        for name, help_text, index in _METRIC_COUNTERS:
+            family = f"{self.namespace}_{name}"
+            if openmetrics:
+                lines += [f"# TYPE {family} counter", f"# HELP {family} {help_text}"]
+            else:
+                lines += [f"# HELP {family}_total {help_text}", f"# TYPE {family}_total counter"]
+            lines += [f"{family}_total{{{label}}} {_metric_number(values[index])}" for label, values in labels]
+
+        histograms = (
+            ("request_latency_seconds", "Call latency", self.latency_buckets, self._latency_offset, 5),
+            ("request_tokens", "Total tokens per call", self.token_buckets, self._token_offset, 6),
+        )
+        for name, help_text, bounds, offset, sum_index in histograms:
+            family = f"{self.namespace}_{name}"
+            if openmetrics:
+                lines += [f"# TYPE {family} histogram", f"# HELP {family} {help_text}"]
+            else:
+                lines += [f"# HELP {family} {help_text}", f"# TYPE {family} histogram"]
+            for label, values in labels:
+                cumulative = 0.0
+                for i, bound in enumerate(bounds + (float("inf"),)):
+                    cumulative += values[offset + i]
+                    le = "+Inf" if bound == float("inf") else _metric_number(float(bound))
+                    lines.append(f'{family}_bucket{{{label},le="{le}"}} {_metric_number(cumulative)}')
+                lines.append(f"{family}_sum{{{label}}} {_metric_number(values[sum_index])}")
+                lines.append(f"{family}_count{{{label}}} {_metric_number(values[0])}")
+
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Expose render() at http://host:port/metrics from a background thread"""
+        if self._server is not None:
+            return self._server
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = metrics.render(openmetrics).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="meterr-metrics", daemon=True).start()
+        return self._server
+
+    def close(self):
+        """Stop the HTTP endpoint if serve() started one"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+class EmbeddingBatcher:
+    """Sends large embedding jobs as few, full requests with several in flight
+
+    Inputs are counted with TokenCounter and packed in order into requests
+    that stay under the model's input limit and `fill` of its per-request
+    token limit; no single input is more than a few percent of that budget,
+    so packing in order leaves less than one input's worth unused per
+    request. Up to `max_in_flight` requests run at once (threads for sync
+    clients, tasks for async ones) and embeddings come back in input order.
+    Each request goes through the tracked client and is metered as one
+    UsageRecord.
+
+    `exact=False` packs with `TokenCounter.estimate_tokens` instead of
+    encoding; it is faster but can overshoot on dense text, so leave more
+    headroom with `fill`.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        model: str,
+        max_in_flight: int = 8,
+        fill: float = 0.98,
+        exact: bool = True,
+        limits: Optional[Dict[str, int]] = None
+    ):
+        limits = dict(EMBEDDING_LIMITS.get(model, DEFAULT_EMBEDDING_LIMITS), **(limits or {}))
+        self.client = client
+        self.model = model
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_inputs = limits["max_inputs"]
+        self.max_tokens = int(limits["max_tokens"] * fill)
+        self.max_input_tokens = limits["max_input_tokens"]
+        self.exact = exact
+
+    def _count(self, inputs: List[Any]) -> List[int]:
+        """Tokens per input; pre-tokenized inputs (lists of token ids) count their length"""
+        texts = [item for item in inputs if isinstance(item, str)]
+        if self.exact:
+            counts = iter(TokenCounter.count_tokens_batch(texts, self.model))
+        else:
+            counts = iter([TokenCounter.estimate_tokens(text) for text in texts])
+        return [next(counts) if isinstance(item, str) else len(item) for item in inputs]
+
+    def plan(self, inputs: List[Any]) -> List[Tuple[int, int]]:
+        """(start, end) slices of `inputs`, one per request"""
+        batches = []
+        start, tokens = 0, 0
+        for i, count in enumerate(self._count(inputs)):
+            if count > self.max_input_tokens:
+                raise ValueError(f"Input {i} has {count} tokens; {self.model} accepts at most {self.max_input_tokens}")
+            if i > start and (i - start >= self.max_inputs or tokens + count > self.max_tokens):
+                batches.append((start, i))
+                start, tokens = i, 0
+            tokens += count
+        if start < len(inputs):
+            batches.append((start, len(inputs)))
+        return batches
+
+    def embed(self, inputs: Union[str, List[Any]], **kwargs) -> Any:
+        """Embeddings for `inputs` in order; extra kwargs go to every embeddings.create call
+
+        Returns a list for sync clients and an awaitable of one for async clients.
+        """
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+        batches = self.plan(inputs)
+        create = self.client.embeddings.create
+        if _is_async(create):
+            return self._embed_async(create, inputs, batches, kwargs)
+
+        results: List[Any] = [None] * len(inputs)
+
+        def send(start: int, end: int) -> Tuple[int, Any]:
+            return start, create(model=self.model, input=inputs[start:end], **kwargs)
+
+        if len(batches) == 1:
+            self._place(results, *send(*batches[0]))
+            return results
+
+        pending = set()
+        pool = ThreadPoolExecutor(min(self.max_in_flight, len(batches)), thread_name_prefix="meterr-embed")
+        try:
+            for start, end in batches:
+                pending.add(pool.submit(send, start, end))
+                if len(pending) >= self.max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(results, done)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_EXCEPTION)
+                self._collect(results, done)
+        finally:
+            # A failed request abandons the rest of the job; requests already
+            # sent finish in the background rather than holding up the error
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=not pending, cancel_futures=True)
+        return results
+
+    async def _embed_async(self, create: Callable, inputs: List[Any], batches: List[Tuple[int, int]], kwargs: Dict[str, Any]) -> List[Any]:
+        results: List[Any] = [None] * len(inputs)
+
+        async def send(start: int, end: int) -> Tuple[int, Any]:
+            return start, await create(model=self.model, input=inputs[start:end], **kwargs)
+
+        pending = set()
+        try:
+            for start, end in batches:
+                pending.add(asyncio.ensure_future(send(start, end)))
+                if len(pending) >= self.max_in_flight:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    self._collect(results, done)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+                self._collect(results, done)
+        finally:
+            # A failed request abandons the rest of the job; wait for the cancellations to land
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return results
+
+    @classmethod
+    def _collect(cls, results: List[Any], done: Any):
+        for future in done:
+            cls._place(results, *future.result())
+
+    @staticmethod
+    def _place(results: List[Any], start: int, response: Any):
+        for position, item in enumerate(_field(response, "data") or []):
+            results[start + _field(item, "index", position)] = _field(item, "embedding")
+
+@dataclass
+class _Scope:
+    """Attribution applied to every call made through one tracked client"""
+    team: Optional[str]
+    project: Optional[str]
+    tags: Dict[str, Any]
+
+def _is_async(method: Callable) -> bool:
+    """Whether an SDK method returns an awaitable (AsyncOpenAI, AsyncAnthropic, ...)"""
+    if inspect.iscoroutinefunction(method):
+        return True
+    owner = getattr(method, "__self__", None)
+    return owner is not None and type(owner).__name__.startswith("Async")
+
+class TrackedClient:
+    """Attribute proxy that meters the methods in TRACKED_METHODS and passes everything else through"""
+
+    def __init__(self, target: Any, meterr: "MeterrClient", scope: _Scope, path: str = ""):
+        self._target = target
+        self._meterr = meterr
+        self._scope = scope
+        self._path = path
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._target, name)
+        path = f"{self._path}.{name}" if self._path else name
+
+        endpoint = TRACKED_METHODS.get(path)
+        if endpoint is not None and callable(attr):
+            return self._meterr._wrap(attr, endpoint, self._scope)
+        if path in _TRACKED_PREFIXES:
+            return TrackedClient(attr, self._meterr, self._scope, path)
+        return attr
+
+    def __repr__(self) -> str:
+        return f"TrackedClient({self._target!r})"
+
+class MeterrClient:
+    """Tracks cost and usage of AI SDK calls and reports them to Meterr
+
+    Wrap a provider client (or the `openai` module) with `track_costs()`;
+    calls are metered in-process, optionally checked against budgets before
+    they are sent, and shipped to the Meterr API in background batches.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        batch_size: int = 100,
+        flush_interval: float = 5.0,
+        offline_db: str = ".meterr_queue.db",
+        budgets: Optional[List[Budget]] = None,
+        budget_store: Optional[Any] = None,
+        cache: Optional[ResponseCache] = None,
+        coalesce: Union[bool, Coalescer] = False,
+        metrics: Union[bool, UsageMetrics] = False
+    ):
+        self.api_key = api_key or os.getenv("METERR_API_KEY")
+        self.offline_queue = OfflineQueue(offline_db)
+        self.batcher = None
+        if self.api_key:
+            self.batcher = TelemetryBatcher(
+                self.api_key,
+                endpoint or DEFAULT_ENDPOINT,
+                batch_size=batch_size,
+                flush_interval=flush_interval,
+                offline_queue=self.offline_queue
+            )
+        else:
+            logger.warning("No Meterr API key set; usage is tracked locally but not reported")
+
+        self.budgets = BudgetEngine(budgets, store=budget_store) if budgets else None
+        self.cache = cache
+        self.coalescer = Coalescer() if coalesce is True else (coalesce or None)
+        self.metrics = UsageMetrics() if metrics is True else (metrics or None)
+        self._last_record: contextvars.ContextVar[Optional[UsageRecord]] = contextvars.ContextVar(
+            "meterr_last_record", default=None
+        )
+
+    def track_costs(
+        self,
+        client: Any,
+        team: Optional[str] = None,
+        project: Optional[str] = None,
+        tags: Optional[Dict[str, Any]] = None
+    ) -> TrackedClient:
+        """Wrap a provider client so its calls are metered; team/project may also come from tags"""
+        tags = dict(tags or {})
+        scope = _Scope(team or tags.get("team"), project or tags.get("project"), tags)
+        return TrackedClient(client, self, scope)
+
+    def embedding_batcher(
+        self,
+        client: Any,
+        model: str,
+        team: Optional[str] = None,
+        project: Optional[str] = None,
+        tags: Optional[Dict[str, Any]] = None,
+        **options
+    ) -> EmbeddingBatcher:
+        """EmbeddingBatcher over `client`, tracked with this attribution unless it already is"""
+        if not isinstance(client, TrackedClient):
+            client = self.track_costs(client, team=team, project=project, tags=tags)
+        return EmbeddingBatcher(client, model, **options)
+
+    def get_last_request_cost(self) -> Optional[float]:
+        """Cost of the most recent call made from this thread or task"""
+        record = self._last_record.get()
+        return record.cost if record is not None else None
+
+    def get_last_record(self) -> Optional[UsageRecord]:
+        """UsageRecord of the most recent call made from this thread or task"""
+        return self._last_record.get()
+
+    def _wrap(self, create: Callable, endpoint: str, scope: _Scope) -> Callable:
+        if _is_async(create):
+            @functools.wraps(create)
+            async def tracked_async(*args, **kwargs):
+                return await self._invoke_async(create, endpoint, scope, args, kwargs)
+            return tracked_async
+
+        @functools.wraps(create)
+        def tracked(*args, **kwargs):
+            return self._invoke(create, endpoint, scope, args, kwargs)
+        return tracked
+
+    def _invoke(self, create: Callable, endpoint: str, scope: _Scope, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        call = _Call(endpoint, kwargs, scope)
+        cached = self._from_cache(call)
+        if cached is not None:
+            return cached
+        if self.coalescer is None or not self.coalescer.eligible(endpoint, kwargs):
+            return self._send(call, create, args, kwargs)[0]
+
+        key = call.cache_key or request_key(endpoint, kwargs)
+        flight, leader = self.coalescer.join(key, _Flight)
+        if not leader:
+            return self._follow(call, flight, functools.partial(self._invoke, create, endpoint, scope, args, kwargs))
+        release = functools.partial(self.coalescer.release, key, flight)
+        try:
+            response, record = self._send(call, create, args, kwargs)
+        except Exception as e:
+            release()
+            flight.finish(error=e)
+            raise
+        except BaseException:
+            # Interrupted rather than failed: followers send their own requests
+            release()
+            flight.abandon()
+            raise
+        return self._lead(call, flight, release, response, record)
+
+    async def _invoke_async(self, create: Callable, endpoint: str, scope: _Scope, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        call = _Call(endpoint, kwargs, scope)
+        cached = self._from_cache(call)
+        if cached is not None:
+            return cached
+        if self.coalescer is None or not self.coalescer.eligible(endpoint, kwargs):
+            return (await self._send_async(call, create, args, kwargs))[0]
+
+        # Async flights wait on loop-bound events, so they never mix across loops or with threads
+        key = f"{id(asyncio.get_running_loop())}:{call.cache_key or request_key(endpoint, kwargs)}"
+        flight, leader = self.coalescer.join(key, _AsyncFlight)
+        if not leader:
+            resend = functools.partial(self._invoke_async, create, endpoint, scope, args, kwargs)
+            if call.stream:
+                return _FollowerStream(self, call, flight, resend)
+            try:
+                result = await flight.wait()
+            except _FlightAbandoned:
+                return await resend()
+            except BaseException as e:
+                self._fail(call, e)
+                raise
+            self._finish(call, *flight.usage, status=COALESCED_STATUS)
+            return copy.deepcopy(result)
+        release = functools.partial(self.coalescer.release, key, flight)
+        try:
+            response, record = await self._send_async(call, create, args, kwargs)
+        except Exception as e:
+            release()
+            flight.finish(error=e)
+            raise
+        except BaseException:
+            # Cancelled rather than failed: followers send their own requests
+            release()
+            flight.abandon()
+            raise
+        return self._lead(call, flight, release, response, record)
+
+    def _send(self, call: _Call, create: Callable, args: tuple, kwargs: Dict[str, Any]) -> Tuple[Any, Optional[UsageRecord]]:
+        """Make the upstream call; streams are returned wrapped and record themselves later"""
+        self._preflight(call)
+        try:
+            response = create(*args, **kwargs)
+        except Exception as e:
+            self._fail(call, e)
+            raise
+        if call.stream:
+            return MeteredStream(response, self, call), None
+        return response, self._complete(call, response)
+
+    async def _send_async(self, call: _Call, create: Callable, args: tuple, kwargs: Dict[str, Any]) -> Tuple[Any, Optional[UsageRecord]]:
+        self._preflight(call)
+        try:
+            response = await create(*args, **kwargs)
+        except Exception as e:
+            self._fail(call, e)
+            raise
+        if call.stream:
+            return MeteredStream(response, self, call), None
+        return response, self._complete(call, response)
+
+    def _lead(self, call: _Call, flight: Any, release: Callable[[], int], response: Any, record: Optional[UsageRecord]) -> Any:
+        """Hand the leader's response to its followers"""
+        if call.stream:
+            flight.attach(response, release)
+            return _LeaderStream(self, response, flight)
+        release()
+        flight.finish(response, (record.input_tokens, record.output_tokens))
+        return response
+
+    def _follow(self, call: _Call, flight: _Flight, resend: Callable[[], Any]) -> Any:
+        """Wait on another thread's identical in-flight call and record a zero-cost coalesced use
+
+        `resend` makes the call afresh if the flight is abandoned first.
+        """
+        if call.stream:
+            return _FollowerStream(self, call, flight, resend)
+        try:
+            result = flight.wait()
+        except _FlightAbandoned:
+            return resend()
+        except BaseException as e:
+            self._fail(call, e)
+            raise
+        self._finish(call, *flight.usage, status=COALESCED_STATUS)
+        return copy.deepcopy(result)
+
+    def meter_response(
+        self,
+        endpoint: str,
+        request: Dict[str, Any],
+        response: Any = None,
+        chunks: Optional[List[Any]] = None,
+        error: Optional[BaseException] = None,
+        started: Optional[float] = None,
+        finished: Optional[float] = None,
+        team: Optional[str] = None,
+        project: Optional[str] = None,
+        tags: Optional[Dict[str, Any]] = None
+    ) -> UsageRecord:
+        """Record a call made outside a tracked client (e.g. by the metering proxy)
+
+        Pass the parsed response, or `chunks` for a streamed one, or the
+        `error` it failed with. `started` and `finished` are the call's
+        time.perf_counter() bounds, so latency stays right when metering runs
+        after the response has been delivered.
+        """
+        call = _Call(endpoint, request, _Scope(team, project, dict(tags or {})))
+        if started is not None:
+            call.started = started
+        call.finished = finished
+        if error is not None:
+            return self._fail(call, error)
+        if chunks is not None:
+            meter = _StreamMeter()
+            for chunk in chunks:
+                meter.feed(chunk)
+            return self._complete_stream(call, meter)
+        return self._complete(call, response)
+
+    def _from_cache(self, call: _Call) -> Any:
+        """Serve a call from the response cache, recording it as a zero-cost cache hit"""
+        if self.cache is None or not self.cache.cacheable(call.endpoint, call.request):
+            return None
+        call.cache_key = self.cache.key(call.endpoint, call.request)
+        entry = self.cache.get(call.cache_key)
+        if entry is None:
+            return None
+
+        self._finish(
+            call,
+            entry.input_tokens,
+            entry.output_tokens,
+            status=CACHE_HIT_STATUS
+        )
+        # Callers may mutate what they get back; never hand out the cached objects
+        payload = copy.deepcopy(entry.payload)
+        return _ReplayStream(payload) if entry.stream else payload
+
+    def _preflight(self, call: _Call):
+        """Run the budget pre-flight check if budgets are configured"""
+        if self.budgets is None:
+            return
+        # Estimated, not encoded: reconcile() corrects the hold with actual usage
+        input_tokens = estimate_input_tokens(call.request, call.model, exact=False)
+        output_tokens = 0
+        if call.endpoint != "embeddings":
+            output_tokens = (
+                call.request.get("max_tokens")
+                or call.request.get("max_completion_tokens")
+                or DEFAULT_OUTPUT_ESTIMATE
+            )
+        call.reservation = self.budgets.reserve(
+            call.scope.team,
+            call.scope.project,
+            call.model,
+            input_tokens + output_tokens,
+            calculate_cost(call.model, input_tokens, output_tokens)
+        )
+
+    def _complete(self, call: _Call, response: Any) -> UsageRecord:
+        usage = extract_usage(response)
+        if usage is None:
+            usage = (call.input_estimate(), 0)
+        request_id = _field(response, "id")
+        if call.cache_key is not None:
+            self.cache.put(call.cache_key, CachedResponse(False, copy.deepcopy(response), usage[0], usage[1]))
+        return self._finish(call, usage[0], usage[1], request_id=request_id)
+
+    def _complete_stream(self, call: _Call, meter: _StreamMeter, exhausted: bool = True) -> UsageRecord:
+        input_tokens = meter.input_tokens
+        if input_tokens is None:
+            input_tokens = call.input_estimate()
+        output_tokens = meter.output_tokens
+        if output_tokens is None:
+            output_tokens = TokenCounter.count_tokens("".join(meter.parts), call.model)
+        if call.cache_key is not None and exhausted:
+            self.cache.put(
+                call.cache_key,
+                CachedResponse(True, copy.deepcopy(meter.chunks), input_tokens, output_tokens)
+            )
+        return self._finish(call, input_tokens, output_tokens, request_id=meter.response_id)
+
+    def _fail(self, call: _Call, error: BaseException) -> UsageRecord:
+        if self.budgets is not None:
+            self.budgets.release(call.reservation)
+        return self._finish(call, 0, 0, status="error", error=f"{type(error).__name__}: {error}")
+
+    def _finish(
+        self,
+        call: _Call,
+        input_tokens: int,
+        output_tokens: int,
+        status: str = "success",
+        error: Optional[str] = None,
+        request_id: Optional[str] = None
+    ) -> UsageRecord:
+        cost = calculate_cost(call.model, input_tokens, output_tokens) if status == "success" else 0.0
+        if self.budgets is not None and status == "success":
+            self.budgets.reconcile(call.reservation, input_tokens + output_tokens, cost)
+
+        record = UsageRecord(
+            timestamp=datetime.now(timezone.utc).isoformat(),
+            model=call.model,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens,
+            cost=cost,
+            team=call.scope.team,
+            project=call.scope.project,
+            tags=call.scope.tags,
+            request_id=request_id or uuid.uuid4().hex,
+            endpoint=call.endpoint,
+            latency_ms=((call.finished or time.perf_counter()) - call.started) * 1000,
+            status=status,
+            error=error
+        )
+        self.record(record)
+        return record
+
+    def record(self, record: UsageRecord):
+        """Publish a finished UsageRecord to last-cost lookups, metrics and telemetry"""
+        self._last_record.set(record)
+        if self.metrics is not None:
+            self.metrics.observe(record)
+        if self.batcher is not None:
+            self.batcher.add(record)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Block until pending telemetry has been shipped or queued offline"""
+        return self.batcher.flush(timeout) if self.batcher is not None else True
+
+    def close(self):
+        """Flush telemetry and stop background threads"""
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.budgets is not None:
+            self.budgets.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.metrics is not None:
+            self.metrics.close()
+
+_default_client: Optional[MeterrClient] = None
+
+def _client() -> MeterrClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = MeterrClient()
+    return _default_client
+
+def track_costs(
+    client: Any,
+    team: Optional[str] = None,
+    project: Optional[str] = None,
+    tags: Optional[Dict[str, Any]] = None
+) -> TrackedClient:
+    """Wrap a provider client using a default MeterrClient configured from METERR_API_KEY"""
+    return _client().track_costs(client, team=team, project=project, tags=tags)
+
+def get_last_request_cost() -> Optional[float]:
+    """Cost of the most recent call tracked by the default client"""
+    return _client().get_last_request_cost()
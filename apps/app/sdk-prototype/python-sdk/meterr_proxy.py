@@ -0,0 +1,721 @@
+"""
+Meterr Proxy - asyncio metering reverse proxy for OpenAI-compatible APIs
+Requests are forwarded over pooled keep-alive upstream connections and
+responses are streamed back chunk by chunk as they arrive. Usage is parsed
+and priced on a metering thread after the response has been delivered, and
+the resulting UsageRecords ship through the SDK's batched telemetry path.
+Usage: python meterr_proxy.py --port 8080 --upstream https://api.openai.com
+"""
+
+import os
+import ssl
+import gzip
+import json
+import zlib
+import time
+import asyncio
+import argparse
+import logging
+import threading
+import multiprocessing
+from http import HTTPStatus
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from meterr import MeterrClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPSTREAM = os.getenv("METERR_PROXY_UPSTREAM", "https://api.openai.com")
+
+# Path suffixes of metered POST endpoints, matched in order
+METERED_PATHS = (
+    ("/chat/completions", "chat.completions"),
+    ("/completions", "completions"),
+    ("/embeddings", "embeddings"),
+)
+
+# Connection-level headers that apply to one hop only (RFC 9110 7.6.1)
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "proxy-connection", "te", "trailer", "transfer-encoding", "upgrade",
+}
+
+# Request headers the proxy sets itself or consumes
+NOT_FORWARDED = HOP_BY_HOP | {"host", "content-length", "expect"}
+
+# Content codings _decode_body() can read, offered upstream on metered calls
+DECODABLE_ENCODINGS = ("gzip", "x-gzip", "deflate", "identity")
+
+MAX_HEAD_BYTES = 64 * 1024
+READ_SIZE = 64 * 1024
+
+class UpstreamError(Exception):
+    """The upstream failed a call: an error status, a dropped connection or a timeout"""
+
+class _BadRequest(Exception):
+    pass
+
+class _ClientGone(ConnectionError):
+    pass
+
+def _parse_headers(lines: List[str]) -> List[Tuple[str, str]]:
+    headers = []
+    for line in lines:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise ValueError("Malformed header line")
+        headers.append((name.strip().lower(), value.strip()))
+    return headers
+
+def _header(headers: List[Tuple[str, str]], name: str, default: Optional[str] = None) -> Optional[str]:
+    for key, value in headers:
+        if key == name:
+            return value
+    return default
+
+class _Request:
+    __slots__ = ("method", "target", "version", "headers", "body")
+
+    def __init__(self, method: str, target: str, version: str, headers: List[Tuple[str, str]]):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = b""
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = (_header(self.headers, "connection") or "").lower()
+        if self.version == "HTTP/1.0":
+            return "keep-alive" in connection
+        return "close" not in connection
+
+class _Response:
+    __slots__ = ("status", "reason", "headers", "framing", "keep_alive")
+
+    def __init__(self, head: bytes, method: str):
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise ValueError("Malformed upstream status line")
+        self.status = int(parts[1])
+        self.reason = parts[2] if len(parts) > 2 else ""
+        self.headers = _parse_headers(lines[1:])
+
+        connection = (_header(self.headers, "connection") or "").lower()
+        self.keep_alive = "close" not in connection and parts[0] != "HTTP/1.0"
+        if method == "HEAD" or self.status in (204, 304) or self.status < 200:
+            self.framing = "none"
+        elif "chunked" in (_header(self.headers, "transfer-encoding") or "").lower():
+            self.framing = "chunked"
+        elif _header(self.headers, "content-length") is not None:
+            self.framing = "length"
+        else:
+            self.framing = "close"
+            self.keep_alive = False
+
+class _Job:
+    """Everything the metering thread needs about one finished exchange"""
+
+    __slots__ = (
+        "endpoint", "body", "headers", "status", "content_type", "encoding", "chunked", "chunks", "error", "started", "finished"
+    )
+
+    def __init__(self, endpoint: str, request: _Request, started: float):
+        self.endpoint = endpoint
+        self.body = request.body
+        self.headers = request.headers
+        self.status = 0
+        self.content_type = ""
+        self.encoding = ""
+        self.chunked = False
+        self.chunks: List[bytes] = []
+        self.error: Optional[BaseException] = None
+        self.started = started
+        self.finished = started
+
+async def _read_chunked(reader: asyncio.StreamReader):
+    """Yield the data of a chunked body, consuming its trailers"""
+    while True:
+        size = int((await reader.readline()).split(b";", 1)[0], 16)
+        if size == 0:
+            while (await reader.readline()).strip():
+                pass
+            return
+        yield await reader.readexactly(size)
+        await reader.readexactly(2)
+
+def _dechunk(raw: bytes) -> bytes:
+    """Data of a complete chunked body"""
+    parts = []
+    pos = 0
+    while True:
+        end = raw.index(b"\r\n", pos)
+        size = int(raw[pos:end].split(b";", 1)[0], 16)
+        if size == 0:
+            return b"".join(parts)
+        parts.append(raw[end + 2:end + 2 + size])
+        pos = end + 4 + size
+
+class _ChunkedScanner:
+    """Follows chunked framing across raw reads so the body can be relayed as-is"""
+
+    __slots__ = ("skip", "partial", "trailers", "done")
+
+    def __init__(self):
+        self.skip = 0
+        self.partial = b""
+        self.trailers = False
+        self.done = False
+
+    def feed(self, data: bytes):
+        pos = min(self.skip, len(data))
+        self.skip -= pos
+        while pos < len(data) and not self.done:
+            end = data.find(b"\n", pos)
+            if end < 0:
+                self.partial += data[pos:]
+                return
+            line = (self.partial + data[pos:end]).strip()
+            self.partial = b""
+            pos = end + 1
+            if self.trailers:
+                self.done = not line
+                continue
+            size = int(line.split(b";", 1)[0], 16)
+            if size == 0:
+                self.trailers = True
+                continue
+            take = min(size + 2, len(data) - pos)
+            self.skip = size + 2 - take
+            pos += take
+
+async def _read_body(reader: asyncio.StreamReader, framing: str, length: int = 0):
+    """Yield raw response bytes as reads return, stopping where the message ends
+
+    Chunked bodies are yielded with their framing intact.
+    """
+    scanner = _ChunkedScanner() if framing == "chunked" else None
+    while True:
+        if framing == "length":
+            if length <= 0:
+                return
+            data = await reader.read(min(length, READ_SIZE))
+            length -= len(data)
+        elif scanner is not None:
+            if scanner.done:
+                return
+            data = await reader.read(READ_SIZE)
+            scanner.feed(data)
+        else:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                return
+        if not data:
+            raise asyncio.IncompleteReadError(b"", None)
+        yield data
+
+async def _read_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Optional[_Request]:
+    """Read one HTTP/1.1 request; None when the client closed the connection"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise _BadRequest("Truncated request head")
+        return None
+    except asyncio.LimitOverrunError:
+        raise _BadRequest("Request head too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError:
+        raise _BadRequest("Malformed request line")
+    request = _Request(method, target, version, _parse_headers(lines[1:]))
+
+    if (_header(request.headers, "expect") or "").lower() == "100-continue":
+        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+    if "chunked" in (_header(request.headers, "transfer-encoding") or "").lower():
+        request.body = b"".join([part async for part in _read_chunked(reader)])
+    else:
+        length = _header(request.headers, "content-length")
+        if length:
+            request.body = await reader.readexactly(int(length))
+    return request
+
+def metered_endpoint(method: str, target: str) -> Optional[str]:
+    """Meterr endpoint name for a request, or None if it is passed through unmetered"""
+    if method != "POST":
+        return None
+    path = target.split("?", 1)[0].rstrip("/")
+    for suffix, endpoint in METERED_PATHS:
+        if path.endswith(suffix):
+            return endpoint
+    return None
+
+def _decode_body(body: bytes, encoding: str) -> Optional[bytes]:
+    """Undo gzip/deflate content coding; None for codings we cannot read"""
+    encoding = encoding.lower()
+    if encoding in ("", "identity"):
+        return body
+    try:
+        if encoding in ("gzip", "x-gzip"):
+            return gzip.decompress(body)
+        if encoding == "deflate":
+            return zlib.decompress(body)
+    except (OSError, zlib.error):
+        return None
+    return None
+
+def _decodable_accept_encoding(value: str) -> str:
+    """Narrow an Accept-Encoding value to codings the metering thread can decode"""
+    kept = [
+        coding.strip() for coding in value.split(",")
+        if coding.split(";", 1)[0].strip().lower() in DECODABLE_ENCODINGS
+    ]
+    return ", ".join(kept) or "identity"
+
+def _sse_events(body: bytes) -> List[Dict[str, Any]]:
+    """JSON payloads of a server-sent event stream, skipping the [DONE] marker"""
+    events = []
+    for line in body.splitlines():
+        if not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if not data or data == b"[DONE]":
+            continue
+        try:
+            event = json.loads(data)
+        except ValueError:
+            continue
+        if isinstance(event, dict):
+            events.append(event)
+    return events
+
+class _Connection:
+    """One upstream connection with an idle timer that aborts it when it fires"""
+
+    __slots__ = ("reader", "writer", "reused", "timed_out", "_timer")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+        self.timed_out = False
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def arm(self, timeout: float):
+        """(Re)start the timer; a read still waiting when it fires fails"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(timeout, self._expire)
+
+    def disarm(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _expire(self):
+        self.timed_out = True
+        self.writer.transport.abort()
+
+    def close(self):
+        self.disarm()
+        self.writer.transport.abort()
+
+class UpstreamPool:
+    """Keep-alive HTTP/1.1 connections to one upstream origin
+
+    At most `max_connections` exchanges run at once. Finished connections go
+    back on an idle stack, most recently used first so warm connections stay
+    warm, unless the upstream asked to close them.
+    """
+
+    def __init__(self, origin: str, max_connections: int = 1000, connect_timeout: float = 10.0):
+        url = urlsplit(origin)
+        secure = url.scheme == "https"
+        self.host = url.hostname or "localhost"
+        self.port = url.port or (443 if secure else 80)
+        self.authority = url.netloc
+        self.prefix = url.path.rstrip("/")
+        self.ssl = ssl.create_default_context() if secure else None
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.opened = 0
+
+        self._idle: List[_Connection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def acquire(self) -> _Connection:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_connections)
+        await self._slots.acquire()
+        while self._idle:
+            conn = self._idle.pop()
+            if not conn.reader.at_eof() and not conn.writer.is_closing():
+                conn.reused = True
+                return conn
+            conn.close()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    self.host, self.port, ssl=self.ssl, limit=MAX_HEAD_BYTES,
+                    server_hostname=self.host if self.ssl else None
+                ),
+                self.connect_timeout
+            )
+        except BaseException:
+            self._slots.release()
+            raise
+        self.opened += 1
+        return _Connection(reader, writer)
+
+    def release(self, conn: _Connection, reusable: bool):
+        conn.disarm()
+        if reusable and len(self._idle) < self.max_connections:
+            self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle.clear()
+
+class MeteringProxy:
+    """Reverse proxy that forwards to one upstream and meters completions and embeddings
+
+    Only relaying happens on the event loop: the request goes upstream in a
+    single write and response bytes are written to the client as each read
+    returns. Metered exchanges keep the body chunks they relayed, and after
+    the response is complete a single metering thread parses them, counts
+    tokens where the provider reported none, and records the call through
+    `MeterrClient.meter_response()`.
+
+    Attribution comes from the X-Meterr-Team, X-Meterr-Project and
+    X-Meterr-Tags (a JSON object) request headers, which are not forwarded.
+    When `proxy_keys` is set, requests must carry one of them in X-Meterr-Key.
+    """
+
+    def __init__(
+        self,
+        upstream: str = DEFAULT_UPSTREAM,
+        meterr: Optional[MeterrClient] = None,
+        max_connections: int = 1000,
+        timeout: float = 600.0,
+        proxy_keys: Optional[Set[str]] = None,
+        max_backlog: int = 10000
+    ):
+        self.pool = UpstreamPool(upstream, max_connections)
+        self.meterr = meterr or MeterrClient()
+        self.timeout = timeout
+        self.proxy_keys = set(proxy_keys) if proxy_keys else None
+
+        self.requests = 0
+        self.metered = 0
+        self.dropped = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._meter_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="meterr-proxy-meter")
+        # Exchanges waiting for the metering thread; past this many, new ones are dropped
+        self._backlog = threading.BoundedSemaphore(max_backlog)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080, reuse_port: bool = False) -> asyncio.AbstractServer:
+        """Start listening"""
+        self._server = await asyncio.start_server(
+            self._handle, host, port, limit=MAX_HEAD_BYTES, backlog=4096, reuse_port=reuse_port or None
+        )
+        return self._server
+
+    async def close(self):
+        """Stop listening, close upstream connections and finish pending metering"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.pool.close()
+        await asyncio.get_running_loop().run_in_executor(None, self._meter_pool.shutdown)
+        self.meterr.flush()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader, writer)
+                except (_BadRequest, ValueError) as e:
+                    await self._respond_error(writer, 400, f"Bad request: {e}", keep_alive=False)
+                    break
+                if request is None or not await self._forward(request, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.debug(f"Client connection dropped: {e}")
+        finally:
+            writer.close()
+
+    def _upstream_request(self, request: _Request, metered: bool = False) -> bytes:
+        head = [f"{request.method} {self.pool.prefix}{request.target} HTTP/1.1\r\nhost: {self.pool.authority}\r\n"]
+        for name, value in request.headers:
+            if name in NOT_FORWARDED or name.startswith("x-meterr-"):
+                continue
+            if metered and name == "accept-encoding":
+                # A br or zstd body would reach the client but could not be metered
+                value = _decodable_accept_encoding(value)
+            head.append(f"{name}: {value}\r\n")
+        if request.body or request.method in ("POST", "PUT", "PATCH"):
+            head.append(f"content-length: {len(request.body)}\r\n")
+        head.append("\r\n")
+        return "".join(head).encode("latin-1") + request.body
+
+    async def _exchange(self, data: bytes, method: str) -> Tuple[_Connection, _Response]:
+        """Send a request and read the response head, retrying once on a stale pooled connection"""
+        retried = False
+        while True:
+            conn = await self.pool.acquire()
+            try:
+                conn.writer.write(data)
+                conn.arm(self.timeout)
+                head = await conn.reader.readuntil(b"\r\n\r\n")
+                return conn, _Response(head, method)
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+                self.pool.release(conn, reusable=False)
+                if conn.timed_out:
+                    raise UpstreamError(f"No response within {self.timeout:.0f}s") from e
+                # The upstream closed an idle keep-alive connection before reading the request
+                stale = isinstance(e, ConnectionError) or (isinstance(e, asyncio.IncompleteReadError) and not e.partial)
+                if conn.reused and stale and not retried:
+                    retried = True
+                    continue
+                raise UpstreamError(f"Upstream connection failed: {e or type(e).__name__}") from e
+            except BaseException:
+                self.pool.release(conn, reusable=False)
+                raise
+
+    async def _forward(self, request: _Request, writer: asyncio.StreamWriter) -> bool:
+        """Relay one exchange; returns whether the client connection stays open"""
+        started = time.perf_counter()
+        self.requests += 1
+        keep_alive = request.keep_alive
+
+        if self.proxy_keys is not None and _header(request.headers, "x-meterr-key") not in self.proxy_keys:
+            await self._respond_error(writer, 401, "Missing or invalid X-Meterr-Key", keep_alive)
+            return keep_alive
+
+        endpoint = metered_endpoint(request.method, request.target)
+        job = _Job(endpoint, request, started) if endpoint else None
+
+        try:
+            conn, response = await self._exchange(self._upstream_request(request, job is not None), request.method)
+        except (UpstreamError, OSError, asyncio.TimeoutError) as e:
+            error = e if isinstance(e, UpstreamError) else UpstreamError(f"Upstream connection failed: {e or type(e).__name__}")
+            if job is not None:
+                job.error = error
+                job.finished = time.perf_counter()
+                self._submit(job)
+            await self._respond_error(writer, 502, str(error), keep_alive)
+            return keep_alive
+
+        reusable = False
+        try:
+            reusable = await self._relay(conn, response, writer, keep_alive, job)
+        finally:
+            self.pool.release(conn, reusable)
+            if job is not None:
+                job.finished = time.perf_counter()
+                self._submit(job)
+        return keep_alive
+
+    async def _relay(
+        self,
+        conn: _Connection,
+        response: _Response,
+        writer: asyncio.StreamWriter,
+        keep_alive: bool,
+        job: Optional[_Job]
+    ) -> bool:
+        """Write the response to the client as it arrives; returns whether conn can be reused
+
+        Chunked bodies pass through with their framing untouched; bodies
+        delimited by the upstream closing are chunked for the client.
+        """
+        rechunk = response.framing == "close"
+        head = [f"HTTP/1.1 {response.status} {response.reason}\r\n"]
+        for name, value in response.headers:
+            if name not in HOP_BY_HOP:
+                head.append(f"{name}: {value}\r\n")
+        if response.framing in ("chunked", "close"):
+            head.append("transfer-encoding: chunked\r\n")
+        if not keep_alive:
+            head.append("connection: close\r\n")
+        head.append("\r\n")
+        pending = "".join(head).encode("latin-1")
+
+        if job is not None:
+            job.status = response.status
+            job.content_type = _header(response.headers, "content-type", "")
+            job.encoding = _header(response.headers, "content-encoding", "")
+            job.chunked = response.framing == "chunked"
+
+        try:
+            if response.framing != "none":
+                length = int(_header(response.headers, "content-length", "0"))
+                async for chunk in _read_body(conn.reader, response.framing, length):
+                    if job is not None:
+                        job.chunks.append(chunk)
+                    # The head goes out with the first chunk to save a write
+                    await self._send(writer, pending + (b"%x\r\n%s\r\n" % (len(chunk), chunk) if rechunk else chunk))
+                    pending = b""
+                    conn.arm(self.timeout)
+            await self._send(writer, pending + b"0\r\n\r\n" if rechunk else pending)
+        except _ClientGone:
+            # What the client received before it left is still metered
+            raise
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            if job is not None:
+                reason = "timed out" if conn.timed_out else "dropped"
+                job.error = UpstreamError(f"Upstream stream {reason}: {e or type(e).__name__}")
+            # The head may already be out, so the client only sees the connection drop
+            raise ConnectionError("Upstream stream failed") from e
+        return response.keep_alive
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, data: bytes):
+        writer.write(data)
+        try:
+            await writer.drain()
+        except ConnectionError as e:
+            raise _ClientGone(str(e)) from e
+
+    async def _respond_error(self, writer: asyncio.StreamWriter, status: int, message: str, keep_alive: bool):
+        body = json.dumps({"error": {"message": message, "type": "meterr_proxy_error"}}).encode()
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"content-type: application/json\r\ncontent-length: {len(body)}\r\n"
+            + ("" if keep_alive else "connection: close\r\n")
+            + "\r\n"
+        )
+        await self._send(writer, head.encode("latin-1") + body)
+
+    def _submit(self, job: _Job):
+        """Hand an exchange to the metering thread, dropping it if the backlog is full"""
+        if not self._backlog.acquire(blocking=False):
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Metering backlog full; {self.dropped} proxied requests dropped unmetered")
+            return
+        self._meter_pool.submit(self._meter, job)
+
+    def _meter(self, job: _Job):
+        """Parse a finished exchange and record it (runs on the metering thread)"""
+        try:
+            try:
+                request = json.loads(job.body) if job.body else {}
+            except ValueError:
+                request = {}
+            if not isinstance(request, dict):
+                request = {}
+
+            headers = dict(job.headers)
+            try:
+                tags = json.loads(headers.get("x-meterr-tags") or "{}")
+            except ValueError:
+                tags = {}
+            if not isinstance(tags, dict):
+                tags = {}
+            scope = {
+                "team": headers.get("x-meterr-team") or tags.get("team"),
+                "project": headers.get("x-meterr-project") or tags.get("project"),
+                "tags": tags,
+                "started": job.started,
+                "finished": job.finished,
+            }
+
+            body = b"".join(job.chunks)
+            if job.chunked and job.error is None:
+                body = _dechunk(body)
+            body = _decode_body(body, job.encoding)
+            if job.error is not None:
+                self.meterr.meter_response(job.endpoint, request, error=job.error, **scope)
+            elif job.status >= 400:
+                detail = (body or b"")[:200].decode("utf-8", "replace")
+                self.meterr.meter_response(job.endpoint, request, error=UpstreamError(f"HTTP {job.status}: {detail}"), **scope)
+            elif body is None:
+                # Unreadable coding: fall back to counting the prompt locally
+                self.meterr.meter_response(job.endpoint, request, response={}, **scope)
+            elif job.content_type.startswith("text/event-stream"):
+                self.meterr.meter_response(job.endpoint, request, chunks=_sse_events(body), **scope)
+            else:
+                try:
+                    response = json.loads(body)
+                except ValueError:
+                    response = {}
+                self.meterr.meter_response(job.endpoint, request, response=response, **scope)
+            self.metered += 1
+        except Exception as e:
+            logger.warning(f"Failed to meter proxied request: {e}")
+        finally:
+            self._backlog.release()
+
+async def run_proxy(
+    host: str,
+    port: int,
+    upstream: str,
+    max_connections: int = 1000,
+    proxy_keys: Optional[Set[str]] = None,
+    reuse_port: bool = False
+):
+    """Serve until cancelled"""
+    proxy = MeteringProxy(upstream, max_connections=max_connections, proxy_keys=proxy_keys)
+    server = await proxy.start(host, port, reuse_port=reuse_port)
+    logger.info(f"Meterr proxy listening on {host}:{port}, forwarding to {upstream}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await proxy.close()
+        proxy.meterr.close()
+
+def _use_uvloop():
+    try:
+        import uvloop
+    except ImportError:
+        return
+    uvloop.install()
+
+def _serve(args: argparse.Namespace, reuse_port: bool):
+    _use_uvloop()
+    keys = {k for k in (args.keys or os.getenv("METERR_PROXY_KEYS", "")).split(",") if k} or None
+    try:
+        asyncio.run(run_proxy(args.host, args.port, args.upstream, args.max_connections, keys, reuse_port))
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Meterr metering proxy')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--upstream', type=str, default=DEFAULT_UPSTREAM, help='Upstream API origin')
+    parser.add_argument('--max-connections', type=int, default=1000, help='Upstream connections per worker')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes sharing the port (SO_REUSEPORT)')
+    parser.add_argument('--keys', type=str, default=None, help='Comma-separated accepted X-Meterr-Key values')
+
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        _serve(args, reuse_port=False)
+        return
+    workers = [multiprocessing.Process(target=_serve, args=(args, True)) for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+if __name__ == "__main__":
+    main()
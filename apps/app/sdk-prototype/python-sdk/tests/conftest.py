@@ -0,0 +1,116 @@
+"""Shared pytest setup for the SDK tests
+
+Run from this directory with: python -m pytest -q tests
+"""
+
+import sys
+import json
+import time
+import threading
+from pathlib import Path
+
+import pytest
+
+SDK_DIR = Path(__file__).resolve().parent.parent
+
+if str(SDK_DIR) not in sys.path:
+    sys.path.insert(0, str(SDK_DIR))
+
+class FakeUpstream:
+    """OpenAI-compatible responses served through an httpx MockTransport
+
+    Counts upstream calls; `delay` slows every response and `error` (an
+    HTTP status) makes every call fail, for coalescing and failure tests.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.delay = 0.0
+        self.error = None
+        self._lock = threading.Lock()
+
+    def handler(self, request):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.respond(request)
+
+    async def async_handler(self, request):
+        import asyncio
+
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.respond(request)
+
+    def respond(self, request):
+        import httpx
+
+        with self._lock:
+            self.calls += 1
+        if self.error:
+            return httpx.Response(self.error, json={"error": {"message": "upstream failed", "type": "server_error"}})
+
+        body = json.loads(request.content)
+        model = body["model"]
+        if "input" in body:
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            tokens = sum(len(str(text)) // 4 + 1 for text in inputs)
+            return httpx.Response(200, json={
+                "object": "list",
+                "model": model,
+                "data": [{"object": "embedding", "index": i, "embedding": [float(len(str(t))), 0.0]} for i, t in enumerate(inputs)],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+        if body.get("stream"):
+            chunks = [
+                {"id": "c1", "object": "chat.completion.chunk", "created": 0, "model": model,
+                 "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                for word in ("Hello", " there", " friend")
+            ]
+            text = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            return httpx.Response(200, text=text, headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={
+            "id": "r1", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "hi"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        })
+
+    def client(self):
+        import httpx
+        import openai
+
+        return openai.OpenAI(
+            api_key="test", max_retries=0,
+            http_client=httpx.Client(transport=httpx.MockTransport(self.handler))
+        )
+
+    def async_client(self):
+        import httpx
+        import openai
+
+        return openai.AsyncOpenAI(
+            api_key="test", max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.async_handler))
+        )
+
+@pytest.fixture
+def upstream():
+    pytest.importorskip("openai")
+    return FakeUpstream()
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    """MeterrClient factory writing its offline queue under tmp_path, with no API key"""
+    from meterr import MeterrClient
+
+    monkeypatch.delenv("METERR_API_KEY", raising=False)
+    clients = []
+
+    def make(**options):
+        options.setdefault("offline_db", str(tmp_path / f"queue-{len(clients)}.db"))
+        client = MeterrClient(**options)
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
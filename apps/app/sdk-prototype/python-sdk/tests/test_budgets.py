@@ -0,0 +1,161 @@
+"""Tests for the in-process budget engine"""
+
+import threading
+import time
+
+import pytest
+
+from meterr import Budget, BudgetEngine, BudgetExceeded, SQLiteBudgetStore
+
+def tokens_available(engine: BudgetEngine, name: str) -> float:
+    return engine.status()[name]['tokens_available']
+
+def test_spend_limit_blocks_before_the_call():
+    engine = BudgetEngine([Budget('daily', limit=1.0, team='t')], stripes=2)
+    engine.reserve('t', None, 'gpt-4o', 10, 0.6)
+
+    with pytest.raises(BudgetExceeded) as exc:
+        engine.reserve('t', None, 'gpt-4o', 10, 0.6)
+    assert exc.value.budget == 'daily'
+    # Other teams don't match the budget
+    assert engine.reserve('other', None, 'gpt-4o', 10, 0.6) is None
+
+def test_reconcile_replaces_the_estimate():
+    engine = BudgetEngine([Budget('daily', limit=1.0)], stripes=2)
+    reservation = engine.reserve(None, None, 'gpt-4o', 10, 0.5)
+    engine.reconcile(reservation, 10, 0.2)
+    assert engine.status()['daily']['spent'] == pytest.approx(0.2)
+
+def test_release_returns_spend_and_borrowed_tokens():
+    engine = BudgetEngine([Budget('spend', limit=1.0), Budget('rate', tokens_per_minute=400)], stripes=4)
+    reservation = engine.reserve(None, None, 'gpt-4o', 250, 0.5)
+    assert tokens_available(engine, 'rate') == pytest.approx(150, abs=1)
+
+    engine.release(reservation)
+    assert engine.status()['spend']['spent'] == pytest.approx(0.0)
+    assert tokens_available(engine, 'rate') == pytest.approx(400, abs=1)
+
+def test_rejection_by_a_later_budget_refunds_what_earlier_ones_drew():
+    engine = BudgetEngine(
+        [Budget('team', tokens_per_minute=400), Budget('model', tokens_per_minute=200, model='gpt-4')],
+        stripes=4
+    )
+    engine.reserve(None, None, 'gpt-4', 150, 0.0)
+    assert tokens_available(engine, 'team') == pytest.approx(250, abs=1)
+    assert tokens_available(engine, 'model') == pytest.approx(50, abs=1)
+
+    # 'team' covers this by borrowing from other stripes, then 'model' rejects it
+    with pytest.raises(BudgetExceeded) as exc:
+        engine.reserve(None, None, 'gpt-4', 200, 0.0)
+    assert exc.value.budget == 'model'
+    assert tokens_available(engine, 'team') == pytest.approx(250, abs=1)
+    assert tokens_available(engine, 'model') == pytest.approx(50, abs=1)
+
+def test_rate_limit_allows_a_burst_then_blocks():
+    engine = BudgetEngine([Budget('rate', tokens_per_minute=60)], stripes=2)
+    engine.reserve(None, None, 'gpt-4o', 50, 0.0)
+    with pytest.raises(BudgetExceeded):
+        engine.reserve(None, None, 'gpt-4o', 50, 0.0)
+
+def test_concurrent_reserve_and_release_conserve_tokens():
+    engine = BudgetEngine([Budget('a', tokens_per_minute=800), Budget('b', tokens_per_minute=600)], stripes=4)
+    errors = []
+
+    def work():
+        for _ in range(500):
+            try:
+                engine.release(engine.reserve(None, None, 'gpt-4o', 120, 0.0))
+            except BudgetExceeded:
+                pass
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert tokens_available(engine, 'a') == pytest.approx(800, abs=1)
+    assert tokens_available(engine, 'b') == pytest.approx(600, abs=1)
+
+def test_store_shares_spend_between_engines(tmp_path):
+    store = SQLiteBudgetStore(str(tmp_path / 'budgets.db'))
+    first = BudgetEngine([Budget('shared', limit=1.0)], stripes=2, store=store, sync_interval=60, node_id='a')
+    second = BudgetEngine([Budget('shared', limit=1.0)], stripes=2, store=store, sync_interval=60, node_id='b')
+    try:
+        first.reserve(None, None, 'gpt-4o', 10, 0.7)
+        first.sync()
+        second.sync()
+        assert second.status()['shared']['remote_spent'] == pytest.approx(0.7)
+        with pytest.raises(BudgetExceeded):
+            second.reserve(None, None, 'gpt-4o', 10, 0.5)
+    finally:
+        first.close()
+        second.close()
+
+def test_concurrent_reserves_never_overshoot_the_cap(monkeypatch):
+    from meterr import _BudgetState
+
+    # Widen the gap between the limit check and the charge so every thread passes the check
+    take = _BudgetState.take
+    monkeypatch.setattr(_BudgetState, 'take', lambda self, *args: time.sleep(0.01) or take(self, *args))
+    engine = BudgetEngine([Budget('cap', limit=1.0)], stripes=8)
+    start = threading.Barrier(16)
+    granted = []
+
+    def work():
+        start.wait()
+        for _ in range(5):
+            try:
+                engine.reserve(None, None, 'gpt-4o', 10, 0.1)
+                granted.append(1)
+            except BudgetExceeded:
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert engine.status()['cap']['spent'] <= 1.0 + 1e-9
+    assert len(granted) <= 10
+
+def test_corrections_land_in_the_reservations_window_slot(monkeypatch):
+    import meterr
+
+    clock = [1_000_000.0]
+    monkeypatch.setattr(meterr.time, 'time', lambda: clock[0])
+    engine = BudgetEngine([Budget('hourly', limit=1.0, window_seconds=3600)], stripes=2)
+    first = engine.reserve(None, None, 'gpt-4o', 10, 0.5)
+    second = engine.reserve(None, None, 'gpt-4o', 10, 0.4)
+
+    # A call that outlives the window: its charge has already expired
+    clock[0] += 3700
+    engine.reconcile(first, 10, 0.1)
+    engine.release(second)
+    assert engine.status()['hourly']['spent'] == pytest.approx(0.0)
+
+    # Within the window the correction replaces the original charge
+    third = engine.reserve(None, None, 'gpt-4o', 10, 0.5)
+    clock[0] += 600
+    engine.reconcile(third, 10, 0.2)
+    assert engine.status()['hourly']['spent'] == pytest.approx(0.2)
+
+def test_preflight_estimates_without_encoding(upstream, make_client, monkeypatch):
+    from meterr import TokenCounter
+
+    encoded = []
+    original = TokenCounter.count_tokens
+    monkeypatch.setattr(TokenCounter, 'count_tokens',
+                        classmethod(lambda cls, text, model='gpt-3.5-turbo': encoded.append(text) or original(text, model)))
+    meterr = make_client(budgets=[Budget('cap', limit=100.0)])
+    client = meterr.track_costs(upstream.client())
+
+    client.chat.completions.create(model='gpt-4o', messages=[{'role': 'user', 'content': 'hi ' * 500}])
+
+    assert encoded == []
+    # The estimated hold is replaced by the priced actual usage
+    assert meterr.budgets.status()['cap']['spent'] == pytest.approx(meterr.get_last_record().cost)
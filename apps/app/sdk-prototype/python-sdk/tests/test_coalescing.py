@@ -0,0 +1,250 @@
+"""Tests for single-flight coalescing of identical concurrent requests"""
+
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from meterr import COALESCED_STATUS
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+REQUEST = {"model": "gpt-4o", "messages": MESSAGES, "temperature": 0}
+
+def run_threads(count, target, stagger=0.05):
+    """Start `count` threads running target(i), the first one alone, and collect outcomes"""
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = ("ok", target(i))
+        except Exception as e:
+            results[i] = ("error", e)
+
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(count)]
+    threads[0].start()
+    time.sleep(stagger)
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive(), "coalesced call did not finish"
+    return results
+
+def test_identical_calls_share_one_upstream_call(upstream, make_client):
+    meterr = make_client(coalesce=True)
+    client = meterr.track_costs(upstream.client())
+    upstream.delay = 0.3
+
+    def call(i):
+        response = client.chat.completions.create(**REQUEST)
+        return response.choices[0].message.content, meterr.get_last_record().status
+
+    results = run_threads(4, call)
+
+    assert upstream.calls == 1
+    assert [r[1][0] for r in results] == ["hi"] * 4
+    assert [r[1][1] for r in results].count(COALESCED_STATUS) == 3
+
+def test_followers_replay_a_coalesced_stream(upstream, make_client):
+    meterr = make_client(coalesce=True)
+    client = meterr.track_costs(upstream.client())
+    upstream.delay = 0.3
+
+    def stream(i):
+        chunks = client.chat.completions.create(**REQUEST, stream=True)
+        text = "".join(c.choices[0].delta.content for c in chunks)
+        return text, meterr.get_last_record().status
+
+    results = run_threads(3, stream)
+
+    assert upstream.calls == 1
+    assert [r[1][0] for r in results] == ["Hello there friend"] * 3
+    assert [r[1][1] for r in results].count(COALESCED_STATUS) == 2
+
+def test_repeating_an_open_stream_on_the_same_thread_does_not_wait_on_itself(upstream, make_client):
+    client = make_client(coalesce=True).track_costs(upstream.client())
+
+    def nested(i):
+        first = client.chat.completions.create(**REQUEST, stream=True)
+        second = client.chat.completions.create(**REQUEST, stream=True)
+        # The follower is read first, on the leader's thread, so it has to pull the stream itself
+        texts = ["".join(c.choices[0].delta.content for c in s) for s in (second, first)]
+        return texts
+
+    (outcome, texts), = run_threads(1, nested)
+
+    assert outcome == "ok"
+    assert texts == ["Hello there friend"] * 2
+    assert upstream.calls == 1
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_upstream_errors_reach_every_follower(upstream, make_client, stream):
+    import openai
+
+    meterr = make_client(coalesce=True)
+    client = meterr.track_costs(upstream.client())
+    upstream.delay = 0.3
+    upstream.error = 500
+
+    def call(i):
+        try:
+            response = client.chat.completions.create(**REQUEST, stream=stream)
+            if stream:
+                list(response)
+        finally:
+            record = meterr.get_last_record()
+            assert record is not None and record.status == "error"
+
+    results = run_threads(3, call)
+
+    assert upstream.calls == 1
+    assert all(outcome == "error" for outcome, _ in results)
+    assert all(isinstance(error, openai.InternalServerError) for _, error in results)
+
+def test_async_calls_coalesce_on_one_loop(upstream, make_client):
+    meterr = make_client(coalesce=True)
+    client = meterr.track_costs(upstream.async_client())
+    upstream.delay = 0.1
+
+    async def main():
+        async def stream():
+            chunks = await client.chat.completions.create(**REQUEST, stream=True)
+            return "".join([c.choices[0].delta.content async for c in chunks])
+
+        calls = [client.chat.completions.create(**REQUEST) for _ in range(3)]
+        responses = await asyncio.gather(*calls)
+        texts = await asyncio.gather(*(stream() for _ in range(3)))
+        return responses, texts
+
+    responses, texts = asyncio.run(main())
+
+    assert [r.choices[0].message.content for r in responses] == ["hi"] * 3
+    assert texts == ["Hello there friend"] * 3
+    assert upstream.calls == 2
+
+def test_async_task_repeating_its_open_stream_does_not_wait_on_itself(upstream, make_client):
+    client = make_client(coalesce=True).track_costs(upstream.async_client())
+
+    async def main():
+        first = await client.chat.completions.create(**REQUEST, stream=True)
+        second = await client.chat.completions.create(**REQUEST, stream=True)
+        texts = []
+        for s in (second, first):
+            texts.append("".join([c.choices[0].delta.content async for c in s]))
+        return texts
+
+    assert asyncio.run(asyncio.wait_for(main(), timeout=10)) == ["Hello there friend"] * 2
+    assert upstream.calls == 1
+
+def test_followers_finish_when_the_leader_never_reads(upstream, make_client):
+    meterr = make_client(coalesce=True)
+    client = meterr.track_costs(upstream.client())
+    upstream.delay = 0.3
+    unread = []
+
+    def stream(i):
+        chunks = client.chat.completions.create(**REQUEST, stream=True)
+        if i == 0:
+            # The leader holds its stream and never touches it
+            unread.append(chunks)
+            return None
+        return "".join(c.choices[0].delta.content for c in chunks), meterr.get_last_record().status
+
+    results = run_threads(3, stream)
+
+    assert upstream.calls == 1
+    assert [r[1] for r in results[1:]] == [("Hello there friend", COALESCED_STATUS)] * 2
+
+def test_leader_stopping_early_leaves_the_rest_to_followers(upstream, make_client):
+    meterr = make_client(coalesce=True)
+    client = meterr.track_costs(upstream.client())
+    upstream.delay = 0.3
+
+    def stream(i):
+        with client.chat.completions.create(**REQUEST, stream=True) as chunks:
+            if i == 0:
+                return next(iter(chunks)).choices[0].delta.content
+            return "".join(c.choices[0].delta.content for c in chunks)
+
+    results = run_threads(3, stream)
+
+    assert upstream.calls == 1
+    assert [r[1] for r in results] == ["Hello", "Hello there friend", "Hello there friend"]
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_cancelled_leader_does_not_cancel_followers(upstream, make_client, stream):
+    meterr = make_client(coalesce=True)
+    client = meterr.track_costs(upstream.async_client())
+    upstream.delay = 0.2
+
+    async def call():
+        response = await client.chat.completions.create(**REQUEST, stream=stream)
+        if stream:
+            return "".join([c.choices[0].delta.content async for c in response])
+        return response.choices[0].message.content
+
+    async def main():
+        leader = asyncio.ensure_future(call())
+        await asyncio.sleep(0.05)
+        followers = [asyncio.ensure_future(call()) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    texts = asyncio.run(asyncio.wait_for(main(), timeout=10))
+
+    assert texts == ["Hello there friend" if stream else "hi"] * 3
+    # The leader's request never completed; the followers shared one new call
+    assert upstream.calls == 1
+    assert meterr.coalescer.leaders == 2
+
+def test_cancelling_the_reading_leader_leaves_the_read_to_followers(make_client):
+    class SlowStream:
+        """Provider stream whose chunks arrive 50ms apart"""
+
+        def __init__(self):
+            self.words = ["Hello", " there", " friend"]
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            if not self.words:
+                raise StopAsyncIteration
+            await asyncio.sleep(0.05)
+            return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.words.pop(0)))])
+
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        return SlowStream()
+
+    client = make_client(coalesce=True).track_costs(
+        SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    )
+
+    async def read(into):
+        async for chunk in await client.chat.completions.create(**REQUEST, stream=True):
+            into.append(chunk.choices[0].delta.content)
+
+    async def main():
+        leader_text, follower_text = [], []
+        leader = asyncio.ensure_future(read(leader_text))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(read(follower_text))
+        await asyncio.sleep(0.07)
+        # The leader is waiting on the second chunk when it is cancelled
+        leader.cancel()
+        await follower
+        return leader_text, follower_text
+
+    leader_text, follower_text = asyncio.run(asyncio.wait_for(main(), timeout=10))
+
+    assert leader_text == ["Hello"]
+    assert "".join(follower_text) == "Hello there friend"
+    assert len(calls) == 1
@@ -0,0 +1,151 @@
+"""Tests for token-aware embedding batching"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from meterr import EmbeddingBatcher
+
+MODEL = "text-embedding-3-small"
+
+class Embeddings:
+    """embeddings.create that sleeps, tracks concurrency and fails on inputs in `fail`"""
+
+    def __init__(self, delay=0.02, fail=(), fail_after=0.02):
+        self.delay = delay
+        self.fail = set(fail)
+        self.fail_after = fail_after
+        self.started = []
+        self.finished = 0
+        self.cancelled = 0
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def _enter(self, texts):
+        with self._lock:
+            self.started.append(list(texts))
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        failing = self.fail.intersection(texts)
+        return (self.fail_after if failing else self.delay), failing
+
+    def _leave(self, texts, failing):
+        with self._lock:
+            self.in_flight -= 1
+            if not failing:
+                self.finished += 1
+        if failing:
+            raise RuntimeError(f"rejected {sorted(failing)}")
+        return {"data": [{"index": i, "embedding": [float(len(text))]} for i, text in enumerate(texts)]}
+
+    def create(self, model, input, **kwargs):
+        delay, failing = self._enter(input)
+        time.sleep(delay)
+        return self._leave(input, failing)
+
+class AsyncEmbeddings(Embeddings):
+    async def create(self, model, input, **kwargs):
+        delay, failing = self._enter(input)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            with self._lock:
+                self.in_flight -= 1
+                self.cancelled += 1
+            raise
+        return self._leave(input, failing)
+
+class Client:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+def texts(n):
+    return [f"text {i} " + "x" * (i % 7) for i in range(n)]
+
+def test_plan_respects_item_and_token_limits():
+    batcher = EmbeddingBatcher(Client(Embeddings()), MODEL, exact=False, fill=1.0,
+                               limits={"max_inputs": 3, "max_tokens": 10, "max_input_tokens": 8})
+
+    # Estimated at one token per four characters
+    assert batcher.plan(["a"] * 7) == [(0, 3), (3, 6), (6, 7)]
+    assert batcher.plan(["x" * 16] * 5) == [(0, 2), (2, 4), (4, 5)]
+    # Token ids count one token each
+    assert batcher.plan([[1] * 6, [1] * 6, "x" * 12]) == [(0, 1), (1, 3)]
+    with pytest.raises(ValueError, match="Input 1 has 9 tokens"):
+        batcher.plan(["a", "x" * 36])
+
+def test_fill_leaves_token_headroom():
+    batcher = EmbeddingBatcher(Client(Embeddings()), MODEL, exact=False, fill=0.5,
+                               limits={"max_tokens": 20})
+    assert batcher.plan(["x" * 16] * 5) == [(0, 2), (2, 4), (4, 5)]
+
+def test_results_come_back_in_input_order_within_the_in_flight_bound():
+    embeddings = Embeddings()
+    batcher = EmbeddingBatcher(Client(embeddings), MODEL, max_in_flight=3, exact=False, limits={"max_inputs": 2})
+    inputs = texts(25)
+
+    assert batcher.embed(inputs) == [[float(len(text))] for text in inputs]
+    assert len(embeddings.started) == 13
+    assert embeddings.peak == 3
+
+def test_each_request_is_metered_once(upstream, make_client):
+    meterr = make_client(metrics=True)
+    batcher = meterr.embedding_batcher(upstream.client(), MODEL, team="search", max_in_flight=4,
+                                       exact=False, limits={"max_inputs": 4})
+    inputs = texts(10)
+
+    vectors = batcher.embed(inputs)
+
+    assert [vector[0] for vector in vectors] == [float(len(text)) for text in inputs]
+    assert upstream.calls == 3
+    (key, values), = meterr.metrics.snapshot().items()
+    assert key == (MODEL, "search", "", "success")
+    # FakeUpstream bills len(text) // 4 + 1 tokens per input
+    assert values[:3] == [3, 0, sum(len(text) // 4 + 1 for text in inputs)]
+
+def test_sync_failure_abandons_the_rest_of_the_job():
+    embeddings = Embeddings(delay=1.0, fail={"text 1 x"})
+    batcher = EmbeddingBatcher(Client(embeddings), MODEL, max_in_flight=2, exact=False, limits={"max_inputs": 1})
+
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match="rejected"):
+        batcher.embed(texts(6))
+
+    # The error surfaces without waiting for the slow request beside it, and no more are sent
+    assert time.monotonic() - started < 0.5
+    assert len(embeddings.started) == 2
+
+def test_sync_failure_after_everything_is_sent_does_not_wait_for_the_rest():
+    embeddings = Embeddings(delay=1.0, fail={"text 3 xxx"})
+    batcher = EmbeddingBatcher(Client(embeddings), MODEL, max_in_flight=8, exact=False, limits={"max_inputs": 1})
+
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match="rejected"):
+        batcher.embed(texts(4))
+
+    assert time.monotonic() - started < 0.5
+
+def test_async_client_keeps_order_and_bound():
+    embeddings = AsyncEmbeddings()
+    batcher = EmbeddingBatcher(Client(embeddings), MODEL, max_in_flight=4, exact=False, limits={"max_inputs": 3})
+    inputs = texts(30)
+
+    assert asyncio.run(batcher.embed(inputs)) == [[float(len(text))] for text in inputs]
+    assert embeddings.peak == 4
+
+def test_async_failure_cancels_requests_in_flight():
+    embeddings = AsyncEmbeddings(delay=1.0, fail={"text 1 x"})
+    batcher = EmbeddingBatcher(Client(embeddings), MODEL, max_in_flight=3, exact=False, limits={"max_inputs": 1})
+
+    async def main():
+        with pytest.raises(RuntimeError, match="rejected"):
+            await batcher.embed(texts(6))
+        # The cancelled requests have finished unwinding by the time the error surfaces
+        return embeddings.cancelled, embeddings.in_flight
+
+    assert asyncio.run(main()) == (2, 0)
+    assert len(embeddings.started) == 3
+    assert embeddings.finished == 0
@@ -0,0 +1,165 @@
+"""Tests for the Prometheus and OpenMetrics usage exposition"""
+
+import re
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from meterr import OPENMETRICS_CONTENT_TYPE, PROMETHEUS_CONTENT_TYPE, UsageMetrics, UsageRecord
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)\{((?:[a-zA-Z_]\w*="(?:[^"\\]|\\.)*",?)*)\} (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_]\w*)="((?:[^"\\]|\\.)*)"')
+
+def record(model="gpt-4o", team="search", project="api", status="success",
+           input_tokens=10, output_tokens=5, cost=0.25, latency_ms=120.0):
+    return UsageRecord(
+        timestamp="2024-01-01T00:00:00+00:00", model=model, input_tokens=input_tokens,
+        output_tokens=output_tokens, total_tokens=input_tokens + output_tokens, cost=cost,
+        team=team, project=project, tags={}, request_id="r1", endpoint="chat.completions",
+        latency_ms=latency_ms, status=status
+    )
+
+def parse(text, openmetrics=False):
+    """Check the exposition grammar and return ({family: type}, [(name, labels, value)])"""
+    assert text.endswith("\n")
+    lines = text.rstrip("\n").split("\n")
+    if openmetrics:
+        assert lines.pop() == "# EOF"
+    types, samples, family = {}, [], None
+    for line in lines:
+        if line.startswith("# "):
+            keyword, name, rest = line[2:].split(" ", 2)
+            if keyword == "TYPE":
+                assert name not in types, f"{name} typed twice"
+                types[name] = rest
+                family = name
+            else:
+                assert keyword == "HELP" and rest
+                # Prometheus text puts HELP first, OpenMetrics puts TYPE first
+                assert (name == family) == openmetrics
+            continue
+        match = SAMPLE.match(line)
+        assert match, f"malformed sample: {line!r}"
+        name, labels, value = match.groups()
+        assert name.startswith(family), f"{name} outside its family {family}"
+        samples.append((name, dict(LABEL.findall(labels)), float(value)))
+    return types, samples
+
+def test_prometheus_text_lists_every_family():
+    metrics = UsageMetrics(latency_buckets=(0.1, 1.0), token_buckets=(10, 100))
+    metrics.observe(record())
+    metrics.observe(record(status="error", cost=0.0, latency_ms=2500.0))
+
+    types, samples = parse(metrics.render())
+
+    assert types == {
+        "meterr_requests_total": "counter", "meterr_errors_total": "counter",
+        "meterr_input_tokens_total": "counter", "meterr_output_tokens_total": "counter",
+        "meterr_cost_usd_total": "counter", "meterr_request_latency_seconds": "histogram",
+        "meterr_request_tokens": "histogram",
+    }
+    values = {(name, labels["status"], labels.get("le")): value for name, labels, value in samples}
+    assert values[("meterr_requests_total", "success", None)] == 1
+    assert values[("meterr_errors_total", "error", None)] == 1
+    assert values[("meterr_errors_total", "success", None)] == 0
+    assert values[("meterr_cost_usd_total", "success", None)] == 0.25
+    assert values[("meterr_request_latency_seconds_sum", "error", None)] == 2.5
+
+def test_openmetrics_puts_type_first_and_ends_with_eof():
+    metrics = UsageMetrics()
+    metrics.observe(record())
+
+    types, samples = parse(metrics.render(openmetrics=True), openmetrics=True)
+
+    # OpenMetrics names the counter family without the _total suffix its samples carry
+    assert types["meterr_requests"] == "counter"
+    assert ("meterr_requests_total", 1.0) in [(name, value) for name, _, value in samples]
+
+def test_histogram_buckets_are_cumulative_and_end_at_count():
+    metrics = UsageMetrics(latency_buckets=(1.0, 0.1), token_buckets=(10, 100))
+    for latency_ms in (50, 100, 500, 5000):
+        metrics.observe(record(latency_ms=latency_ms))
+
+    _, samples = parse(metrics.render())
+
+    buckets = [(labels["le"], value) for name, labels, value in samples if name == "meterr_request_latency_seconds_bucket"]
+    # A value equal to a bound falls in that bucket (le is "less than or equal")
+    assert buckets == [("0.1", 2), ("1", 3), ("+Inf", 4)]
+    count, = [value for name, _, value in samples if name == "meterr_request_latency_seconds_count"]
+    assert count == 4
+
+def test_label_values_are_escaped():
+    metrics = UsageMetrics()
+    metrics.observe(record(team='a "quoted"\\team', project="line\nbreak"))
+
+    _, samples = parse(metrics.render())
+
+    labels = samples[0][1]
+    assert labels["team"] == 'a \\"quoted\\"\\\\team'
+    assert labels["project"] == "line\\nbreak"
+
+def test_shards_sum_to_the_same_series():
+    metrics = UsageMetrics(shards=4)
+
+    def work():
+        for _ in range(250):
+            metrics.observe(record(cost=0.5))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    (key, values), = metrics.snapshot().items()
+    assert key == ("gpt-4o", "search", "api", "success")
+    assert values[:5] == [2000, 0, 20000, 10000, 1000]
+
+def test_endpoint_negotiates_the_format():
+    metrics = UsageMetrics()
+    metrics.observe(record())
+    server = metrics.serve(port=0)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{base}/metrics") as response:
+            assert response.headers["Content-Type"] == PROMETHEUS_CONTENT_TYPE
+            parse(response.read().decode())
+
+        request = urllib.request.Request(base, headers={"Accept": "application/openmetrics-text; version=1.0.0"})
+        with urllib.request.urlopen(request) as response:
+            assert response.headers["Content-Type"] == OPENMETRICS_CONTENT_TYPE
+            parse(response.read().decode(), openmetrics=True)
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{base}/other")
+        assert error.value.code == 404
+    finally:
+        metrics.close()
+
+@pytest.mark.parametrize("openmetrics", [False, True])
+def test_prometheus_client_parses_the_output(openmetrics):
+    module = "prometheus_client.openmetrics.parser" if openmetrics else "prometheus_client.parser"
+    parser = pytest.importorskip(module)
+    metrics = UsageMetrics()
+    metrics.observe(record(team='a "quoted" team'))
+    metrics.observe(record(model="gpt-4o-mini", cost=1e-06))
+
+    text = metrics.render(openmetrics)
+    families = {family.name: family for family in parser.text_string_to_metric_families(text)}
+
+    assert families["meterr_requests"].type == "counter"
+    assert families["meterr_request_latency_seconds"].type == "histogram"
+    teams = {sample.labels["team"] for sample in families["meterr_requests"].samples}
+    assert teams == {'a "quoted" team', "search"}
+
+def test_tracked_calls_feed_the_metrics(upstream, make_client):
+    meterr = make_client(metrics=True)
+    client = meterr.track_costs(upstream.client(), team="search")
+    client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "hi"}])
+
+    _, samples = parse(meterr.metrics.render())
+
+    tokens = {name: value for name, labels, value in samples if labels["team"] == "search" and "tokens_total" in name}
+    assert tokens == {"meterr_input_tokens_total": 10, "meterr_output_tokens_total": 5}
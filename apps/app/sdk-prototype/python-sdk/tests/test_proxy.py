@@ -0,0 +1,188 @@
+"""Tests for the metering proxy against a local upstream"""
+
+import asyncio
+import gzip
+import json
+import threading
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from meterr_proxy import MeteringProxy
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+USAGE = {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+
+def completion():
+    return json.dumps({
+        "id": "r1", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "hi"}, "finish_reason": "stop"}],
+        "usage": USAGE,
+    }).encode()
+
+def sse_events():
+    events = [
+        {"id": "c1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-mini",
+         "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+        for word in ("Hello", " there", " friend")
+    ]
+    events.append({"id": "c1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-mini",
+                   "choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13}})
+    return [f"data: {json.dumps(event)}\n\n".encode() for event in events] + [b"data: [DONE]\n\n"]
+
+class Upstream:
+    """HTTP/1.1 upstream framing its responses as the request's query asks
+
+    `?framing=length|chunked|close` picks the body framing and `&gzip=1`
+    gzips it. Streamed chat completions always come back as chunked SSE.
+    """
+
+    def __init__(self):
+        self.heads = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+                lines = head.split("\r\n")
+                headers = dict(
+                    (name.strip().lower(), value.strip())
+                    for name, _, value in (line.partition(":") for line in lines[1:] if line)
+                )
+                self.heads.append(headers)
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                target = lines[0].split(" ")[1]
+                if not await self._respond(target, json.loads(body) if body else {}, writer):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, target, request, writer):
+        query = dict(part.split("=") for part in target.partition("?")[2].split("&") if part)
+        if request.get("stream"):
+            writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\ntransfer-encoding: chunked\r\n\r\n")
+            for event in sse_events():
+                writer.write(b"%x\r\n%s\r\n" % (len(event), event))
+                await writer.drain()
+                await asyncio.sleep(0.01)
+            writer.write(b"0\r\n\r\n")
+            return True
+
+        framing = query.get("framing", "length")
+        body = completion()
+        head = "HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+        if query.get("gzip"):
+            body = gzip.compress(body)
+            head += "content-encoding: gzip\r\n"
+        if framing == "length":
+            writer.write(f"{head}content-length: {len(body)}\r\n\r\n".encode() + body)
+        elif framing == "chunked":
+            writer.write(f"{head}transfer-encoding: chunked\r\n\r\n".encode())
+            for i in range(0, len(body), 16):
+                piece = body[i:i + 16]
+                writer.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+            writer.write(b"0\r\n\r\n")
+        else:
+            writer.write(f"{head}connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+        return framing != "close"
+
+def run_proxy(meterr, exchange, **options):
+    """Serve the proxy against Upstream and return what `exchange(client)` and the metering saw"""
+    records = []
+    meter_response = meterr.meter_response
+
+    def capture(*args, **kwargs):
+        record = meter_response(*args, **kwargs)
+        records.append(record)
+        return record
+
+    meterr.meter_response = capture
+
+    async def main():
+        upstream = Upstream()
+        port = await upstream.start()
+        proxy = MeteringProxy(f"http://127.0.0.1:{port}", meterr=meterr, **options)
+        server = await proxy.start("127.0.0.1", 0)
+        proxy_port = server.sockets[0].getsockname()[1]
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{proxy_port}", timeout=10) as client:
+                result = await exchange(client)
+        finally:
+            await proxy.close()
+            upstream.server.close()
+        return result, proxy, upstream
+
+    result, proxy, upstream = asyncio.run(main())
+    return result, proxy, upstream, records
+
+@pytest.mark.parametrize("query", ["framing=length", "framing=chunked", "framing=close", "framing=chunked&gzip=1"])
+def test_json_responses_are_relayed_and_metered(make_client, query):
+    async def exchange(client):
+        response = await client.post(f"/v1/chat/completions?{query}", json={"model": "gpt-4o-mini", "messages": MESSAGES})
+        return response.status_code, response.json()
+
+    (status, body), proxy, _, records = run_proxy(make_client(), exchange)
+
+    assert status == 200
+    assert body["choices"][0]["message"]["content"] == "hi"
+    assert proxy.metered == 1
+    record, = records
+    assert (record.model, record.input_tokens, record.output_tokens, record.status) == ("gpt-4o-mini", 10, 5, "success")
+
+def test_streamed_responses_arrive_in_pieces_and_are_metered(make_client):
+    request = {"model": "gpt-4o-mini", "messages": MESSAGES, "stream": True}
+
+    async def exchange(client):
+        async with client.stream("POST", "/v1/chat/completions", json=request) as response:
+            return response.headers.get("transfer-encoding"), [chunk async for chunk in response.aiter_raw()]
+
+    (framing, pieces), proxy, _, records = run_proxy(make_client(), exchange)
+
+    assert framing == "chunked"
+    assert len(pieces) > 1
+    assert b"".join(pieces) == b"".join(sse_events())
+    record, = records
+    assert (record.input_tokens, record.output_tokens, record.status) == (10, 3, "success")
+
+def test_accept_encoding_is_narrowed_to_decodable_codings(make_client):
+    async def exchange(client):
+        for accept in ("br, zstd, gzip;q=0.5", "br"):
+            await client.post("/v1/chat/completions", json={"model": "gpt-4o-mini", "messages": MESSAGES},
+                              headers={"accept-encoding": accept})
+        # Unmetered calls are passed through untouched
+        await client.get("/v1/models", headers={"accept-encoding": "br"})
+
+    _, _, upstream, records = run_proxy(make_client(), exchange)
+
+    assert [head["accept-encoding"] for head in upstream.heads] == ["gzip;q=0.5", "identity", "br"]
+    assert len(records) == 2
+
+def test_full_backlog_drops_and_counts_records(make_client):
+    meterr = make_client()
+    release = threading.Event()
+    meter_response = meterr.meter_response
+
+    def blocked(*args, **kwargs):
+        release.wait(timeout=10)
+        return meter_response(*args, **kwargs)
+
+    meterr.meter_response = blocked
+
+    async def exchange(client):
+        for _ in range(3):
+            response = await client.post("/v1/chat/completions", json={"model": "gpt-4o-mini", "messages": MESSAGES})
+            assert response.status_code == 200
+        release.set()
+
+    _, proxy, _, records = run_proxy(meterr, exchange, max_backlog=1)
+
+    assert (proxy.requests, proxy.metered, proxy.dropped) == (3, 1, 2)
+    assert len(records) == 1
@@ -0,0 +1,83 @@
+"""Tests for the exact-match response cache"""
+
+import json
+import sys
+
+import pytest
+
+from meterr import CACHE_HIT_STATUS, CachedResponse, ResponseCache, request_key
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+def test_request_key_ignores_non_semantic_fields():
+    base = {"model": "gpt-4o", "messages": MESSAGES, "temperature": 0}
+    assert request_key("chat.completions", base) == request_key("chat.completions", dict(base, timeout=5))
+    assert request_key("chat.completions", base) != request_key("chat.completions", dict(base, temperature=1))
+
+def test_unknown_response_types_are_never_imported(tmp_path, monkeypatch):
+    (tmp_path / "planted_module.py").write_text("IMPORTED = True\nclass Payload:\n    pass\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    stored = json.dumps({
+        "stream": False,
+        "payload": {"type": "planted_module:Payload", "data": {"answer": 42}},
+        "input_tokens": 1,
+        "output_tokens": 1,
+    })
+
+    entry = CachedResponse.from_json(stored)
+
+    assert entry.payload == {"answer": 42}
+    assert "planted_module" not in sys.modules
+
+def test_dict_payloads_round_trip():
+    entry = CachedResponse(False, {"answer": 42}, 3, 4)
+    restored = CachedResponse.from_json(entry.to_json())
+    assert restored.payload == {"answer": 42}
+    assert (restored.input_tokens, restored.output_tokens) == (3, 4)
+
+def test_openai_responses_are_rebuilt_from_disk(upstream, make_client, tmp_path):
+    db = str(tmp_path / "cache.db")
+    client = make_client(cache=ResponseCache(db_path=db)).track_costs(upstream.client())
+    client.chat.completions.create(model="gpt-4o", messages=MESSAGES, temperature=0)
+    list(client.chat.completions.create(model="gpt-4o", messages=MESSAGES, temperature=0, stream=True))
+
+    # A fresh client only has the disk tier to go on
+    meterr = make_client(cache=ResponseCache(db_path=db))
+    fresh = meterr.track_costs(upstream.client())
+    response = fresh.chat.completions.create(model="gpt-4o", messages=MESSAGES, temperature=0)
+    assert type(response).__name__ == "ChatCompletion"
+    assert response.choices[0].message.content == "hi"
+    assert meterr.get_last_record().status == CACHE_HIT_STATUS
+
+    chunks = list(fresh.chat.completions.create(model="gpt-4o", messages=MESSAGES, temperature=0, stream=True))
+    assert [type(c).__name__ for c in chunks] == ["ChatCompletionChunk"] * 3
+    assert "".join(c.choices[0].delta.content for c in chunks) == "Hello there friend"
+    assert upstream.calls == 2
+
+def test_only_deterministic_calls_are_cached(upstream, make_client):
+    meterr = make_client(cache=ResponseCache())
+    client = meterr.track_costs(upstream.client())
+    for _ in range(3):
+        client.chat.completions.create(model="gpt-4o", messages=MESSAGES, temperature=0)
+    assert upstream.calls == 1
+    assert meterr.get_last_record().cost == 0
+
+    client.chat.completions.create(model="gpt-4o", messages=MESSAGES)
+    client.chat.completions.create(model="gpt-4o", messages=MESSAGES)
+    assert upstream.calls == 3
+
+def test_records_carry_timezone_aware_timestamps(upstream, make_client):
+    from datetime import datetime, timedelta
+
+    meterr = make_client(cache=ResponseCache())
+    client = meterr.track_costs(upstream.client())
+    statuses = []
+    for _ in range(2):
+        client.chat.completions.create(model="gpt-4o", messages=MESSAGES, temperature=0)
+        record = meterr.get_last_record()
+        statuses.append(record.status)
+        # Regular and cache-hit records share one ISO format with an explicit UTC offset
+        assert record.timestamp.endswith("+00:00")
+        assert datetime.fromisoformat(record.timestamp).utcoffset() == timedelta(0)
+
+    assert statuses == ["success", CACHE_HIT_STATUS]
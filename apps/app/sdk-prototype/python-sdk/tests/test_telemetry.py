@@ -0,0 +1,157 @@
+"""Tests for the telemetry batcher's offline drain and the telemetry load benchmark's checks"""
+
+import json
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from meterr import OfflineQueue, TelemetryBatcher, UsageRecord
+
+def record(i=0):
+    return UsageRecord(
+        timestamp="2024-01-01T00:00:00+00:00", model="gpt-4o", input_tokens=10, output_tokens=5,
+        total_tokens=15, cost=0.001, team=None, project=None, tags={}, request_id=f"r{i}",
+        endpoint="chat.completions", latency_ms=100.0, status="success"
+    )
+
+class Ingest:
+    """Telemetry endpoint that refuses batches while `down` and counts the records it accepts"""
+
+    def __init__(self):
+        self.down = True
+        self.accepted = 0
+
+    def handler(self, request):
+        import httpx
+
+        if self.down:
+            return httpx.Response(503)
+        self.accepted += len(json.loads(request.content)["records"])
+        return httpx.Response(200, json={"ok": True})
+
+def test_offline_backlog_drains_under_steady_load(tmp_path):
+    httpx = pytest.importorskip("httpx")
+    ingest = Ingest()
+    offline = OfflineQueue(str(tmp_path / "queue.db"))
+    batcher = TelemetryBatcher("mk-test", "http://ingest.test/usage", batch_size=10,
+                               flush_interval=0.05, offline_queue=offline)
+    batcher._http = httpx.Client(transport=httpx.MockTransport(ingest.handler))
+    stop = threading.Event()
+    added = [0]
+
+    def load():
+        # A record every few ms keeps the buffer from ever going idle
+        while not stop.is_set():
+            batcher.add(record(added[0]))
+            added[0] += 1
+            time.sleep(0.005)
+
+    try:
+        for i in range(50):
+            batcher.add(record(i))
+        assert batcher.flush()
+        assert offline.size() == 50
+
+        ingest.down = False
+        worker = threading.Thread(target=load, daemon=True)
+        worker.start()
+        deadline = time.monotonic() + 10
+        while offline.size() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert offline.size() == 0, "offline backlog did not drain while records kept arriving"
+    finally:
+        stop.set()
+        batcher.close()
+
+    assert ingest.accepted + offline.size() == 50 + added[0]
+
+def test_failed_batch_goes_offline_in_one_transaction(tmp_path, monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    import sqlite3
+
+    offline = OfflineQueue(str(tmp_path / "queue.db"))
+    batcher = TelemetryBatcher("mk-test", "http://ingest.test/usage", batch_size=50,
+                               flush_interval=5.0, offline_queue=offline)
+    batcher._http = httpx.Client(transport=httpx.MockTransport(Ingest().handler))
+    connect = sqlite3.connect
+    connections = []
+    monkeypatch.setattr(sqlite3, "connect", lambda *args, **kwargs: connections.append(args) or connect(*args, **kwargs))
+    try:
+        for i in range(50):
+            batcher.add(record(i))
+        assert batcher.flush()
+    finally:
+        monkeypatch.undo()
+        batcher.close()
+
+    assert offline.size() == 50
+    assert len(connections) == 1
+
+@pytest.fixture
+def telemetry_load(monkeypatch):
+    pytest.importorskip("openai")
+    monkeypatch.syspath_prepend(str(Path(__file__).resolve().parent.parent / "benchmarks"))
+    import telemetry_load
+    return telemetry_load
+
+def report(p99_ratio, p99_ms, drain=2.0, lost=0):
+    phase = {"p50_ratio": 1.0, "p99_ratio": p99_ratio, "p99_ms": p99_ms, "shipped_ratio": 1.0}
+    return {
+        "phases": {"healthy": dict(phase), "recovery": dict(phase)},
+        "drain_after_recovery_s": drain,
+        "final_drain_s": 1.0,
+        "records": {"lost": lost},
+    }
+
+def test_latency_is_compared_as_a_ratio_to_the_untracked_run(telemetry_load):
+    baseline = report(p99_ratio=1.2, p99_ms=300.0)
+
+    # A slower machine: every call takes three times as long, tracked or not
+    assert telemetry_load.compare(report(p99_ratio=1.2, p99_ms=900.0), baseline, 0.25) == []
+    failures = telemetry_load.compare(report(p99_ratio=2.0, p99_ms=300.0), baseline, 0.25)
+    assert [f.split(":")[0] for f in failures] == ["phases.healthy.p99_ratio", "phases.recovery.p99_ratio"]
+
+def test_drain_and_losses_are_checked(telemetry_load):
+    baseline = report(p99_ratio=1.2, p99_ms=300.0)
+
+    failures = telemetry_load.compare(report(1.2, 300.0, drain=None, lost=3), baseline, 0.25)
+
+    assert any(f.startswith("drain_after_recovery_s") and "never reached" in f for f in failures)
+    assert any(f.startswith("records.lost") for f in failures)
+
+def test_summary_reports_ratios_and_losses(telemetry_load):
+    scenario = [{"name": "healthy", "seconds": 2}]
+    baseline_calls = [(0.1 * i, 0.010) for i in range(20)]
+    calls = [(0.1 * i, 0.015) for i in range(20)]
+    samples = [
+        {"t": 0.0, "produced": 0, "shipped": 0, "queue_depth": 0, "offline_rows": 0, "disk_bytes": 0},
+        {"t": 1.0, "produced": 25, "shipped": 20, "queue_depth": 5, "offline_rows": 0, "disk_bytes": 0},
+    ]
+
+    summary = telemetry_load.summarize(scenario, baseline_calls, calls, samples, None, None, 0)
+
+    healthy = summary["phases"]["healthy"]
+    assert healthy["p50_ratio"] == pytest.approx(1.5)
+    assert healthy["shipped_ratio"] == pytest.approx(20 / 10)
+    assert summary["records"]["lost"] == 5
+
+def test_failed_calls_count_as_produced_records(telemetry_load):
+    import openai
+
+    class Failing:
+        class chat:
+            class completions:
+                @staticmethod
+                def create(**kwargs):
+                    time.sleep(0.001)
+                    raise openai.OpenAIError("upstream down")
+
+    run = telemetry_load.LoadRun(Failing(), None, threads=2, coroutines=0, t0=time.time())
+    run.start()
+    time.sleep(0.05)
+    run.stop()
+
+    assert run.calls == []
+    assert run.attempted() == run.failures > 0
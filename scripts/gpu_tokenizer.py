@@ -7,6 +7,7 @@ Requires: pip install torch transformers tiktoken
 
 import json
 import sys
+import signal
 import argparse
 import os
 from typing import List, Dict, Any
@@ -28,9 +29,27 @@ try:
 except ImportError:
     TIKTOKEN_AVAILABLE = False
 
+# Token count index shared with scripts/python/token_analyzer.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'python'))
+try:
+    from token_index import TokenCountIndex, DEFAULT_INDEX_DIR, batch_token_lengths, tokenizer_fingerprint
+    INDEX_AVAILABLE = True
+except ImportError:
+    DEFAULT_INDEX_DIR = None
+    INDEX_AVAILABLE = False
+
+    def batch_token_lengths(tokenizer, texts: List[str]) -> List[int]:
+        # Same counting policy as token_index.batch_token_lengths
+        return [len(tokenizer.encode(text, disallowed_special=())) for text in texts]
+
+# Write new index entries to disk once this many are pending (and on close)
+INDEX_FLUSH_RECORDS = 50_000
+
 class GPUTokenizer:
-    def __init__(self, device: int = 0, model: str = 'gpt-4'):
+    def __init__(self, device: int = 0, model: str = 'gpt-4', index_dir: str = DEFAULT_INDEX_DIR):
         self.model = model
+        self.index_dir = index_dir if INDEX_AVAILABLE else None
+        self.indexes = {}
         self.device_name = f'cuda:{device}' if CUDA_AVAILABLE else 'cpu'
         
         if CUDA_AVAILABLE:
@@ -59,7 +78,7 @@ class GPUTokenizer:
         # For now, use approximation
         self.tokenizers['claude-3'] = None
     
-    def count_tokens_batch(self, texts: List[str], model: str = None) -> List[int]:
+    def count_tokens_batch(self, texts: List[str], model: str = None, use_index: bool = True) -> List[int]:
         """Count tokens for multiple texts in parallel"""
         model = model or self.model
         tokenizer = self.tokenizers.get(model)
@@ -68,12 +87,45 @@ class GPUTokenizer:
             # Fallback to word-based approximation
             return [len(text.split()) for text in texts]
         
+        index = self._get_index(model, tokenizer) if use_index else None
+        if index is None:
+            return self._encode_counts(texts, tokenizer)
+        
+        # Only encode texts the index hasn't seen before
+        counts = index.counts_for(texts, lambda missing: self._encode_counts(missing, tokenizer))
+        if index.pending >= INDEX_FLUSH_RECORDS:
+            index.flush()
+        return counts
+    
+    def close(self):
+        """Write pending token count index entries to disk"""
+        for model, index in self.indexes.items():
+            if index is None:
+                continue
+            try:
+                index.flush()
+            except Exception as e:
+                print(f"Could not save token count index for {model}: {e}", file=sys.stderr)
+    
+    def _encode_counts(self, texts: List[str], tokenizer) -> List[int]:
         if CUDA_AVAILABLE and len(texts) > 100:
             # Use GPU parallelization for large batches
             return self._count_tokens_gpu(texts, tokenizer)
         else:
             # CPU processing for small batches
-            return [len(tokenizer.encode(text)) for text in texts]
+            return batch_token_lengths(tokenizer, texts)
+    
+    def _get_index(self, model: str, tokenizer):
+        """Persistent token count index for a model, if enabled"""
+        if self.index_dir is None:
+            return None
+        if model not in self.indexes:
+            try:
+                self.indexes[model] = TokenCountIndex(model, tokenizer_fingerprint(tokenizer), self.index_dir)
+            except Exception as e:
+                print(f"Token count index unavailable for {model}: {e}", file=sys.stderr)
+                self.indexes[model] = None
+        return self.indexes[model]
     
     def _count_tokens_gpu(self, texts: List[str], tokenizer) -> List[int]:
         """GPU-accelerated token counting using parallel processing"""
@@ -88,17 +140,13 @@ class GPUTokenizer:
                 # Parallelize encoding on GPU
                 with torch.cuda.stream(torch.cuda.Stream()):
                     # Encode texts in parallel
-                    counts = []
-                    for text in chunk:
-                        tokens = tokenizer.encode(text)
-                        counts.append(len(tokens))
-                    all_counts.extend(counts)
+                    all_counts.extend(batch_token_lengths(tokenizer, chunk))
             
             return all_counts
             
         except Exception as e:
             print(f"GPU processing error, falling back to CPU: {e}", file=sys.stderr)
-            return [len(tokenizer.encode(text)) for text in texts]
+            return batch_token_lengths(tokenizer, texts)
     
     def benchmark(self, num_texts: int = 10000) -> Dict[str, Any]:
         """Benchmark GPU vs CPU performance"""
@@ -112,10 +160,10 @@ class GPUTokenizer:
         cpu_counts = [len(text.split()) for text in texts]
         cpu_time = time.time() - cpu_start
         
-        # GPU benchmark (if available)
+        # GPU benchmark (if available); bypass the index to time tokenization itself
         if CUDA_AVAILABLE:
             gpu_start = time.time()
-            gpu_counts = self.count_tokens_batch(texts)
+            gpu_counts = self.count_tokens_batch(texts, use_index=False)
             gpu_time = time.time() - gpu_start
             
             speedup = cpu_time / gpu_time
@@ -136,11 +184,17 @@ def main():
     parser.add_argument('--batch-size', type=int, default=1000, help='Batch size for processing')
     parser.add_argument('--model', type=str, default='gpt-4', help='Model type for tokenization')
     parser.add_argument('--benchmark', action='store_true', help='Run benchmark')
+    parser.add_argument('--index-dir', type=str, default=DEFAULT_INDEX_DIR, help='Token count index directory')
+    parser.add_argument('--no-index', action='store_true', help='Disable the persistent token count index')
     
     args = parser.parse_args()
     
     # Initialize tokenizer
-    tokenizer = GPUTokenizer(device=args.device, model=args.model)
+    tokenizer = GPUTokenizer(
+        device=args.device,
+        model=args.model,
+        index_dir=None if args.no_index else args.index_dir
+    )
     
     if args.benchmark:
         # Run benchmark
@@ -148,6 +202,15 @@ def main():
         print(json.dumps(results))
         return
     
+    # lib/gpu-tokenizer.ts stops this process with SIGTERM; save the index first
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        serve(tokenizer, args.model)
+    finally:
+        tokenizer.close()
+
+def serve(tokenizer: GPUTokenizer, model: str):
+    """Answer JSON count requests from stdin until it closes"""
     # Process requests from stdin
     print("Ready for requests", file=sys.stderr)
     sys.stderr.flush()
@@ -164,7 +227,7 @@ def main():
             
             if action == 'count':
                 texts = request.get('texts', [])
-                counts = tokenizer.count_tokens_batch(texts, args.model)
+                counts = tokenizer.count_tokens_batch(texts, model)
                 response = {
                     'id': request_id,
                     'result': counts
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Cost Forecast - incremental Holt-Winters cost forecasting per (model, team)
+Each series keeps a damped-trend level, a day-of-week seasonal profile and
+an exponentially weighted error variance. A new hourly or daily bucket
+updates state in constant time, and forecasts with prediction intervals are
+read straight from that state without rescanning history.
+Usage: python scripts/python/cost_forecast.py [--db data/usage.db] [--state data/forecast-state.npz]
+"""
+
+import os
+import json
+import argparse
+from pathlib import Path
+from typing import List, Dict, Tuple, Iterable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_STATE_PATH = os.environ.get('METERR_FORECAST_STATE', 'data/forecast-state.npz')
+
+DAY = 86400
+
+# Smoothing for level, trend, day-of-week season, trend damping and error variance
+DEFAULT_PARAMS = {
+    'alpha': 0.3,
+    'beta': 0.05,
+    'gamma': 0.2,
+    'phi': 0.98,
+    'variance': 0.1,
+}
+
+# Two-sided normal quantiles for prediction intervals
+Z_SCORES = {0.8: 1.2816, 0.9: 1.6449, 0.95: 1.96}
+
+SeriesKey = Tuple[str, str]
+
+def day_of_week(day: int) -> int:
+    """Monday=0 weekday for a day number since the epoch (1970-01-01 was a Thursday)"""
+    return (day + 3) % 7
+
+class CostForecaster:
+    """Vectorized additive Holt-Winters state for many daily cost series
+
+    All series share one day clock. Observations accumulate into the open
+    day; when a later day arrives the open day is closed with one
+    vectorized update across every series (absent series observe zero
+    spend), so per-observation work is constant.
+    """
+
+    def __init__(self, params: Optional[Dict[str, float]] = None):
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        self.keys: List[SeriesKey] = []
+        self.index: Dict[SeriesKey, int] = {}
+        self.current_day: Optional[int] = None
+
+        self.level = np.zeros(0)
+        self.trend = np.zeros(0)
+        self.season = np.zeros((0, 7))
+        self.variance = np.zeros(0)
+        self.observed_days = np.zeros(0, dtype=np.int64)
+        self.pending = np.zeros(0)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _slots(self, keys: Sequence[SeriesKey]) -> np.ndarray:
+        """Array positions for keys, allocating state for new series"""
+        new = [key for key in dict.fromkeys(keys) if key not in self.index]
+        if new:
+            for key in new:
+                self.index[key] = len(self.keys)
+                self.keys.append(key)
+            grow = len(new)
+            self.level = np.concatenate([self.level, np.zeros(grow)])
+            self.trend = np.concatenate([self.trend, np.zeros(grow)])
+            self.season = np.concatenate([self.season, np.zeros((grow, 7))])
+            self.variance = np.concatenate([self.variance, np.zeros(grow)])
+            self.observed_days = np.concatenate([self.observed_days, np.zeros(grow, dtype=np.int64)])
+            self.pending = np.concatenate([self.pending, np.zeros(grow)])
+        return np.fromiter((self.index[key] for key in keys), dtype=np.int64, count=len(keys))
+
+    def _close_day(self, y: np.ndarray):
+        """One Holt-Winters step for every series with `y` as the day's spend"""
+        p = self.params
+        dow = day_of_week(self.current_day)
+        fresh = self.observed_days == 0
+
+        s = self.season[:, dow]
+        damped = self.level + p['phi'] * self.trend
+        error = y - (damped + s)
+
+        level = p['alpha'] * (y - s) + (1 - p['alpha']) * damped
+        trend = p['beta'] * (level - self.level) + (1 - p['beta']) * p['phi'] * self.trend
+        season = p['gamma'] * (y - level) + (1 - p['gamma']) * s
+        variance = (1 - p['variance']) * self.variance + p['variance'] * error ** 2
+
+        # A series' first day seeds its level; the interval starts wide
+        self.level = np.where(fresh, y, level)
+        self.trend = np.where(fresh, 0.0, trend)
+        self.season[:, dow] = np.where(fresh, 0.0, season)
+        self.variance = np.where(fresh, y ** 2, variance)
+        self.observed_days += 1
+
+    def _advance(self, day: int):
+        """Close every open day before `day`, treating skipped days as zero spend"""
+        if self.current_day is None:
+            self.current_day = day
+            return
+        while self.current_day < day:
+            self._close_day(self.pending)
+            self.pending = np.zeros(len(self.keys))
+            self.current_day += 1
+
+    def observe(self, timestamp: int, keys: Sequence[SeriesKey], costs: Iterable[float]):
+        """Add spend from a bucket (hourly or daily) starting at `timestamp`"""
+        day = int(timestamp) // DAY
+        if self.current_day is not None and day < self.current_day:
+            raise ValueError("Buckets must arrive in time order; the day is already closed")
+        # Close earlier days first so a series first seen today starts today
+        self._advance(day)
+        slots = self._slots(keys)
+        np.add.at(self.pending, slots, np.asarray(list(costs), dtype=np.float64))
+
+    def set_day_totals(self, timestamp: int, keys: Sequence[SeriesKey], totals: Iterable[float]):
+        """Replace the open day's running totals, e.g. from a re-read day rollup"""
+        day = int(timestamp) // DAY
+        if self.current_day is not None and day < self.current_day:
+            raise ValueError("Buckets must arrive in time order; the day is already closed")
+        # Close earlier days first so a series first seen today starts today
+        self._advance(day)
+        slots = self._slots(keys)
+        self.pending[slots] = np.asarray(list(totals), dtype=np.float64)
+
+    def forecast(self, horizon_days: int, interval: float = 0.8) -> pd.DataFrame:
+        """Projected spend per series over `horizon_days` days, starting with the open day
+
+        The open day counts at least what has already been spent in it. The
+        interval is for the horizon total: each day's shock carries into the
+        level, trend and season of every later day, so the step errors are
+        summed with those weights rather than as independent draws.
+        """
+        if self.current_day is None or not self.keys:
+            return pd.DataFrame(columns=['model', 'team', 'forecast', 'lower', 'upper', 'std'])
+
+        p = self.params
+        # Step 1 is the open day, one step past the last closed day
+        steps = np.arange(1, horizon_days + 1)
+        damping = np.cumsum(p['phi'] ** steps)
+        dows = day_of_week(self.current_day + steps - 1)
+
+        open_day = self.level + p['phi'] * self.trend + self.season[:, dows[0]]
+        total = (
+            horizon_days * self.level
+            + damping.sum() * self.trend
+            + self.season[:, dows].sum(axis=1)
+            + np.maximum(self.pending - open_day, 0.0)
+        )
+        std = np.sqrt(self.variance * self._total_variance_factor(horizon_days))
+        z = Z_SCORES.get(interval, 1.2816)
+
+        ready = self.observed_days > 0
+        total = np.where(ready, np.maximum(total, 0.0), 0.0)
+        return pd.DataFrame({
+            'model': [k[0] for k in self.keys],
+            'team': [k[1] for k in self.keys],
+            'forecast': total,
+            'lower': np.maximum(total - z * std, 0.0),
+            'upper': total + z * std,
+            'std': std,
+        })
+
+    def _total_variance_factor(self, horizon_days: int) -> float:
+        """Variance of the horizon total in units of the one-step error variance
+
+        In error-correction form (ETS(A,Ad,A)) a shock j days back moves the
+        forecast by c_j = alpha + alpha*beta*(phi + ... + phi^j) +
+        gamma*(1 - alpha) on same-weekday lags. The day-k shock reaches the
+        total through itself and the c_j of every later day, so
+        Var(total) = variance * sum over k of (1 + C_(H-k))^2 with C the
+        cumulative c.
+        """
+        p = self.params
+        lags = np.arange(1, horizon_days)
+        c = (
+            p['alpha']
+            + p['alpha'] * p['beta'] * np.cumsum(p['phi'] ** lags)
+            + p['gamma'] * (1 - p['alpha']) * (lags % 7 == 0)
+        )
+        carried = np.concatenate([[0.0], np.cumsum(c)])
+        return float(((1 + carried) ** 2).sum())
+
+    def projected_spend(
+        self,
+        horizon_days: int,
+        model: Optional[str] = None,
+        team: Optional[str] = None,
+        interval: float = 0.8
+    ) -> Dict[str, float]:
+        """Summed forecast and interval for the series matching a model/team filter"""
+        df = self.forecast(horizon_days, interval)
+        if model is not None:
+            df = df[df['model'] == model]
+        if team is not None:
+            df = df[df['team'] == team]
+
+        total = float(df['forecast'].sum())
+        # Series share drivers (traffic, releases), so their errors are not
+        # independent; adding the deviations gives the conservative bound
+        std = float(df['std'].sum())
+        z = Z_SCORES.get(interval, 1.2816)
+        return {'forecast': total, 'lower': max(total - z * std, 0.0), 'upper': total + z * std}
+
+    def sync_from_store(self, store) -> int:
+        """Feed day rollups from a UsageStore, starting at the open day"""
+        if self.current_day is None:
+            start = 0
+        else:
+            start = self.current_day * DAY
+        end = (pd.Timestamp.now(tz='UTC').value // 10**9 // DAY + 1) * DAY
+
+        df = store.query(
+            'day', pd.Timestamp(start, unit='s', tz='UTC'), pd.Timestamp(end, unit='s', tz='UTC'),
+            group_by=('model', 'team')
+        )
+        if df.empty:
+            return 0
+
+        df['day'] = df['timestamp'].dt.as_unit('s').astype('int64')
+        for day, rows in df.groupby('day', sort=True):
+            keys = list(zip(rows['model'], rows['team']))
+            self.set_day_totals(int(day), keys, rows['cost'])
+        return len(df)
+
+    def save(self, path: str = DEFAULT_STATE_PATH):
+        """Persist series state so the next run continues incrementally"""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez(
+            tmp,
+            keys=np.array(json.dumps(self.keys)),
+            meta=np.array(json.dumps({'current_day': self.current_day, 'params': self.params})),
+            level=self.level,
+            trend=self.trend,
+            season=self.season,
+            variance=self.variance,
+            observed_days=self.observed_days,
+            pending=self.pending,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_STATE_PATH) -> 'CostForecaster':
+        """Restore saved state, or start empty if there is none"""
+        if not Path(path).exists():
+            return cls()
+
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            forecaster = cls(meta['params'])
+            forecaster.keys = [tuple(k) for k in json.loads(str(data['keys']))]
+            forecaster.index = {key: i for i, key in enumerate(forecaster.keys)}
+            forecaster.current_day = meta['current_day']
+            forecaster.level = data['level']
+            forecaster.trend = data['trend']
+            forecaster.season = data['season']
+            forecaster.variance = data['variance']
+            forecaster.observed_days = data['observed_days']
+            forecaster.pending = data['pending']
+        return forecaster
+
+def main():
+    from usage_store import UsageStore, DEFAULT_DB_PATH
+
+    parser = argparse.ArgumentParser(description='Cost Forecast')
+    parser.add_argument('--db', type=str, default=DEFAULT_DB_PATH, help='Usage store database')
+    parser.add_argument('--state', type=str, default=DEFAULT_STATE_PATH, help='Forecast state file')
+    parser.add_argument('--days', type=int, default=30, help='Forecast horizon in days')
+
+    args = parser.parse_args()
+
+    forecaster = CostForecaster.load(args.state)
+    rows = forecaster.sync_from_store(UsageStore(args.db))
+    forecaster.save(args.state)
+
+    print(f"Updated {len(forecaster)} series from {rows} day buckets")
+    df = forecaster.forecast(args.days)
+    print(df.sort_values('forecast', ascending=False).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,10 @@ import numpy as np
 from pathlib import Path
 import json
 
+from usage_store import UsageStore, DEFAULT_DB_PATH
+from dashboard_data import RollupCache, downsample_series, heatmap_matrix
+from cost_forecast import CostForecaster, DEFAULT_STATE_PATH
+
 # Page config
 st.set_page_config(
     page_title="Meterr Token Analytics",
@@ -23,6 +27,75 @@ st.set_page_config(
 st.title("📊 Meterr Token Usage Analytics")
 st.markdown("Real-time analysis of LLM token usage and costs")
 
+REPORTS_DIR = Path(__file__).resolve().parents[2] / 'data' / 'usage-reports'
+SAMPLE_MODELS = ['gpt-4', 'gpt-3.5-turbo', 'claude-3-opus', 'claude-3-sonnet']
+
+# Generate sample data (replace with real data loading)
+def generate_sample_data(start, end):
+    np.random.seed(42)
+    dates = pd.date_range(start=start, end=end, freq='h')
+    
+    data = []
+    for date in dates:
+        for model in SAMPLE_MODELS:
+            data.append({
+                'timestamp': date.to_pydatetime(),
+                'model': model,
+                'total_tokens': np.random.randint(100, 10000),
+                'cost': np.random.uniform(0.01, 1.0),
+                'requests': np.random.randint(1, 50)
+            })
+    
+    return data
+
+@st.cache_resource
+def get_store() -> UsageStore:
+    """Open the rollup store, loading provider exports and demo data on first use"""
+    store = UsageStore(DEFAULT_DB_PATH)
+    if store.is_empty():
+        store.ingest_records(generate_sample_data(datetime.now() - timedelta(days=90), datetime.now()))
+    for path in sorted(REPORTS_DIR.glob('*.csv')):
+        store.ingest_csv(str(path))  # unchanged exports are skipped
+    return store
+
+@st.cache_resource
+def get_rollups() -> RollupCache:
+    """Rollup frames shared across reruns and sessions"""
+    return RollupCache(get_store())
+
+@st.cache_data(max_entries=64)
+def load_rollup(level, start, end, model, version):
+    """Rollup rows for a view; `version` invalidates entries after a refresh"""
+    return get_rollups().get(level, start, end, model)
+
+@st.cache_data(max_entries=64)
+def load_series(level, start, end, model, version):
+    """Per-model token series downsampled for plotting"""
+    return downsample_series(load_rollup(level, start, end, model, version), 'tokens')
+
+@st.cache_data(max_entries=64)
+def load_heatmap(start, end, model, version):
+    """Hour x day token matrix downsampled for plotting"""
+    return heatmap_matrix(load_rollup('hour', start, end, model, version))
+
+@st.cache_resource
+def get_forecaster() -> CostForecaster:
+    """Forecast state persisted between runs, caught up with the store"""
+    forecaster = CostForecaster.load(DEFAULT_STATE_PATH)
+    forecaster.sync_from_store(get_store())
+    forecaster.save(DEFAULT_STATE_PATH)
+    return forecaster
+
+@st.cache_data(max_entries=64)
+def load_projections(model, version):
+    """Projected spend with 80% intervals for the dashboard horizons"""
+    forecaster = get_forecaster()
+    return {days: forecaster.projected_spend(days, model=model) for days in (1, 7, 30, 365)}
+
+store = get_store()
+rollups = get_rollups()
+forecaster = get_forecaster()
+
 # Sidebar
 with st.sidebar:
     st.header("Configuration")
@@ -35,54 +108,44 @@ with st.sidebar:
     )
     
     # Model filter
-    models = ['All', 'gpt-4', 'gpt-3.5-turbo', 'claude-3-opus', 'claude-3-sonnet']
+    models = ['All'] + store.models()
     selected_model = st.selectbox("Select Model", models)
     
-    # Refresh button
+    # Chart resolution
+    resolution = st.selectbox("Resolution", ['Auto', 'minute', 'hour', 'day'])
+    
+    # Refresh button: pulls only buckets written since the last fetch
     if st.button("🔄 Refresh Data"):
+        rollups.refresh()
+        forecaster.sync_from_store(store)
+        forecaster.save(DEFAULT_STATE_PATH)
         st.rerun()
 
-# Generate sample data (replace with real data loading)
-def generate_sample_data():
-    np.random.seed(42)
-    dates = pd.date_range(start=date_range[0], end=date_range[1], freq='H')
-    
-    data = []
-    for date in dates:
-        for model in models[1:]:  # Skip 'All'
-            data.append({
-                'timestamp': date,
-                'model': model,
-                'tokens': np.random.randint(100, 10000),
-                'cost': np.random.uniform(0.01, 1.0),
-                'requests': np.random.randint(1, 50)
-            })
-    
-    return pd.DataFrame(data)
-
-df = generate_sample_data()
+start = datetime.combine(date_range[0], datetime.min.time())
+end = datetime.combine(date_range[-1], datetime.min.time()) + timedelta(days=1)
+model_filter = None if selected_model == 'All' else selected_model
+level = store.pick_level(start, end) if resolution == 'Auto' else resolution
 
-# Filter by selected model
-if selected_model != 'All':
-    df = df[df['model'] == selected_model]
+# Each view reads only the rollup level it needs
+daily = load_rollup('day', start, end, model_filter, rollups.version)
 
 # Main content
 col1, col2, col3, col4 = st.columns(4)
 
 with col1:
-    total_tokens = df['tokens'].sum()
+    total_tokens = daily['tokens'].sum()
     st.metric("Total Tokens", f"{total_tokens:,.0f}", "↑ 12.5%")
 
 with col2:
-    total_cost = df['cost'].sum()
+    total_cost = daily['cost'].sum()
     st.metric("Total Cost", f"${total_cost:,.2f}", "↑ 8.3%")
 
 with col3:
-    total_requests = df['requests'].sum()
+    total_requests = daily['requests'].sum()
     st.metric("Total Requests", f"{total_requests:,.0f}", "↑ 15.2%")
 
 with col4:
-    avg_tokens = df['tokens'].mean()
+    avg_tokens = total_tokens / total_requests if total_requests else 0
     st.metric("Avg Tokens/Request", f"{avg_tokens:,.0f}", "↓ 3.1%")
 
 # Charts
@@ -93,15 +156,12 @@ col1, col2 = st.columns(2)
 with col1:
     st.subheader("📈 Token Usage Over Time")
     
-    # Group by date and model
-    daily_usage = df.groupby([pd.Grouper(key='timestamp', freq='D'), 'model'])['tokens'].sum().reset_index()
-    
     fig = px.line(
-        daily_usage,
+        load_series(level, start, end, model_filter, rollups.version),
         x='timestamp',
         y='tokens',
         color='model',
-        title="Daily Token Usage by Model",
+        title=f"Token Usage by Model (per {level})",
         labels={'tokens': 'Tokens', 'timestamp': 'Date'}
     )
     fig.update_layout(height=400)
@@ -111,7 +171,7 @@ with col2:
     st.subheader("💰 Cost Distribution")
     
     # Cost by model
-    cost_by_model = df.groupby('model')['cost'].sum().reset_index()
+    cost_by_model = daily.groupby('model')['cost'].sum().reset_index()
     
     fig = px.pie(
         cost_by_model,
@@ -127,19 +187,25 @@ with col2:
 st.markdown("---")
 st.subheader("📑 Detailed Usage Table")
 
-# Aggregate by hour for display
-hourly_data = df.groupby([pd.Grouper(key='timestamp', freq='H'), 'model']).agg({
-    'tokens': 'sum',
-    'cost': 'sum',
-    'requests': 'sum'
-}).reset_index()
+hourly_data = load_rollup('hour', start, end, model_filter, rollups.version)
+hourly_data = hourly_data[['timestamp', 'model', 'tokens', 'cost', 'requests']].iloc[::-1]
+
+# Paginate so only one page of rows is styled and sent to the browser
+page_col, size_col = st.columns([3, 1])
+with size_col:
+    page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+pages = max(1, -(-len(hourly_data) // page_size))
+with page_col:
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+
+page_data = hourly_data.iloc[(page - 1) * page_size:page * page_size].copy()
 
 # Add cost per token
-hourly_data['cost_per_1k_tokens'] = (hourly_data['cost'] / hourly_data['tokens']) * 1000
+page_data['cost_per_1k_tokens'] = (page_data['cost'] / page_data['tokens']) * 1000
 
 # Display with formatting
 st.dataframe(
-    hourly_data.style.format({
+    page_data.style.format({
         'tokens': '{:,.0f}',
         'cost': '${:.4f}',
         'requests': '{:,.0f}',
@@ -152,22 +218,12 @@ st.dataframe(
 st.markdown("---")
 st.subheader("🌡️ Usage Heatmap")
 
-# Create hourly heatmap data
-heatmap_data = df.copy()
-heatmap_data['hour'] = heatmap_data['timestamp'].dt.hour
-heatmap_data['day'] = heatmap_data['timestamp'].dt.date
-
-heatmap_pivot = heatmap_data.pivot_table(
-    values='tokens',
-    index='hour',
-    columns='day',
-    aggfunc='sum',
-    fill_value=0
-)
+# Hourly heatmap data, long ranges merged by max-per-bucket
+heatmap_pivot = load_heatmap(start, end, model_filter, rollups.version)
 
 fig = go.Figure(data=go.Heatmap(
     z=heatmap_pivot.values,
-    x=[str(d) for d in heatmap_pivot.columns],
+    x=list(heatmap_pivot.columns),
     y=heatmap_pivot.index,
     colorscale='Viridis',
     colorbar=dict(title="Tokens")
@@ -189,25 +245,32 @@ st.subheader("🔮 Cost Predictions")
 col1, col2 = st.columns(2)
 
 with col1:
-    # Simple linear projection
-    daily_avg = df.groupby(pd.Grouper(key='timestamp', freq='D'))['cost'].sum().mean()
+    # Holt-Winters projections with day-of-week seasonality
+    projections = load_projections(model_filter, rollups.version)
+    
+    def projected(days):
+        p = projections[days]
+        return f"${p['forecast']:,.2f} (${p['lower']:,.2f} – ${p['upper']:,.2f})"
     
     st.info(f"""
-    **Based on current usage:**
-    - Daily Average: ${daily_avg:.2f}
-    - Weekly Projection: ${daily_avg * 7:.2f}
-    - Monthly Projection: ${daily_avg * 30:.2f}
-    - Annual Projection: ${daily_avg * 365:.2f}
+    **Forecast from usage history (80% interval):**
+    - Next Day: {projected(1)}
+    - Weekly Projection: {projected(7)}
+    - Monthly Projection: {projected(30)}
+    - Annual Projection: {projected(365)}
     """)
+    
+    monthly = projections[30]['forecast']
+    annual = projections[365]['forecast']
 
 with col2:
     # Savings calculation
     st.success(f"""
     **Potential Savings with Meterr:**
-    - Current Monthly Cost: ${daily_avg * 30:.2f}
-    - With 30% Optimization: ${daily_avg * 30 * 0.7:.2f}
-    - Monthly Savings: ${daily_avg * 30 * 0.3:.2f}
-    - Annual Savings: ${daily_avg * 365 * 0.3:.2f}
+    - Projected Monthly Cost: ${monthly:,.2f}
+    - With 30% Optimization: ${monthly * 0.7:,.2f}
+    - Monthly Savings: ${monthly * 0.3:,.2f}
+    - Annual Savings: ${annual * 0.3:,.2f}
     """)
 
 # Footer
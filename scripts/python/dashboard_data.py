@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Dashboard Data - incremental, downsampled access to the usage rollup store
+Keeps fetched rollup frames in memory, pulls only new or rewritten buckets on refresh
+and reduces series/heatmaps to a fixed number of points before plotting.
+Used by: streamlit run scripts/python/dashboard.py
+"""
+
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from usage_store import UsageStore, ROLLUP_LEVELS, to_utc
+
+# Points per plotted series and columns per heatmap after downsampling
+MAX_SERIES_POINTS = 500
+MAX_HEATMAP_COLUMNS = 120
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices kept by Largest-Triangle-Three-Buckets downsampling"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (threshold - 2)
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int(np.floor((i + 1) * every)) + 1
+        next_end = min(int(np.floor((i + 2) * every)) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        start = int(np.floor(i * every)) + 1
+        end = int(np.floor((i + 1) * every)) + 1
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+
+    return kept
+
+def downsample_series(
+    df: pd.DataFrame,
+    y: str,
+    group: str = 'model',
+    max_points: int = MAX_SERIES_POINTS
+) -> pd.DataFrame:
+    """LTTB-downsample each group's time series to at most `max_points` rows"""
+    if df.empty:
+        return df
+
+    parts = []
+    for _, part in df.groupby(group, sort=False):
+        part = part.sort_values('timestamp')
+        x = part['timestamp'].astype('int64').to_numpy()
+        parts.append(part.iloc[lttb(x, part[y].to_numpy(), max_points)])
+    return pd.concat(parts, ignore_index=True)
+
+def heatmap_matrix(
+    hourly: pd.DataFrame,
+    value: str = 'tokens',
+    max_columns: int = MAX_HEATMAP_COLUMNS
+) -> pd.DataFrame:
+    """Hour-of-day x day matrix, merging days by max-per-bucket past `max_columns`"""
+    if hourly.empty:
+        return pd.DataFrame(index=range(24))
+
+    frame = pd.DataFrame({
+        'hour': hourly['timestamp'].dt.hour,
+        'day': hourly['timestamp'].dt.normalize(),
+        value: hourly[value]
+    })
+    pivot = frame.pivot_table(values=value, index='hour', columns='day', aggfunc='sum', fill_value=0)
+
+    days = pivot.shape[1]
+    if days > max_columns:
+        # Keep peaks visible rather than averaging them away
+        width = -(-days // max_columns)
+        labels = pivot.columns[::width]
+        groups = np.arange(days) // width
+        pivot = pivot.T.groupby(groups).max().T
+        pivot.columns = labels
+
+    pivot.columns = [d.strftime('%Y-%m-%d') for d in pivot.columns]
+    return pivot
+
+class RollupCache:
+    """In-memory rollup frames per (level, model) that only fetch unseen buckets
+
+    A frame covers a contiguous [loaded_start, loaded_end) range. Widening
+    the requested range fetches just the missing edges, and `refresh()`
+    re-reads from the newest (possibly still filling) bucket onwards, or
+    from the earliest bucket the store reports as rewritten since the last
+    refresh when late or backfilled events landed further back.
+
+    Naive datetimes passed in are local time; frame timestamps are naive UTC
+    like `UsageStore.query`.
+    """
+
+    def __init__(self, store: UsageStore):
+        self.store = store
+        self.version = 0
+        self._frames: Dict[Tuple[str, Optional[str]], Tuple[pd.DataFrame, pd.Timestamp, pd.Timestamp]] = {}
+        self._lock = threading.Lock()
+        self._seq, _ = store.changes_since(0)
+
+    def _fetch(self, level: str, start: pd.Timestamp, end: pd.Timestamp, model: Optional[str]) -> pd.DataFrame:
+        return self.store.query(level, start, end, [model] if model else None)
+
+    def get(self, level: str, start: datetime, end: datetime, model: Optional[str] = None) -> pd.DataFrame:
+        """Rollup rows for [start, end), fetching only buckets not already held"""
+        width = timedelta(seconds=ROLLUP_LEVELS[level])
+        start = pd.Timestamp(to_utc(start)).floor(width)
+        end = pd.Timestamp(to_utc(end))
+        key = (level, model)
+
+        with self._lock:
+            cached = self._frames.get(key)
+            if cached is None:
+                frame, lo, hi = self._fetch(level, start, end, model), start, end
+            else:
+                frame, lo, hi = cached
+                pieces = [frame]
+                if start < lo:
+                    pieces.insert(0, self._fetch(level, start, lo, model))
+                    lo = start
+                if end > hi:
+                    pieces.append(self._fetch(level, hi, end, model))
+                    hi = end
+                if len(pieces) > 1:
+                    frame = pd.concat([p for p in pieces if not p.empty] or [frame], ignore_index=True)
+            self._frames[key] = (frame, lo, hi)
+
+        mask = (frame['timestamp'] >= start.tz_convert(None)) & (frame['timestamp'] < end.tz_convert(None))
+        return frame[mask].reset_index(drop=True)
+
+    def refresh(self) -> int:
+        """Pull buckets written since the last fetch; returns the new data version"""
+        with self._lock:
+            seq, changed = self.store.changes_since(self._seq)
+            for key, (frame, lo, hi) in list(self._frames.items()):
+                level, model = key
+                since = frame['timestamp'].max().tz_localize('UTC') if not frame.empty else lo
+                if level in changed:
+                    first = pd.Timestamp(changed[level][0], unit='s', tz='UTC')
+                    since = min(since, max(first, lo))
+                now = max(hi, pd.Timestamp.now(tz='UTC') + timedelta(seconds=ROLLUP_LEVELS[level]))
+                fresh = self._fetch(level, since, now, model)
+                kept = frame[frame['timestamp'] < since.tz_convert(None)]
+                frame = pd.concat([kept, fresh], ignore_index=True) if not fresh.empty else kept
+                self._frames[key] = (frame, lo, now)
+            self._seq = seq
+            self.version += 1
+            return self.version
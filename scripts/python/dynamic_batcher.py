@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Dynamic Batcher - groups concurrent inference requests into padded batches
+Requests queue per model; a worker thread forms a batch once `max_batch_size`
+are waiting or the oldest has waited `max_wait` seconds, picking requests of
+similar token length so little compute is spent on padding.
+Used by: python scripts/python/model_tester.py --benchmark
+"""
+
+import time
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+class _Request:
+    __slots__ = ('item', 'length', 'arrived', 'future')
+
+    def __init__(self, item: Any, length: int):
+        self.item = item
+        self.length = length
+        self.arrived = time.monotonic()
+        self.future: Future = Future()
+
+def pick_bucket(lengths: Sequence[int], anchor: int, size: int) -> Tuple[int, int]:
+    """Least-padding window of `size` consecutive sorted lengths that contains `anchor`
+
+    `lengths` must be sorted ascending. Padding for a window is its longest
+    length times its size minus the real tokens in it.
+    """
+    n = len(lengths)
+    size = min(size, n)
+    sums = np.concatenate([[0], np.cumsum(lengths)])
+    starts = np.arange(max(0, anchor - size + 1), min(anchor, n - size) + 1)
+    ends = starts + size
+    padding = np.asarray(lengths)[ends - 1] * size - (sums[ends] - sums[starts])
+    best = int(starts[np.argmin(padding)])
+    return best, best + size
+
+class DynamicBatcher:
+    """Batches items submitted from any thread and runs them on one worker thread
+
+    `run_batch` receives a list of items and returns one result per item in
+    the same order. The oldest waiting request is always in the next batch,
+    so nothing starves while similar-length requests are grouped around it.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], List[Any]],
+        length: Callable[[Any], int] = len,
+        max_batch_size: int = 16,
+        max_wait: float = 0.02,
+        max_batch_tokens: Optional[int] = None,
+        name: str = 'batcher'
+    ):
+        self.run_batch = run_batch
+        self.length = length
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_batch_tokens = max_batch_tokens
+
+        self.batches = 0
+        self.items = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+        self._pending: List[_Request] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item; the future resolves to its result"""
+        request = _Request(item, self.length(item))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Batcher is closed")
+            self._pending.append(request)
+            if len(self._pending) >= self.max_batch_size or len(self._pending) == 1:
+                self._cond.notify()
+        return request.future
+
+    def map(self, items: Sequence[Any]) -> List[Any]:
+        """Submit all items and wait for their results in input order"""
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _take_batch(self) -> List[_Request]:
+        """Remove the next batch from the pending list (caller holds the lock)"""
+        pending = self._pending
+        order = sorted(range(len(pending)), key=lambda i: pending[i].length)
+        lengths = [pending[i].length for i in order]
+        anchor = order.index(0)
+
+        size = min(self.max_batch_size, len(pending))
+        start, end = pick_bucket(lengths, anchor, size)
+        if self.max_batch_tokens:
+            # Shrink until the padded batch fits the token budget
+            while size > 1 and lengths[end - 1] * size > self.max_batch_tokens:
+                size -= 1
+                start, end = pick_bucket(lengths, anchor, size)
+
+        chosen = set(order[start:end])
+        batch = [pending[i] for i in sorted(chosen)]
+        self._pending = [r for i, r in enumerate(pending) if i not in chosen]
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                deadline = self._pending[0].arrived + self.max_wait
+                while len(self._pending) < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+
+            lengths = [r.length for r in batch]
+            self.batches += 1
+            self.items += len(batch)
+            self.real_tokens += sum(lengths)
+            self.padded_tokens += max(lengths) * len(batch)
+
+            try:
+                results = list(self.run_batch([r.item for r in batch]))
+                if len(results) != len(batch):
+                    # Results can't be matched to requests, so fail the whole batch
+                    raise ValueError(f"run_batch returned {len(results)} results for a batch of {len(batch)}")
+                for request, result in zip(batch, results):
+                    request.future.set_result(result)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def stats(self) -> Dict[str, float]:
+        """Batch counts and the share of padded compute spent on real tokens"""
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+            'padding_efficiency': self.real_tokens / self.padded_tokens if self.padded_tokens else 1.0,
+        }
+
+    def close(self):
+        """Finish pending work and stop the worker thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
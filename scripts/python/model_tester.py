@@ -5,70 +5,178 @@ Usage: python scripts/python/model_tester.py
 """
 
 import torch
-from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
+import pandas as pd
+from transformers import AutoTokenizer, AutoModelForCausalLM
 import time
 import json
+import threading
 from typing import Dict, Any, List
 import argparse
 from pathlib import Path
 
+from dynamic_batcher import DynamicBatcher
+
+# Small models for testing, loaded on first use
+MODEL_CONFIGS = {
+    'simple': 'gpt2',  # Small, fast model
+    'medium': 'microsoft/DialoGPT-medium',  # Medium complexity
+    # Add more models as needed
+}
+
 class ModelTester:
     """Test different models locally for routing decisions"""
     
-    def __init__(self, use_gpu: bool = True):
+    def __init__(
+        self,
+        use_gpu: bool = True,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 20.0,
+        max_new_tokens: int = 100
+    ):
         self.device = 'cuda' if (use_gpu and torch.cuda.is_available()) else 'cpu'
         print(f"🎮 Using device: {self.device}")
+        self.model_configs = dict(MODEL_CONFIGS)
         self.models = {}
-        self._load_models()
+        self.batchers: Dict[str, DynamicBatcher] = {}
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_new_tokens = max_new_tokens
+        self.load_errors: Dict[str, Exception] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
     
-    def _load_models(self):
-        """Load small models for testing"""
-        print("Loading test models...")
+    def get_model(self, name: str):
+        """Tokenizer and model for a config name, loading them on first use
+
+        A model that fails to load is not retried; later calls raise at once.
+        """
+        if name not in self.model_configs:
+            raise ValueError(f"Model {name} not available")
         
-        # Load small models for testing
-        model_configs = {
-            'simple': 'gpt2',  # Small, fast model
-            'medium': 'microsoft/DialoGPT-medium',  # Medium complexity
-            # Add more models as needed
-        }
+        loaded = self.models.get(name)
+        if loaded is not None:
+            return loaded
         
-        for name, model_id in model_configs.items():
-            try:
+        # Downloads hold a per-model lock so other models and batchers aren't blocked
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            if name in self.load_errors:
+                raise RuntimeError(f"Model {name} failed to load: {self.load_errors[name]}")
+            if name not in self.models:
+                model_id = self.model_configs[name]
                 print(f"Loading {name} ({model_id})...")
-                self.models[name] = pipeline(
-                    'text-generation',
-                    model=model_id,
-                    device=0 if self.device == 'cuda' else -1,
-                    max_new_tokens=100
-                )
+                try:
+                    self.models[name] = self._load(model_id)
+                except Exception as e:
+                    print(f"⚠️ Could not load {name}: {e}")
+                    self.load_errors[name] = e
+                    raise
                 print(f"✅ Loaded {name}")
-            except Exception as e:
-                print(f"⚠️ Could not load {name}: {e}")
+        return self.models[name]
+    
+    def _load(self, model_id: str):
+        tokenizer = AutoTokenizer.from_pretrained(model_id)
+        # Decoder-only models must be left-padded to generate in batches
+        tokenizer.padding_side = 'left'
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(model_id).to(self.device)
+        model.eval()
+        return tokenizer, model
+    
+    def is_available(self, name: str) -> bool:
+        """Whether a model is configured and loads"""
+        try:
+            self.get_model(name)
+            return True
+        except Exception:
+            return False
+    
+    def _encode(self, name: str, prompts: List[str]) -> List[List[int]]:
+        """Token ids for prompts in one batched tokenizer call, leaving room to generate"""
+        tokenizer, model = self.get_model(name)
+        limit = getattr(model.config, 'n_positions', None) or tokenizer.model_max_length
+        return tokenizer(
+            prompts,
+            truncation=True,
+            max_length=max(limit - self.max_new_tokens, 1),
+            return_attention_mask=False
+        )['input_ids']
+    
+    def _generate(self, name: str, batch: List[List[int]]) -> List[Dict[str, Any]]:
+        """Generate for a batch of token id lists, counting real output tokens per row"""
+        tokenizer, model = self.get_model(name)
+        inputs = tokenizer.pad({'input_ids': batch}, padding=True, return_tensors='pt').to(self.device)
+        
+        start_time = time.time()
+        with torch.inference_mode():
+            output = model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=True,
+                temperature=0.7,
+                pad_token_id=tokenizer.pad_token_id
+            )
+        elapsed = time.time() - start_time
+        
+        generated = output[:, inputs['input_ids'].shape[1]:].cpu()
+        results = []
+        for ids, row in zip(batch, generated):
+            # Rows that finish early are padded out after their first EOS
+            ends = (row == tokenizer.eos_token_id).nonzero()
+            count = int(ends[0]) + 1 if len(ends) else len(row)
+            results.append({
+                'response': tokenizer.decode(list(ids) + row[:count].tolist(), skip_special_tokens=True),
+                'input_tokens': len(ids),
+                'output_tokens': count,
+                'batch_size': len(batch),
+                'seconds': elapsed
+            })
+        # Every row shares the batch's elapsed time, so throughput is only meaningful per batch
+        batch_tokens = sum(r['output_tokens'] for r in results)
+        for r in results:
+            r['batch_output_tokens'] = batch_tokens
+        return results
+    
+    def get_batcher(self, name: str) -> DynamicBatcher:
+        """Dynamic batcher feeding one model, created on first use"""
+        with self._lock:
+            if name not in self.batchers:
+                self.batchers[name] = DynamicBatcher(
+                    lambda batch: self._generate(name, batch),
+                    max_batch_size=self.max_batch_size,
+                    max_wait=self.max_wait,
+                    name=f"batcher-{name}"
+                )
+        return self.batchers[name]
+    
+    def close(self):
+        """Stop batcher worker threads"""
+        for batcher in self.batchers.values():
+            batcher.close()
     
     def test_prompt(self, prompt: str, model_name: str = None) -> Dict[str, Any]:
         """Test a prompt with specified model"""
-        if model_name and model_name not in self.models:
+        if model_name and model_name not in self.model_configs:
             raise ValueError(f"Model {model_name} not available")
         
-        if model_name:
-            models_to_test = {model_name: self.models[model_name]}
-        else:
-            models_to_test = self.models
-        
+        models_to_test = [model_name] if model_name else list(self.model_configs)
         results = {}
         
-        for name, model in models_to_test.items():
+        for name in models_to_test:
             print(f"\nTesting with {name}...")
             
-            start_time = time.time()
             try:
-                response = model(prompt, max_new_tokens=100, do_sample=True, temperature=0.7)
-                elapsed = time.time() - start_time
+                result = self._generate(name, self._encode(name, [prompt]))[0]
+                elapsed = result['seconds']
                 
                 results[name] = {
-                    'response': response[0]['generated_text'],
+                    'response': result['response'],
                     'time': f"{elapsed:.3f}s",
-                    'tokens_per_second': len(response[0]['generated_text'].split()) / elapsed
+                    'tokens_per_second': result['output_tokens'] / elapsed if elapsed else 0,
+                    'input_tokens': result['input_tokens'],
+                    'output_tokens': result['output_tokens']
                 }
             except Exception as e:
                 results[name] = {
@@ -113,30 +221,73 @@ class ModelTester:
             return 'simple'
     
     def test_routing_logic(self, test_prompts: List[str]) -> pd.DataFrame:
-        """Test routing logic on multiple prompts"""
-        import pandas as pd
-        
-        results = []
-        
+        """Test routing logic on multiple prompts, batching them per routed model"""
+        routes = []
         for prompt in test_prompts:
             complexity = self.classify_complexity(prompt)
             
-            # Test with appropriate model
-            model_name = complexity if complexity in self.models else 'simple'
-            response_data = self.test_prompt(prompt, model_name)
+            # Test with appropriate model, falling back to 'simple' if it isn't available
+            model_name = complexity if complexity in self.model_configs else 'simple'
+            if model_name != 'simple' and not self.is_available(model_name):
+                model_name = 'simple'
+            routes.append((complexity, model_name))
+        
+        start_time = time.time()
+        futures = [None] * len(test_prompts)
+        errors = [None] * len(test_prompts)
+        for model_name in dict.fromkeys(m for _, m in routes):
+            indices = [i for i, (_, m) in enumerate(routes) if m == model_name]
+            try:
+                encoded = self._encode(model_name, [test_prompts[i] for i in indices])
+                batcher = self.get_batcher(model_name)
+            except Exception as e:
+                for i in indices:
+                    errors[i] = str(e)
+                continue
+            for i, ids in zip(indices, encoded):
+                futures[i] = batcher.submit(ids)
+        
+        results = []
+        for i, (prompt, (complexity, model_name), future) in enumerate(zip(test_prompts, routes, futures)):
+            response_time, output_tokens, batch_size, batch_tokens_per_second = 'N/A', 0, 0, 0
+            if future is not None:
+                try:
+                    data = future.result()
+                    response_time = f"{data['seconds']:.3f}s"
+                    output_tokens = data['output_tokens']
+                    batch_size = data['batch_size']
+                    batch_tokens_per_second = data['batch_output_tokens'] / data['seconds'] if data['seconds'] else 0
+                except Exception as e:
+                    print(f"⚠️ {model_name} failed: {e}")
+                    errors[i] = str(e)
             
             results.append({
                 'prompt': prompt[:50] + '...' if len(prompt) > 50 else prompt,
                 'complexity': complexity,
                 'model_used': model_name,
-                'response_time': response_data[model_name]['time']
+                'response_time': response_time,
+                'batch_size': batch_size,
+                'output_tokens': output_tokens,
+                'batch_tokens_per_second': batch_tokens_per_second,
+                'error': errors[i]
             })
+        wall = time.time() - start_time
         
-        return pd.DataFrame(results)
+        df = pd.DataFrame(results)
+        total_tokens = int(df['output_tokens'].sum()) if len(df) else 0
+        df.attrs['summary'] = {
+            'prompts': len(df),
+            'failed': int(df['error'].notna().sum()) if len(df) else 0,
+            'seconds': wall,
+            'output_tokens': total_tokens,
+            'tokens_per_second': total_tokens / wall if wall else 0,
+            'batchers': {name: b.stats() for name, b in self.batchers.items()}
+        }
+        return df
     
-    def benchmark_routing(self) -> None:
+    def benchmark_routing(self, test_prompts: List[str] = None) -> None:
         """Benchmark routing decisions"""
-        test_prompts = [
+        test_prompts = test_prompts or [
             "Hello, how are you?",  # Simple
             "What is the capital of France?",  # Simple
             "Explain quantum computing in simple terms.",  # Medium
@@ -147,7 +298,16 @@ class ModelTester:
         print("\n🏁 Testing routing logic...")
         df = self.test_routing_logic(test_prompts)
         print("\nRouting Results:")
-        print(df.to_string())
+        print(df.head(50).to_string())
+        
+        summary = df.attrs['summary']
+        print(f"\n{summary['prompts']} prompts in {summary['seconds']:.1f}s: "
+              f"{summary['output_tokens']} tokens generated, {summary['tokens_per_second']:.1f} tokens/sec")
+        if summary['failed']:
+            print(f"⚠️ {summary['failed']} prompts failed; see the error column")
+        for name, stats in summary['batchers'].items():
+            print(f"  {name}: {stats['batches']} batches, avg size {stats['avg_batch_size']:.1f}, "
+                  f"padding efficiency {stats['padding_efficiency']:.0%}")
 
 def main():
     parser = argparse.ArgumentParser(description='Model Tester')
@@ -155,13 +315,23 @@ def main():
     parser.add_argument('--model', type=str, help='Specific model to use')
     parser.add_argument('--benchmark', action='store_true', help='Run routing benchmark')
     parser.add_argument('--no-gpu', action='store_true', help='Disable GPU usage')
+    parser.add_argument('--prompts-file', type=str, help='Benchmark prompts, one per line')
+    parser.add_argument('--batch-size', type=int, default=16, help='Max prompts per generation batch')
+    parser.add_argument('--max-wait-ms', type=float, default=20.0, help='Max time a prompt waits for its batch to fill')
     
     args = parser.parse_args()
     
-    tester = ModelTester(use_gpu=not args.no_gpu)
+    tester = ModelTester(
+        use_gpu=not args.no_gpu,
+        max_batch_size=args.batch_size,
+        max_wait_ms=args.max_wait_ms
+    )
     
     if args.benchmark:
-        tester.benchmark_routing()
+        prompts = None
+        if args.prompts_file:
+            prompts = [line.strip() for line in Path(args.prompts_file).read_text().splitlines() if line.strip()]
+        tester.benchmark_routing(prompts)
     
     elif args.prompt:
         complexity = tester.classify_complexity(args.prompt)
@@ -178,7 +348,7 @@ def main():
     else:
         # Interactive mode
         print("\n🤖 Interactive Model Tester")
-        print("Available models:", list(tester.models.keys()))
+        print("Available models:", list(tester.model_configs.keys()))
         
         while True:
             prompt = input("\nEnter prompt (or 'quit' to exit): ")
@@ -192,6 +362,8 @@ def main():
             for model_name, data in results.items():
                 print(f"\n{model_name}: {data['response'][:100]}...")
                 print(f"Time: {data['time']}")
+    
+    tester.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
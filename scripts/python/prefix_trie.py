@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Prefix Trie - token-level radix tree over a prompt corpus
+Estimates how much of a prompt dataset could be served from a provider's
+prompt cache and where cache breakpoints pay off.
+Used by: python scripts/python/token_analyzer.py --file prompts.csv --prefix-cache
+"""
+
+from typing import List, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+from pricing import CACHE_PRICING, DEFAULT_MIN_PREFIX_TOKENS
+
+# Prefixes longer than this rarely matter for caching and only cost memory
+DEFAULT_MAX_DEPTH = 8192
+DEFAULT_MAX_NODES = 2_000_000
+
+class _Node:
+    __slots__ = ('edge', 'count', 'children', 'last_seen', 'writes')
+
+    def __init__(self, edge: np.ndarray, ttl_count: int):
+        self.edge = edge
+        self.count = 0
+        self.children: Dict[int, '_Node'] = {}
+        self.last_seen = [None] * ttl_count
+        self.writes = [0] * ttl_count
+
+class PrefixTrie:
+    """Streaming radix tree of prompt token prefixes
+
+    Each node stores a run of tokens shared by `count` prompts plus a simple
+    cache simulation per TTL: a visit more than `ttl_seconds` after the
+    previous one counts as a cache write, anything sooner as a read. Prompts
+    must be inserted in timestamp order. Without timestamps every prompt is
+    treated as arriving inside one window, so savings are an upper bound and
+    the report says so.
+
+    Only prefixes of at least `min_prefix_tokens` can be cached: the first
+    node at or past that depth carries the whole prefix above it, and
+    shallower segments save nothing on their own.
+
+    Memory stays bounded by `max_nodes`: when exceeded, branches seen fewer
+    than `prune_threshold` times are dropped and the threshold doubles, so
+    reported savings are a lower bound.
+    """
+
+    def __init__(
+        self,
+        max_nodes: int = DEFAULT_MAX_NODES,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        pricing: Dict[str, Dict[str, float]] = CACHE_PRICING,
+        min_prefix_tokens: int = DEFAULT_MIN_PREFIX_TOKENS
+    ):
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.pricing = pricing
+        self.min_prefix_tokens = min_prefix_tokens
+        self.ttls = [p['ttl_seconds'] for p in pricing.values()]
+
+        self.root = _Node(np.empty(0, dtype=np.int32), len(self.ttls))
+        self.node_count = 0
+        self.prune_threshold = 2
+
+        self.prompts = 0
+        self.total_tokens = 0
+        self.pruned_nodes = 0
+
+        # None until the first insert, then whether prompts carry timestamps
+        self.timed: Optional[bool] = None
+        self.last_timestamp = float('-inf')
+
+    def _visit(self, node: _Node, timestamp: float):
+        node.count += 1
+        for i, ttl in enumerate(self.ttls):
+            last = node.last_seen[i]
+            if last is None or timestamp - last > ttl:
+                node.writes[i] += 1
+            node.last_seen[i] = timestamp
+
+    def insert(self, tokens: Sequence[int], timestamp: Optional[float] = None):
+        """Add one prompt's tokens; timestamps (seconds) must not decrease"""
+        timed = timestamp is not None
+        if self.timed is None:
+            self.timed = timed
+        elif timed != self.timed:
+            raise ValueError("Either every prompt has a timestamp or none does")
+        if timed:
+            if timestamp < self.last_timestamp:
+                raise ValueError(
+                    f"Prompts must be inserted in timestamp order ({timestamp} after {self.last_timestamp})"
+                )
+            self.last_timestamp = timestamp
+        else:
+            timestamp = 0.0
+
+        self.prompts += 1
+        self.total_tokens += len(tokens)
+
+        tokens = np.asarray(tokens[:self.max_depth], dtype=np.int32)
+        node = self.root
+        node.count += 1
+        i = 0
+
+        while i < len(tokens):
+            child = node.children.get(int(tokens[i]))
+            if child is None:
+                leaf = _Node(tokens[i:].copy(), len(self.ttls))
+                self._visit(leaf, timestamp)
+                node.children[int(tokens[i])] = leaf
+                self.node_count += 1
+                break
+
+            edge = child.edge
+            n = min(len(edge), len(tokens) - i)
+            mismatch = np.flatnonzero(edge[:n] != tokens[i:i + n])
+            k = int(mismatch[0]) if len(mismatch) else n
+
+            if k < len(edge):
+                # Split the edge where this prompt diverges (or ends)
+                mid = _Node(edge[:k].copy(), len(self.ttls))
+                mid.count = child.count
+                mid.last_seen = list(child.last_seen)
+                mid.writes = list(child.writes)
+                child.edge = edge[k:].copy()
+                mid.children[int(child.edge[0])] = child
+                node.children[int(tokens[i])] = mid
+                self.node_count += 1
+                child = mid
+
+            self._visit(child, timestamp)
+            node = child
+            i += k
+
+        if self.node_count > self.max_nodes:
+            self._prune()
+
+    def _prune(self):
+        """Drop low-frequency branches until back under the node budget"""
+        target = int(self.max_nodes * 0.75)
+        while self.node_count > target:
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                for key, child in list(node.children.items()):
+                    if child.count < self.prune_threshold:
+                        removed = self._subtree_size(child)
+                        del node.children[key]
+                        self.node_count -= removed
+                        self.pruned_nodes += removed
+                    else:
+                        stack.append(child)
+            self.prune_threshold *= 2
+
+    @staticmethod
+    def _subtree_size(node: _Node) -> int:
+        size = 0
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            size += 1
+            stack.extend(current.children.values())
+        return size
+
+    def _cacheable_tokens(self, node: _Node, depth: int) -> int:
+        """Tokens this node adds to a cacheable prefix ending at `depth`"""
+        if depth < self.min_prefix_tokens:
+            return 0
+        start = depth - len(node.edge)
+        # The first node past the minimum brings the uncacheable prefix above it along
+        return depth if start < self.min_prefix_tokens else len(node.edge)
+
+    def _segment_savings(self, node: _Node, depth: int, tier: int) -> float:
+        """Token-equivalents saved by caching this node's edge under a pricing tier"""
+        pricing = list(self.pricing.values())[tier]
+        writes = node.writes[tier]
+        reads = node.count - writes
+        return self._cacheable_tokens(node, depth) * (reads * (1 - pricing['read']) - writes * (pricing['write'] - 1))
+
+    def _walk(self):
+        """Yield (node, parent path, depth) for every node below the root
+
+        The path holds (ancestor, ancestor depth) pairs; depths count tokens
+        up to the end of each node's edge.
+        """
+        stack = [(child, (), 0) for child in self.root.children.values()]
+        while stack:
+            node, path, depth = stack.pop()
+            depth += len(node.edge)
+            yield node, path, depth
+            child_path = path + ((node, depth),)
+            stack.extend((child, child_path, depth) for child in node.children.values())
+
+    def shared_prefix_tokens(self) -> int:
+        """Prompt tokens that repeat a prefix already seen earlier in the corpus"""
+        return sum((node.count - 1) * len(node.edge) for node, _, _ in self._walk())
+
+    def best_breakpoints(self, tier: str = '5m', k: int = 4, candidates: int = 200) -> List[Dict[str, Any]]:
+        """Greedy choice of up to `k` cache breakpoints by marginal savings
+
+        A breakpoint at a node caches the whole prefix up to it, so its value
+        is the summed savings of every segment on the path that an earlier
+        pick does not already cover.
+        """
+        t = list(self.pricing).index(tier)
+
+        scored = []
+        for node, path, depth in self._walk():
+            if node.count < 2 or depth < self.min_prefix_tokens:
+                continue
+            segments = path + ((node, depth),)
+            total = sum(self._segment_savings(seg, d, t) for seg, d in segments)
+            if total > 0:
+                scored.append((total, node, segments, depth))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        scored = scored[:candidates]
+
+        covered = set()
+        chosen = []
+        for _ in range(k):
+            best = None
+            for total, node, segments, depth in scored:
+                if id(node) in covered:
+                    continue
+                gain = sum(self._segment_savings(seg, d, t) for seg, d in segments if id(seg) not in covered)
+                if gain > 0 and (best is None or gain > best[0]):
+                    best = (gain, node, segments, depth)
+            if best is None:
+                break
+
+            gain, node, segments, depth = best
+            covered.update(id(seg) for seg, _ in segments)
+            chosen.append({
+                'node': node,
+                'prefix_tokens': np.concatenate([seg.edge for seg, _ in segments]),
+                'depth': depth,
+                'prompts': node.count,
+                'writes': node.writes[t],
+                'reads': node.count - node.writes[t],
+                'saved_tokens': gain
+            })
+
+        return chosen
+
+    def projected_savings(self, tier: str) -> float:
+        """Input token-equivalents saved if every profitable shared prefix were cached"""
+        t = list(self.pricing).index(tier)
+        total = 0.0
+        for node, path, depth in self._walk():
+            # Caching a segment requires caching everything before it; segments
+            # above the minimum length are carried by the first one past it
+            if node.count >= 2 and all(
+                self._segment_savings(seg, d, t) > 0
+                for seg, d in path if self._cacheable_tokens(seg, d)
+            ):
+                total += max(self._segment_savings(node, depth, t), 0.0)
+        return total
+
+    def report(self, cost_per_1k: float, decode=None, breakpoints: int = 4) -> Dict[str, Any]:
+        """Summary of shared-prefix mass, breakpoints and projected savings"""
+        shared = self.shared_prefix_tokens()
+        baseline_cost = self.total_tokens / 1000 * cost_per_1k
+
+        tiers = {}
+        for tier in self.pricing:
+            saved = self.projected_savings(tier)
+            points = []
+            for bp in self.best_breakpoints(tier, k=breakpoints):
+                point = {
+                    'depth_tokens': bp['depth'],
+                    'prompts': bp['prompts'],
+                    'cache_writes': bp['writes'],
+                    'cache_reads': bp['reads'],
+                    'saved': bp['saved_tokens'] / 1000 * cost_per_1k
+                }
+                if decode is not None:
+                    try:
+                        point['prefix_tail'] = decode(bp['prefix_tokens'][-24:].tolist())
+                    except Exception:
+                        pass
+                points.append(point)
+
+            tiers[tier] = {
+                'saved_tokens_equivalent': saved,
+                'saved': saved / 1000 * cost_per_1k,
+                'saved_pct': (saved / self.total_tokens) if self.total_tokens else 0.0,
+                'breakpoints': points
+            }
+
+        return {
+            'prompts': self.prompts,
+            'total_tokens': self.total_tokens,
+            'shared_prefix_tokens': shared,
+            'shared_prefix_pct': (shared / self.total_tokens) if self.total_tokens else 0.0,
+            'baseline_cost': baseline_cost,
+            'nodes': self.node_count,
+            'pruned_nodes': self.pruned_nodes,
+            'min_prefix_tokens': self.min_prefix_tokens,
+            # Without timestamps the TTL simulation cannot expire anything
+            'timestamps': bool(self.timed),
+            'upper_bound': not self.timed,
+            'tiers': tiers
+        }
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Pricing - provider token prices shared by the analysis and storage scripts
+Used by: usage_store.py (pricing provider exports) and prefix_trie.py
+(prompt-cache savings)
+"""
+
+from typing import Dict
+
+# Per 1K tokens; provider exports carry token counts only
+PROVIDER_COSTS = {
+    'gpt-4o-mini': {'input': 0.00015, 'output': 0.0006},
+    'gpt-4o': {'input': 0.005, 'output': 0.015},
+    'gpt-4-turbo': {'input': 0.01, 'output': 0.03},
+    'gpt-4-0125-preview': {'input': 0.01, 'output': 0.03},
+    'gpt-4-1106-preview': {'input': 0.01, 'output': 0.03},
+    'gpt-4-32k': {'input': 0.06, 'output': 0.12},
+    'gpt-4': {'input': 0.03, 'output': 0.06},
+    'gpt-3.5-turbo': {'input': 0.0005, 'output': 0.0015},
+    'claude-opus-4': {'input': 0.015, 'output': 0.075},
+    'claude-sonnet-4': {'input': 0.003, 'output': 0.015},
+    'claude-3-opus': {'input': 0.015, 'output': 0.075},
+    'claude-3-5-sonnet': {'input': 0.003, 'output': 0.015},
+    'claude-3-sonnet': {'input': 0.003, 'output': 0.015},
+    'claude-3-5-haiku': {'input': 0.0008, 'output': 0.004},
+    'claude-3-haiku': {'input': 0.00025, 'output': 0.00125},
+}
+
+# Prompt-cache pricing as multiples of the base input token price
+CACHE_PRICING = {
+    '5m': {'ttl_seconds': 300, 'write': 1.25, 'read': 0.1},
+    '1h': {'ttl_seconds': 3600, 'write': 2.0, 'read': 0.1},
+}
+
+# OpenAI bills cached input tokens at this multiple of the base input price
+OPENAI_CACHED_INPUT = 0.5
+
+# Shortest prefix providers will cache (OpenAI and most Anthropic models)
+DEFAULT_MIN_PREFIX_TOKENS = 1024
+
+def model_prices(model: str) -> Dict[str, float]:
+    """Per-1K prices for a dated model version, by longest matching prefix"""
+    best = ''
+    for name in PROVIDER_COSTS:
+        if model.startswith(name) and len(name) > len(best):
+            best = name
+    return PROVIDER_COSTS.get(best, {'input': 0.0, 'output': 0.0})
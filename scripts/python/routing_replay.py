@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Routing Replay - what recorded traffic would have cost under other routing policies
+Extracts complexity features from logged prompts in vectorized batches, routes
+every record under each policy and prices it with the SDK's MODEL_COSTS,
+reporting cost and latency deltas against what actually ran.
+Usage: python scripts/python/routing_replay.py --file prompts.csv [--sweep]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+SDK_DIR = Path(__file__).resolve().parents[2] / 'apps' / 'app' / 'sdk-prototype' / 'python-sdk'
+sys.path.insert(0, str(SDK_DIR))
+from meterr import model_costs
+
+# Records per chunk; feature extraction works on one contiguous byte buffer per chunk
+DEFAULT_CHUNK_ROWS = 250_000
+
+# Output tokens assumed when records carry no output_tokens column
+DEFAULT_OUTPUT_TOKENS = 256
+
+# Model per complexity tier for the default policies
+DEFAULT_TIERS = ('gpt-4o-mini', 'gpt-4o', 'gpt-4-turbo-preview')
+
+# (base ms, ms per output token) by model prefix, used until recorded latencies are fitted
+DEFAULT_LATENCY = {
+    'gpt-4o-mini': (300.0, 8.0),
+    'gpt-4o': (400.0, 15.0),
+    'gpt-4-turbo': (500.0, 25.0),
+    'gpt-4-1106': (500.0, 25.0),
+    'gpt-4': (600.0, 40.0),
+    'gpt-3.5': (250.0, 10.0),
+    'text-embedding': (100.0, 0.0),
+}
+FALLBACK_LATENCY = (500.0, 20.0)
+
+# Log-spaced latency histogram edges (ms) for streaming percentiles
+LATENCY_EDGES = np.geomspace(1.0, 600_000.0, 1025)
+
+CODE_MARKERS = (b'```', b'def ', b'function')
+MATH_CHARS = b'=+-*/%'
+WHITESPACE = b' \t\n\r\x0b\x0c'
+
+_IS_SPACE = np.zeros(256, dtype=bool)
+_IS_SPACE[list(WHITESPACE)] = True
+_IS_MATH = np.zeros(256, dtype=bool)
+_IS_MATH[list(MATH_CHARS)] = True
+
+def _segment_counts(mask: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Per-string count of True positions in [start, end) of a byte mask"""
+    positions = np.flatnonzero(mask)
+    return np.searchsorted(positions, ends) - np.searchsorted(positions, starts)
+
+def _substring_counts(data: np.ndarray, starts: np.ndarray, ends: np.ndarray, needle: bytes) -> np.ndarray:
+    """Per-string occurrences of `needle`, counting only matches that fit inside the string"""
+    k = len(needle)
+    if len(data) < k:
+        return np.zeros(len(starts), dtype=np.int64)
+    hits = data[:len(data) - k + 1] == needle[0]
+    for j in range(1, k):
+        hits &= data[j:len(data) - k + 1 + j] == needle[j]
+    # A match starting at i is inside the string only if i <= end - k
+    lo = np.minimum(starts, len(hits))
+    hi = np.clip(ends - k + 1, lo, len(hits))
+    return _segment_counts(hits, lo, hi)
+
+def prompt_features(texts: Iterable[Optional[str]]) -> Dict[str, np.ndarray]:
+    """Complexity features for a batch of prompts, computed on their UTF-8 bytes
+
+    Mirrors the inputs of ModelTester.classify_complexity: word and
+    question counts plus code and math markers. Whitespace is ASCII only.
+    """
+    arr = pa.array(texts, type=pa.large_string()) if not isinstance(texts, (pa.Array, pa.ChunkedArray)) else texts
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.combine_chunks()
+    arr = pc.fill_null(arr.cast(pa.large_string()), '')
+
+    n = len(arr)
+    offsets = np.frombuffer(arr.buffers()[1], dtype=np.int64)[arr.offset:arr.offset + n + 1]
+    base = int(offsets[0])
+    data = np.frombuffer(arr.buffers()[2], dtype=np.uint8)[base:int(offsets[-1])] if n else np.zeros(0, np.uint8)
+    starts = offsets[:-1] - base
+    ends = offsets[1:] - base
+
+    space = _IS_SPACE[data]
+    # A word starts at a non-space byte whose predecessor is a space or the string start
+    word_start = ~space
+    word_start[1:] &= space[:-1]
+    if len(data):
+        nonempty = starts[starts < ends]
+        word_start[nonempty] = ~space[nonempty]
+
+    code_markers = sum(_substring_counts(data, starts, ends, m) for m in CODE_MARKERS)
+    return {
+        'word_count': _segment_counts(word_start, starts, ends),
+        'char_count': ends - starts,
+        'code_markers': code_markers,
+        'math_chars': _segment_counts(_IS_MATH[data], starts, ends),
+        'question_count': _segment_counts(data == ord('?'), starts, ends),
+    }
+
+def complexity_score(
+    features: Dict[str, np.ndarray],
+    long_words: int = 100,
+    medium_words: int = 50,
+    many_questions: int = 2
+) -> np.ndarray:
+    """ModelTester.classify_complexity's score for every record at once"""
+    words = features['word_count']
+    score = np.where(words > long_words, 2, np.where(words > medium_words, 1, 0))
+    score += 2 * (features['code_markers'] > 0)
+    score += features['math_chars'] > 0
+    score += features['question_count'] > many_questions
+    return score
+
+class RoutingPolicy:
+    """Routes each record to one of `models`; subclasses implement route()"""
+
+    def __init__(self, name: str, models: Sequence[str]):
+        self.name = name
+        self.models = list(models)
+
+    def route(self, features: Dict[str, np.ndarray], records: pd.DataFrame) -> np.ndarray:
+        """Index into self.models for every record"""
+        raise NotImplementedError
+
+class FixedPolicy(RoutingPolicy):
+    """Sends everything to one model"""
+
+    def __init__(self, model: str, name: Optional[str] = None):
+        super().__init__(name or f"all-{model}", [model])
+
+    def route(self, features, records):
+        return np.zeros(len(records), dtype=np.int64)
+
+class ThresholdPolicy(RoutingPolicy):
+    """Complexity-score tiers: score >= thresholds[i] moves a record up to models[i + 1]"""
+
+    def __init__(
+        self,
+        name: str = 'heuristic',
+        models: Sequence[str] = DEFAULT_TIERS,
+        thresholds: Sequence[int] = (2, 4),
+        **score_params
+    ):
+        if len(models) != len(thresholds) + 1:
+            raise ValueError("Need exactly one more model than thresholds")
+        super().__init__(name, models)
+        self.thresholds = np.asarray(thresholds)
+        self.score_params = score_params
+
+    def route(self, features, records):
+        return np.searchsorted(self.thresholds, complexity_score(features, **self.score_params), side='right')
+
+class FunctionPolicy(RoutingPolicy):
+    """Wraps fn(features, records) -> model indices"""
+
+    def __init__(self, name: str, models: Sequence[str], fn):
+        super().__init__(name, models)
+        self.fn = fn
+
+    def route(self, features, records):
+        return np.asarray(self.fn(features, records), dtype=np.int64)
+
+def threshold_sweep(
+    models: Sequence[str] = DEFAULT_TIERS,
+    medium: Sequence[int] = range(1, 5),
+    complex_: Sequence[int] = range(2, 7)
+) -> List[ThresholdPolicy]:
+    """Three-tier threshold policies over a grid of (medium, complex) cut-offs"""
+    return [
+        ThresholdPolicy(f"tiers@{m}/{c}", models, (m, c))
+        for m in medium for c in complex_ if c > m
+    ]
+
+def model_prices(models: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-1K input and output prices for a list of models; unknown models are free"""
+    costs = [model_costs(str(m)) or {'input': 0.0, 'output': 0.0} for m in models]
+    return np.array([c['input'] for c in costs]), np.array([c['output'] for c in costs])
+
+class LatencyModel:
+    """Linear latency per model: base_ms + ms_per_token * output_tokens"""
+
+    def __init__(self, profiles: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.defaults = dict(DEFAULT_LATENCY)
+        self.fitted: Dict[str, Tuple[float, float]] = dict(profiles or {})
+
+    def fit(self, models: pd.Series, output_tokens: np.ndarray, latency_ms: np.ndarray, min_samples: int = 50):
+        """Least-squares profile per recorded model with enough samples"""
+        frame = pd.DataFrame({'model': models.to_numpy(), 'x': output_tokens, 'y': latency_ms}).dropna()
+        frame['xx'] = frame['x'] ** 2
+        frame['xy'] = frame['x'] * frame['y']
+        sums = frame.groupby('model').agg(n=('x', 'size'), x=('x', 'sum'), y=('y', 'sum'), xx=('xx', 'sum'), xy=('xy', 'sum'))
+
+        for model, row in sums[sums['n'] >= min_samples].iterrows():
+            var = row['n'] * row['xx'] - row['x'] ** 2
+            slope = (row['n'] * row['xy'] - row['x'] * row['y']) / var if var > 0 else 0.0
+            slope = max(slope, 0.0)
+            base = max((row['y'] - slope * row['x']) / row['n'], 0.0)
+            self.fitted[model] = (base, slope)
+
+    def profile(self, model: str) -> Tuple[float, float]:
+        if model in self.fitted:
+            return self.fitted[model]
+        matches = [name for name in self.defaults if model.startswith(name)]
+        return self.defaults[max(matches, key=len)] if matches else FALLBACK_LATENCY
+
+    def arrays(self, models: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        profiles = [self.profile(str(m)) for m in models]
+        return np.array([p[0] for p in profiles]), np.array([p[1] for p in profiles])
+
+class _Totals:
+    """Streaming cost/latency aggregates for one policy (or the recorded baseline)"""
+
+    def __init__(self, models: Sequence[str]):
+        self.models = list(models)
+        self.records = 0
+        self.cost = 0.0
+        self.latency = 0.0
+        self.histogram = np.zeros(len(LATENCY_EDGES) + 1, dtype=np.int64)
+        self.mix = np.zeros(len(self.models), dtype=np.int64)
+
+    def add(self, cost: np.ndarray, latency: np.ndarray, codes: np.ndarray):
+        self.records += len(cost)
+        self.cost += float(cost.sum())
+        self.latency += float(latency.sum())
+        self.histogram += np.bincount(np.searchsorted(LATENCY_EDGES, latency), minlength=len(self.histogram))
+        self.mix += np.bincount(codes, minlength=len(self.models))[:len(self.models)]
+
+    def percentile(self, q: float) -> float:
+        if not self.records:
+            return 0.0
+        bucket = int(np.searchsorted(np.cumsum(self.histogram), q * self.records))
+        return float(LATENCY_EDGES[min(bucket, len(LATENCY_EDGES) - 1)])
+
+    def mix_label(self) -> str:
+        shares = sorted(zip(self.mix, self.models), reverse=True)
+        return ', '.join(f"{m} {n / self.records:.0%}" for n, m in shares if n) if self.records else ''
+
+class ReplaySimulator:
+    """Replays record chunks through every policy and accumulates cost and latency
+
+    Records may carry a prompt ('prompt' or 'text'), 'model', 'input_tokens',
+    'output_tokens', 'cost' and 'latency_ms'. Missing token counts are
+    estimated; without prompts, features fall back to input token counts.
+    The recorded model (or, without one, the first policy) is the baseline.
+    """
+
+    def __init__(
+        self,
+        policies: Sequence[RoutingPolicy],
+        latency: Optional[LatencyModel] = None,
+        default_output_tokens: int = DEFAULT_OUTPUT_TOKENS
+    ):
+        if not policies:
+            raise ValueError("At least one policy is required")
+        self.policies = list(policies)
+        self.latency = latency or LatencyModel()
+        self.default_output_tokens = default_output_tokens
+        self.totals = {p.name: _Totals(p.models) for p in self.policies}
+        self.baseline: Optional[_Totals] = None
+        self._baseline_models: Dict[str, int] = {}
+        self._calibrated = latency is not None
+        self.seconds = 0.0
+
+    def _features(self, records: pd.DataFrame) -> Dict[str, np.ndarray]:
+        text = next((c for c in ('prompt', 'text') if c in records.columns), None)
+        if text is not None:
+            return prompt_features(pa.array(records[text], type=pa.large_string(), from_pandas=True))
+        tokens = records['input_tokens'].to_numpy(dtype=np.float64)
+        zeros = np.zeros(len(records), dtype=np.int64)
+        return {
+            'word_count': (tokens * 0.75).astype(np.int64),
+            'char_count': (tokens * 4).astype(np.int64),
+            'code_markers': zeros,
+            'math_chars': zeros,
+            'question_count': zeros,
+        }
+
+    def _add_baseline(self, records: pd.DataFrame, input_tokens: np.ndarray, output_tokens: np.ndarray):
+        codes, uniques = pd.factorize(records['model'].astype(str))
+        # Keep one code space across chunks for the model mix
+        remap = np.array([self._baseline_models.setdefault(m, len(self._baseline_models)) for m in uniques], dtype=np.int64)
+        codes = remap[codes]
+        models = list(self._baseline_models)
+        if self.baseline is None:
+            self.baseline = _Totals(models)
+        elif len(models) > len(self.baseline.models):
+            self.baseline.mix = np.concatenate([self.baseline.mix, np.zeros(len(models) - len(self.baseline.models), np.int64)])
+            self.baseline.models = models
+
+        if 'cost' in records.columns:
+            cost = records['cost'].to_numpy(dtype=np.float64)
+        else:
+            pin, pout = model_prices(models)
+            cost = (input_tokens * pin[codes] + output_tokens * pout[codes]) / 1000
+        if 'latency_ms' in records.columns:
+            latency = records['latency_ms'].to_numpy(dtype=np.float64)
+        else:
+            base, per_token = self.latency.arrays(models)
+            latency = base[codes] + per_token[codes] * output_tokens
+        self.baseline.add(cost, latency, codes)
+
+    def add(self, records: pd.DataFrame):
+        """Replay one chunk of records"""
+        started = time.perf_counter()
+        features = self._features(records)
+
+        if 'input_tokens' in records.columns:
+            input_tokens = records['input_tokens'].to_numpy(dtype=np.float64)
+        else:
+            input_tokens = np.ceil(features['char_count'] / 4)
+        if 'output_tokens' in records.columns:
+            output_tokens = records['output_tokens'].to_numpy(dtype=np.float64)
+        else:
+            output_tokens = np.full(len(records), float(self.default_output_tokens))
+
+        if not self._calibrated and 'latency_ms' in records.columns and 'model' in records.columns:
+            self.latency.fit(records['model'].astype(str), output_tokens, records['latency_ms'].to_numpy(dtype=np.float64))
+            self._calibrated = True
+
+        if 'model' in records.columns:
+            self._add_baseline(records, input_tokens, output_tokens)
+
+        for policy in self.policies:
+            codes = policy.route(features, records)
+            pin, pout = model_prices(policy.models)
+            base, per_token = self.latency.arrays(policy.models)
+            cost = (input_tokens * pin[codes] + output_tokens * pout[codes]) / 1000
+            latency = base[codes] + per_token[codes] * output_tokens
+            self.totals[policy.name].add(cost, latency, codes)
+
+        self.seconds += time.perf_counter() - started
+
+    def report(self) -> pd.DataFrame:
+        """One row per policy with totals and deltas against the baseline"""
+        reference = self.baseline or self.totals[self.policies[0].name]
+        rows = []
+        entries = ([('recorded', self.baseline)] if self.baseline else []) + list(self.totals.items())
+        for name, totals in entries:
+            mean = totals.latency / totals.records if totals.records else 0.0
+            ref_mean = reference.latency / reference.records if reference.records else 0.0
+            rows.append({
+                'policy': name,
+                'records': totals.records,
+                'cost': totals.cost,
+                'cost_delta': totals.cost - reference.cost,
+                'cost_delta_pct': (totals.cost / reference.cost - 1) if reference.cost else 0.0,
+                'latency_mean_ms': mean,
+                'latency_delta_ms': mean - ref_mean,
+                'latency_p50_ms': totals.percentile(0.5),
+                'latency_p95_ms': totals.percentile(0.95),
+                'model_mix': totals.mix_label(),
+            })
+        return pd.DataFrame(rows)
+
+def read_records(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Stream records from CSV, JSON Lines (e.g. exported UsageRecords) or Parquet"""
+    suffix = Path(path).suffix.lower()
+    if suffix == '.parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif suffix in ('.jsonl', '.ndjson'):
+        yield from pd.read_json(path, lines=True, chunksize=chunk_rows)
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+
+def replay(path: str, policies: Sequence[RoutingPolicy], chunk_rows: int = DEFAULT_CHUNK_ROWS) -> ReplaySimulator:
+    """Replay a record file through the given policies"""
+    simulator = ReplaySimulator(policies)
+    for chunk in read_records(path, chunk_rows):
+        simulator.add(chunk)
+    return simulator
+
+def main():
+    parser = argparse.ArgumentParser(description='Routing Replay')
+    parser.add_argument('--file', type=str, required=True, help='Records: CSV, JSONL or Parquet')
+    parser.add_argument('--models', type=str, default=','.join(DEFAULT_TIERS), help='Simple,medium,complex tier models')
+    parser.add_argument('--sweep', action='store_true', help='Add a grid of tier threshold policies')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS, help='Records per chunk')
+    parser.add_argument('--output', type=str, help='Write the report to CSV')
+
+    args = parser.parse_args()
+
+    tiers = args.models.split(',')
+    unknown = [m for m in tiers if model_costs(m) is None]
+    if unknown:
+        print(f"⚠️ No MODEL_COSTS entry for {unknown}; they are priced at 0")
+
+    policies: List[RoutingPolicy] = [ThresholdPolicy('heuristic', tiers)]
+    policies += [FixedPolicy(m) for m in dict.fromkeys(tiers)]
+    if args.sweep:
+        policies += threshold_sweep(tiers)
+
+    simulator = replay(args.file, policies, args.chunk_rows)
+    df = simulator.report()
+
+    records = df['records'].max() if len(df) else 0
+    rate = records / simulator.seconds * 60 if simulator.seconds else 0
+    print(f"Replayed {records:,} records through {len(policies)} policies in {simulator.seconds:.1f}s ({rate:,.0f} records/min)")
+    print(df.sort_values('cost').to_string(index=False, float_format=lambda v: f"{v:,.4f}"))
+
+    if args.output:
+        df.to_csv(args.output, index=False)
+        print(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""
+Shared pytest setup for scripts/python
+The scripts import each other as top-level modules, so their directory goes
+on sys.path. Tests for scripts that need torch/transformers skip when those
+are not installed.
+Usage: python -m pytest scripts/python/tests
+"""
+
+import os
+import sys
+
+SCRIPTS_PYTHON = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# scripts/python, plus scripts/ for gpu_tokenizer.py
+sys.path.insert(0, SCRIPTS_PYTHON)
+sys.path.insert(1, os.path.dirname(SCRIPTS_PYTHON))
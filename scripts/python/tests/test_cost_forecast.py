@@ -0,0 +1,132 @@
+"""Tests for the incremental Holt-Winters cost forecaster"""
+
+import numpy as np
+import pytest
+
+from cost_forecast import DAY, CostForecaster
+
+A = ('gpt-4o', 'team-a')
+B = ('claude-3-haiku', 'team-b')
+
+def feed(forecaster: CostForecaster, days, series):
+    """Observe each series' daily spend for the given day numbers"""
+    for day in days:
+        keys = [key for key, (first, _) in series.items() if day >= first]
+        costs = [series[key][1] for key in keys]
+        forecaster.observe(day * DAY, keys, costs)
+
+def test_first_day_seeds_level():
+    forecaster = CostForecaster()
+    feed(forecaster, range(3), {A: (0, 10.0)})
+
+    # Day 2 is still open
+    assert forecaster.observed_days.tolist() == [2]
+    assert forecaster.level.tolist() == pytest.approx([10.0])
+    assert forecaster.trend.tolist() == pytest.approx([0.0])
+
+def test_constant_spend_forecasts_flat():
+    forecaster = CostForecaster()
+    feed(forecaster, range(28), {A: (0, 10.0)})
+
+    result = forecaster.projected_spend(7)
+    assert result['forecast'] == pytest.approx(70.0, rel=0.01)
+    assert result['lower'] <= result['forecast'] <= result['upper']
+
+def test_series_appearing_mid_history_starts_on_its_first_day():
+    forecaster = CostForecaster()
+    feed(forecaster, range(28), {A: (0, 10.0), B: (14, 100.0)})
+
+    a, b = forecaster.index[A], forecaster.index[B]
+    assert forecaster.observed_days[a] == 27
+    assert forecaster.observed_days[b] == 13
+    assert forecaster.level[b] == pytest.approx(100.0)
+
+    df = forecaster.forecast(7).set_index('model')
+    assert df.loc['gpt-4o', 'forecast'] == pytest.approx(70.0, rel=0.01)
+    assert df.loc['claude-3-haiku', 'forecast'] == pytest.approx(700.0, rel=0.01)
+
+def test_new_series_on_a_rollover_is_not_seeded_with_zero():
+    forecaster = CostForecaster()
+    feed(forecaster, range(2), {A: (0, 10.0), B: (1, 30.0)})
+    forecaster.observe(2 * DAY, [A, B], [10.0, 30.0])
+
+    assert forecaster.level.tolist() == pytest.approx([10.0, 30.0])
+    assert forecaster.observed_days.tolist() == [2, 1]
+
+def test_skipped_days_count_as_zero_spend():
+    forecaster = CostForecaster()
+    forecaster.observe(0, [A], [10.0])
+    forecaster.observe(3 * DAY, [A], [10.0])
+
+    assert forecaster.observed_days.tolist() == [3]
+    assert forecaster.level[0] < 10.0
+
+def test_set_day_totals_replaces_the_open_day():
+    forecaster = CostForecaster()
+    forecaster.observe(0, [A], [4.0])
+    forecaster.set_day_totals(0, [A], [10.0])
+    forecaster.observe(DAY, [A], [0.0])
+
+    assert forecaster.level.tolist() == pytest.approx([10.0])
+
+def test_closed_days_are_rejected():
+    forecaster = CostForecaster()
+    forecaster.observe(2 * DAY, [A], [1.0])
+    with pytest.raises(ValueError):
+        forecaster.observe(DAY, [A], [1.0])
+
+def test_state_round_trip(tmp_path):
+    forecaster = CostForecaster()
+    feed(forecaster, range(10), {A: (0, 10.0), B: (4, 5.0)})
+    path = str(tmp_path / 'state.npz')
+    forecaster.save(path)
+
+    restored = CostForecaster.load(path)
+    assert restored.keys == forecaster.keys
+    assert restored.current_day == forecaster.current_day
+    for name in ('level', 'trend', 'season', 'variance', 'observed_days', 'pending'):
+        assert np.array_equal(getattr(restored, name), getattr(forecaster, name)), name
+
+    # Continuing from the restored state matches continuing in memory
+    feed(restored, range(10, 14), {A: (0, 10.0), B: (4, 5.0)})
+    feed(forecaster, range(10, 14), {A: (0, 10.0), B: (4, 5.0)})
+    assert restored.forecast(7)['forecast'].tolist() == pytest.approx(forecaster.forecast(7)['forecast'].tolist())
+
+def simulate(forecaster, keys, rng, days, sigma):
+    """Extend every series from the model's own one-step forecast plus noise; returns the spend"""
+    spend = []
+    for day in days:
+        # Close the previous day, then read the forecast for this one
+        forecaster.set_day_totals(day * DAY, keys, np.zeros(len(keys)))
+        p = forecaster.params
+        expected = forecaster.level + p['phi'] * forecaster.trend + forecaster.season[:, (day + 3) % 7]
+        if not forecaster.observed_days.any():
+            expected = np.full(len(keys), 100.0)
+        y = expected + sigma * rng.standard_normal(len(keys))
+        forecaster.set_day_totals(day * DAY, keys, y)
+        spend.append(y)
+    return np.array(spend)
+
+@pytest.mark.parametrize('horizon', [7, 30])
+def test_horizon_intervals_cover_simulated_totals(horizon):
+    rng = np.random.default_rng(7)
+    keys = [('gpt-4o', f'team-{i}') for i in range(2000)]
+    forecaster = CostForecaster()
+    simulate(forecaster, keys, rng, range(150), sigma=5.0)
+
+    # Forecast from the open day 150 before anything is spent in it
+    forecaster.set_day_totals(150 * DAY, keys, np.zeros(len(keys)))
+    df = forecaster.forecast(horizon, interval=0.8)
+    actual = simulate(forecaster, keys, rng, range(150, 150 + horizon), sigma=5.0).sum(axis=0)
+
+    covered = ((df['lower'] <= actual) & (actual <= df['upper'])).mean()
+    # The smoothed variance is itself an estimate, so allow a few points either side
+    assert 0.72 <= covered <= 0.88
+
+def test_open_day_spend_counts_toward_the_forecast():
+    forecaster = CostForecaster()
+    feed(forecaster, range(28), {A: (0, 10.0)})
+    # A spike already recorded today cannot be forecast away
+    forecaster.observe(27 * DAY, [A], [90.0])
+
+    assert forecaster.projected_spend(7)['forecast'] == pytest.approx(60.0 + 100.0, rel=0.01)
@@ -0,0 +1,100 @@
+"""Tests for dashboard downsampling and the incremental rollup cache"""
+
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dashboard_data import RollupCache, heatmap_matrix, lttb
+from usage_store import UsageStore
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def record(when: datetime, tokens: int = 100):
+    return {'timestamp': when.timestamp(), 'model': 'gpt-4o', 'input_tokens': tokens, 'cost': 0.01}
+
+class CountingStore(UsageStore):
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.fetches = []
+
+    def query(self, level, start, end, models=None, group_by=('model',)):
+        self.fetches.append((level, start, end))
+        return super().query(level, start, end, models, group_by)
+
+@pytest.fixture
+def store(tmp_path):
+    store = CountingStore(str(tmp_path / 'usage.db'))
+    yield store
+    store.conn.close()
+
+@pytest.fixture
+def local_tz():
+    """Run in a non-UTC local zone so naive datetimes can't pass as UTC"""
+    mp = pytest.MonkeyPatch()
+    mp.setenv('TZ', 'America/New_York')
+    time.tzset()
+    yield
+    mp.undo()
+    time.tzset()
+
+def test_lttb_keeps_endpoints_and_peaks():
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[500] = 100
+    kept = lttb(x, y, 50)
+    assert len(kept) == 50
+    assert kept[0] == 0 and kept[-1] == 999
+    assert 500 in kept
+
+def test_heatmap_merges_days_by_max():
+    hours = pd.date_range('2024-01-01', periods=24 * 10, freq='h')
+    hourly = pd.DataFrame({'timestamp': hours, 'tokens': np.arange(len(hours))})
+    matrix = heatmap_matrix(hourly, max_columns=5)
+    assert matrix.shape == (24, 5)
+    assert matrix.loc[0].tolist() == [24, 72, 120, 168, 216]
+
+def test_widening_fetches_only_missing_edges(store):
+    store.ingest_records([record(utc(2024, 5, 1, h)) for h in range(6)])
+    cache = RollupCache(store)
+
+    assert len(cache.get('hour', utc(2024, 5, 1, 2), utc(2024, 5, 1, 4))) == 2
+    assert len(cache.get('hour', utc(2024, 5, 1, 0), utc(2024, 5, 1, 6))) == 6
+    edges = [(start.hour, end.hour) for _, start, end in store.fetches[1:]]
+    assert edges == [(0, 2), (4, 6)]
+
+def test_refresh_picks_up_late_events_in_earlier_buckets(store):
+    store.ingest_records([record(utc(2024, 5, 1, h)) for h in range(4)])
+    cache = RollupCache(store)
+    assert cache.get('hour', utc(2024, 5, 1), utc(2024, 5, 2))['tokens'].tolist() == [100] * 4
+
+    # A late event for hour 1 and a new one for hour 5
+    store.ingest_records([record(utc(2024, 5, 1, 1, 30), 50), record(utc(2024, 5, 1, 5))])
+    cache.refresh()
+
+    frame = cache.get('hour', utc(2024, 5, 1), utc(2024, 5, 2))
+    assert frame['tokens'].tolist() == [100, 150, 100, 100, 100]
+    # Hour 0 was untouched and is not re-read
+    assert store.fetches[-1][1] == pd.Timestamp(utc(2024, 5, 1, 1))
+
+def test_refresh_without_changes_rereads_only_the_open_bucket(store):
+    store.ingest_records([record(utc(2024, 5, 1, h)) for h in range(4)])
+    cache = RollupCache(store)
+    cache.get('hour', utc(2024, 5, 1), utc(2024, 5, 2))
+
+    version = cache.refresh()
+
+    assert version == 1
+    assert store.fetches[-1][1] == pd.Timestamp(utc(2024, 5, 1, 3))
+
+def test_naive_datetimes_are_local_time(store, local_tz):
+    store.ingest_records([record(utc(2024, 5, 1, 12))])
+    cache = RollupCache(store)
+
+    # 08:00 in New York (EDT) is 12:00 UTC
+    frame = cache.get('hour', datetime(2024, 5, 1, 8), datetime(2024, 5, 1, 9))
+    assert frame['timestamp'].tolist() == [pd.Timestamp('2024-05-01 12:00')]
+    assert cache.get('hour', datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 13)).empty
@@ -0,0 +1,136 @@
+"""Tests for the dynamic batcher"""
+
+import threading
+import time
+
+import pytest
+
+from dynamic_batcher import DynamicBatcher, pick_bucket
+
+class Recorder:
+    """run_batch that records each batch it sees"""
+
+    def __init__(self, delay: float = 0.0):
+        self.batches = []
+        self.delay = delay
+
+    def __call__(self, batch):
+        self.batches.append(list(batch))
+        time.sleep(self.delay)
+        return [sum(item) for item in batch]
+
+def test_pick_bucket_minimizes_padding_around_anchor():
+    lengths = [1, 2, 3, 10, 11, 12]
+    assert pick_bucket(lengths, 0, 3) == (0, 3)
+    assert pick_bucket(lengths, 3, 3) == (3, 6)
+    # The anchor must stay inside the window even when another is cheaper
+    assert pick_bucket(lengths, 2, 3) == (0, 3)
+    assert pick_bucket(lengths, 5, 10) == (0, 6)
+
+def test_results_come_back_in_submit_order():
+    batcher = DynamicBatcher(Recorder(), max_batch_size=4, max_wait=0.01)
+    try:
+        items = [[i] * (i % 5 + 1) for i in range(20)]
+        assert batcher.map(items) == [sum(item) for item in items]
+    finally:
+        batcher.close()
+
+def test_full_batch_runs_without_waiting():
+    recorder = Recorder()
+    batcher = DynamicBatcher(recorder, max_batch_size=4, max_wait=10.0)
+    try:
+        start = time.monotonic()
+        assert batcher.map([[1]] * 4) == [1] * 4
+        assert time.monotonic() - start < 5.0
+        assert [len(b) for b in recorder.batches] == [4]
+    finally:
+        batcher.close()
+
+def test_partial_batch_runs_after_max_wait():
+    recorder = Recorder()
+    batcher = DynamicBatcher(recorder, max_batch_size=16, max_wait=0.05)
+    try:
+        assert batcher.submit([1, 2]).result(timeout=5) == 3
+        assert [len(b) for b in recorder.batches] == [1]
+    finally:
+        batcher.close()
+
+def test_batches_group_similar_lengths():
+    recorder = Recorder(delay=0.05)
+    batcher = DynamicBatcher(recorder, max_batch_size=2, max_wait=0.01)
+    try:
+        # Block the worker so the rest queue up together
+        first = batcher.submit([0])
+        time.sleep(0.02)
+        futures = [batcher.submit([1] * n) for n in (1, 9, 2, 10)]
+        first.result(timeout=5)
+        for future in futures:
+            future.result(timeout=5)
+        lengths = sorted(sorted(len(item) for item in batch) for batch in recorder.batches[1:])
+        assert lengths == [[1, 2], [9, 10]]
+        assert batcher.stats()['padding_efficiency'] > 0.8
+    finally:
+        batcher.close()
+
+def test_max_batch_tokens_limits_padded_size():
+    recorder = Recorder(delay=0.05)
+    batcher = DynamicBatcher(recorder, max_batch_size=8, max_wait=0.01, max_batch_tokens=20)
+    try:
+        first = batcher.submit([0])
+        time.sleep(0.02)
+        futures = [batcher.submit([1] * 10) for _ in range(4)]
+        first.result(timeout=5)
+        for future in futures:
+            future.result(timeout=5)
+        assert all(len(batch) * max(len(i) for i in batch) <= 20 for batch in recorder.batches[1:])
+    finally:
+        batcher.close()
+
+def test_batch_errors_reach_every_request_in_the_batch():
+    def fail(batch):
+        raise RuntimeError('model crashed')
+
+    batcher = DynamicBatcher(fail, max_batch_size=2, max_wait=0.01)
+    try:
+        futures = [batcher.submit([1]), batcher.submit([2])]
+        for future in futures:
+            with pytest.raises(RuntimeError, match='model crashed'):
+                future.result(timeout=5)
+    finally:
+        batcher.close()
+
+def test_short_result_list_fails_the_batch():
+    batcher = DynamicBatcher(lambda batch: [0] * (len(batch) - 1), max_batch_size=3, max_wait=0.05)
+    try:
+        futures = [batcher.submit([i]) for i in range(3)]
+        for future in futures:
+            with pytest.raises(ValueError, match='2 results for a batch of 3'):
+                future.result(timeout=5)
+    finally:
+        batcher.close()
+
+def test_close_finishes_pending_work_then_rejects():
+    batcher = DynamicBatcher(Recorder(delay=0.01), max_batch_size=2, max_wait=1.0)
+    futures = [batcher.submit([i]) for i in range(5)]
+    batcher.close()
+    assert [f.result(timeout=0) for f in futures] == list(range(5))
+    with pytest.raises(RuntimeError):
+        batcher.submit([1])
+
+def test_submit_from_many_threads():
+    batcher = DynamicBatcher(Recorder(), max_batch_size=8, max_wait=0.005)
+    results = {}
+
+    def work(offset):
+        results[offset] = batcher.map([[offset, i] for i in range(25)])
+
+    threads = [threading.Thread(target=work, args=(t * 100,)) for t in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    for offset, values in results.items():
+        assert values == [offset + i for i in range(25)]
+    assert batcher.stats()['items'] == 100
@@ -0,0 +1,103 @@
+"""Tests for ModelTester routing with models that fail to load"""
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+from model_tester import ModelTester
+
+SIMPLE = "Hello, how are you?"
+MEDIUM = "Write a Python function def f(x) that returns x * 2"
+
+class FakeTokenizer:
+    model_max_length = 1024
+
+    def __call__(self, prompts, **kwargs):
+        return {'input_ids': [[1] * len(p.split()) for p in prompts]}
+
+class FakeModel:
+    class config:
+        n_positions = 1024
+
+def make_tester(monkeypatch, broken=()):
+    tester = ModelTester(use_gpu=False, max_wait_ms=1)
+    loads = []
+
+    def load(model_id):
+        loads.append(model_id)
+        # Loading must not block batcher creation for other models
+        assert tester._lock.acquire(blocking=False)
+        tester._lock.release()
+        if model_id in broken:
+            raise OSError(f"{model_id} is not cached and the network is unreachable")
+        return FakeTokenizer(), FakeModel()
+
+    def generate(name, batch):
+        return [
+            {'response': 'ok', 'input_tokens': len(ids), 'output_tokens': 5, 'batch_size': len(batch),
+             'batch_output_tokens': 5 * len(batch), 'seconds': 0.5}
+            for ids in batch
+        ]
+
+    monkeypatch.setattr(tester, '_load', load)
+    monkeypatch.setattr(tester, '_generate', generate)
+    return tester, loads
+
+def test_unloadable_model_falls_back_to_simple(monkeypatch):
+    tester, loads = make_tester(monkeypatch, broken={'microsoft/DialoGPT-medium'})
+    try:
+        assert tester.classify_complexity(MEDIUM) == 'medium'
+        df = tester.test_routing_logic([SIMPLE, MEDIUM, MEDIUM])
+    finally:
+        tester.close()
+
+    assert df['model_used'].tolist() == ['simple'] * 3
+    assert df['error'].isna().all()
+    assert df['output_tokens'].tolist() == [5, 5, 5]
+    # The failed download is attempted once, not once per prompt
+    assert loads.count('microsoft/DialoGPT-medium') == 1
+
+def test_throughput_is_reported_per_batch(monkeypatch):
+    tester, _ = make_tester(monkeypatch)
+    try:
+        df = tester.test_routing_logic([SIMPLE] * 3)
+    finally:
+        tester.close()
+
+    # Three rows of 5 tokens generated together in 0.5s
+    assert df['batch_size'].tolist() == [3, 3, 3]
+    assert df['batch_tokens_per_second'].tolist() == [30.0, 30.0, 30.0]
+
+def test_load_failures_are_recorded_per_row(monkeypatch):
+    tester, _ = make_tester(monkeypatch, broken={'gpt2', 'microsoft/DialoGPT-medium'})
+    try:
+        df = tester.test_routing_logic([SIMPLE, MEDIUM])
+    finally:
+        tester.close()
+
+    assert df['response_time'].tolist() == ['N/A', 'N/A']
+    assert all('gpt2' in error for error in df['error'])
+    assert df.attrs['summary']['failed'] == 2
+
+def test_generation_errors_are_recorded_per_row(monkeypatch):
+    tester, _ = make_tester(monkeypatch)
+
+    def generate(name, batch):
+        if name == 'medium':
+            raise RuntimeError('CUDA out of memory')
+        return [
+            {'response': 'ok', 'input_tokens': 1, 'output_tokens': 5, 'batch_size': len(batch),
+             'batch_output_tokens': 5 * len(batch), 'seconds': 0.5}
+            for _ in batch
+        ]
+
+    monkeypatch.setattr(tester, '_generate', generate)
+    try:
+        df = tester.test_routing_logic([SIMPLE, MEDIUM])
+    finally:
+        tester.close()
+
+    assert df['model_used'].tolist() == ['simple', 'medium']
+    assert df['error'].isna().tolist() == [True, False]
+    assert 'out of memory' in df.loc[1, 'error']
@@ -0,0 +1,87 @@
+"""Tests for the prompt-prefix trie and its prompt-cache simulation"""
+
+import pytest
+
+from prefix_trie import PrefixTrie
+
+def prompt(shared, tail, length=20):
+    """`shared` tokens common to a family of prompts, then `length` tokens unique to `tail`"""
+    return list(range(shared)) + [100_000 + tail * length + i for i in range(length)]
+
+def test_shared_prefix_tokens_counts_repeats():
+    trie = PrefixTrie(min_prefix_tokens=0)
+    for tail in range(3):
+        trie.insert(prompt(50, tail), timestamp=float(tail))
+    assert trie.prompts == 3
+    assert trie.total_tokens == 3 * 70
+    assert trie.shared_prefix_tokens() == 2 * 50
+
+def test_ttl_expiry_turns_reads_into_writes():
+    trie = PrefixTrie(min_prefix_tokens=0)
+    trie.insert(prompt(100, 0), timestamp=0.0)
+    trie.insert(prompt(100, 1), timestamp=10.0)
+    trie.insert(prompt(100, 2), timestamp=1000.0)
+
+    shared = next(node for node in trie.root.children.values())
+    # 5m: write, read, write (expired); 1h: write, read, read
+    assert shared.writes == [2, 1]
+    assert shared.count == 3
+
+def test_out_of_order_timestamps_are_rejected():
+    trie = PrefixTrie()
+    trie.insert([1, 2, 3], timestamp=100.0)
+    with pytest.raises(ValueError):
+        trie.insert([1, 2, 4], timestamp=50.0)
+
+def test_mixed_timed_and_untimed_prompts_are_rejected():
+    trie = PrefixTrie()
+    trie.insert([1, 2, 3], timestamp=1.0)
+    with pytest.raises(ValueError):
+        trie.insert([1, 2, 4])
+
+def test_untimed_report_is_labelled_upper_bound():
+    trie = PrefixTrie(min_prefix_tokens=0)
+    for tail in range(3):
+        trie.insert(prompt(50, tail))
+    report = trie.report(cost_per_1k=1.0)
+    assert report['timestamps'] is False
+    assert report['upper_bound'] is True
+
+    timed = PrefixTrie(min_prefix_tokens=0)
+    timed.insert(prompt(50, 0), timestamp=0.0)
+    assert timed.report(cost_per_1k=1.0)['upper_bound'] is False
+
+def test_prefixes_below_minimum_save_nothing():
+    trie = PrefixTrie(min_prefix_tokens=1024)
+    for tail in range(5):
+        trie.insert(prompt(500, tail), timestamp=float(tail))
+    report = trie.report(cost_per_1k=1.0)
+    assert report['shared_prefix_tokens'] == 4 * 500
+    assert all(tier['saved'] == 0 for tier in report['tiers'].values())
+    assert all(not tier['breakpoints'] for tier in report['tiers'].values())
+
+def test_first_node_past_minimum_carries_the_whole_prefix():
+    base = list(range(1500))
+    prompts = [
+        base + [200_000],        # shares 0-1500 with the next one
+        base + [200_001],
+        base[:800] + [300_000],  # only shares the first 800 tokens
+    ]
+
+    def five_minute_savings(min_prefix_tokens):
+        trie = PrefixTrie(min_prefix_tokens=min_prefix_tokens)
+        for i, tokens in enumerate(prompts):
+            trie.insert(tokens, timestamp=float(i))
+        return trie.projected_savings('5m')
+
+    # 0-800: 3 prompts (1 write, 2 reads); 800-1500: 2 prompts (1 write, 1 read)
+    assert five_minute_savings(0) == pytest.approx(800 * (2 * 0.9 - 0.25) + 700 * (0.9 - 0.25))
+    # Only the 1500-token prefix is cacheable, and only the two prompts that reach it pay off
+    assert five_minute_savings(1024) == pytest.approx(1500 * (0.9 - 0.25))
+
+def test_breakpoints_sit_at_or_past_minimum():
+    trie = PrefixTrie(min_prefix_tokens=1024)
+    for tail in range(4):
+        trie.insert(prompt(2000, tail), timestamp=float(tail))
+    points = trie.best_breakpoints('5m')
+    assert points and all(point['depth'] >= 1024 for point in points)
@@ -0,0 +1,101 @@
+"""Tests for vectorized routing replay"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from routing_replay import (
+    FixedPolicy, LatencyModel, ReplaySimulator, ThresholdPolicy,
+    complexity_score, model_costs, prompt_features, replay
+)
+
+PROMPTS = [
+    "Hello, how are you?",
+    "",
+    None,
+    "   leading and  trailing   ",
+    "What is 2+2? And 3*3? Or 4/4? Maybe 5%5?",
+    "Write a Python function def fib(n) that returns fib numbers",
+    "```python\nprint('hi')\n```",
+    "naïve café ünïcode — words déf",
+    "defined functions",
+    " ".join(["word"] * 60),
+    " ".join(["word"] * 120) + " def x(): return 1 = 2",
+]
+
+def reference_score(prompt):
+    """ModelTester.classify_complexity's scoring, one prompt at a time"""
+    prompt = prompt or ''
+    word_count = len(prompt.split())
+    has_code = '```' in prompt or 'def ' in prompt or 'function' in prompt
+    has_math = any(c in prompt for c in ['=', '+', '-', '*', '/', '%'])
+    score = 2 if word_count > 100 else 1 if word_count > 50 else 0
+    score += 2 * has_code + has_math + (prompt.count('?') > 2)
+    return score
+
+def test_features_match_the_per_prompt_heuristic():
+    features = prompt_features(PROMPTS)
+    assert features['word_count'].tolist() == [len((p or '').split()) for p in PROMPTS]
+    assert features['question_count'].tolist() == [(p or '').count('?') for p in PROMPTS]
+    assert complexity_score(features).tolist() == [reference_score(p) for p in PROMPTS]
+
+def test_threshold_policy_routes_by_score():
+    policy = ThresholdPolicy('tiers', ('small', 'medium', 'large'), (2, 4))
+    features = {'word_count': np.array([0, 60, 120, 120]), 'code_markers': np.array([0, 1, 0, 1]),
+                'math_chars': np.array([0, 0, 0, 1]), 'question_count': np.array([0, 0, 0, 0])}
+    # Scores 0, 3, 2, 5
+    assert policy.route(features, pd.DataFrame(index=range(4))).tolist() == [0, 1, 1, 2]
+
+def records(n=50):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'prompt': [PROMPTS[i % len(PROMPTS)] for i in range(n)],
+        'model': ['gpt-4o' if i % 3 else 'gpt-4' for i in range(n)],
+        'input_tokens': rng.integers(10, 2000, n),
+        'output_tokens': rng.integers(1, 500, n),
+    })
+
+def test_fixed_policy_is_priced_with_model_costs():
+    df = records()
+    simulator = ReplaySimulator([FixedPolicy('gpt-4o')])
+    simulator.add(df)
+
+    prices = model_costs('gpt-4o')
+    expected = ((df['input_tokens'] * prices['input'] + df['output_tokens'] * prices['output']) / 1000).sum()
+    report = simulator.report().set_index('policy')
+    assert report.loc['all-gpt-4o', 'cost'] == pytest.approx(expected)
+    assert report.loc['all-gpt-4o', 'records'] == len(df)
+
+def test_chunking_does_not_change_the_report(tmp_path):
+    path = tmp_path / 'records.csv'
+    records(200).to_csv(path, index=False)
+    policies = lambda: [ThresholdPolicy(), FixedPolicy('gpt-4o-mini')]
+
+    whole = replay(str(path), policies(), chunk_rows=1000).report()
+    chunked = replay(str(path), policies(), chunk_rows=7).report()
+
+    columns = ['policy', 'records', 'cost', 'latency_mean_ms', 'model_mix']
+    pd.testing.assert_frame_equal(chunked[columns], whole[columns], rtol=1e-9)
+
+def test_recorded_baseline_uses_recorded_cost_and_latency(tmp_path):
+    df = records(30)
+    df['cost'] = 0.01
+    df['latency_ms'] = 1000.0
+    # A model first seen in a later chunk extends the baseline mix
+    df.loc[25:, 'model'] = 'gpt-3.5-turbo'
+    path = tmp_path / 'records.jsonl'
+    df.to_json(path, orient='records', lines=True)
+
+    report = replay(str(path), [FixedPolicy('gpt-4o')], chunk_rows=10).report().set_index('policy')
+    assert report.loc['recorded', 'cost'] == pytest.approx(0.3)
+    assert report.loc['recorded', 'latency_mean_ms'] == pytest.approx(1000.0)
+    assert 'gpt-3.5-turbo 17%' in report.loc['recorded', 'model_mix']
+    assert report.loc['all-gpt-4o', 'cost_delta'] == pytest.approx(report.loc['all-gpt-4o', 'cost'] - 0.3)
+
+def test_latency_model_fits_recorded_latencies():
+    tokens = np.arange(100, dtype=np.float64)
+    latency = LatencyModel()
+    latency.fit(pd.Series(['m'] * 100), tokens, 200.0 + 3.0 * tokens)
+    assert latency.profile('m') == pytest.approx((200.0, 3.0))
+    # Unfitted models use the longest matching default prefix
+    assert latency.profile('gpt-4o-mini-2024') == (300.0, 8.0)
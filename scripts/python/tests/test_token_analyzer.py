@@ -0,0 +1,172 @@
+"""Tests for TokenAnalyzer's batched multi-tokenizer fan-out"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from token_analyzer import TokenAnalyzer, _chunked, batch_token_lengths
+
+class WordTokenizer:
+    """Slow-path tokenizer: one token per whitespace-separated word"""
+
+    def encode(self, text):
+        return text.split()
+
+class FastCharTokenizer:
+    """Stands in for a HuggingFace fast tokenizer: one token per character"""
+
+    is_fast = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, texts, return_attention_mask=False):
+        self.calls += 1
+        return {"input_ids": [list(text) for text in texts]}
+
+class VocabTokenizer:
+    """Word-level tokenizer that returns integer ids"""
+
+    def __init__(self):
+        self.vocab = {}
+
+    def encode(self, text):
+        return [self.vocab.setdefault(word, len(self.vocab)) for word in text.split()]
+
+class BrokenTokenizer:
+    def encode(self, text):
+        raise RuntimeError("tokenizer unavailable")
+
+def make_analyzer(tokenizers, index_dir=None):
+    analyzer = TokenAnalyzer.__new__(TokenAnalyzer)
+    analyzer.device = "cpu"
+    analyzer.tokenizers = tokenizers
+    analyzer.index_dir = index_dir
+    analyzer.indexes = {}
+    return analyzer
+
+def test_chunked_keeps_order_and_remainder():
+    chunks = list(_chunked(iter(range(7)), 3))
+    assert chunks == [[0, 1, 2], [3, 4, 5], [6]]
+
+def test_batch_token_lengths_uses_fast_path():
+    tokenizer = FastCharTokenizer()
+    assert batch_token_lengths(tokenizer, ["ab", "abcd", ""]) == [2, 4, 0]
+    assert tokenizer.calls == 1
+
+def test_fan_out_matches_per_model_counts():
+    texts = [f"word {'x ' * (i % 5)}end" for i in range(25)]
+    analyzer = make_analyzer({"words": WordTokenizer(), "chars": FastCharTokenizer()})
+
+    counts = analyzer.fan_out(texts, chunk_size=4)
+
+    assert counts["words"].tolist() == [len(t.split()) for t in texts]
+    assert counts["chars"].tolist() == [len(t) for t in texts]
+    assert counts["words"].dtype == np.int64
+    assert analyzer.count_tokens(texts, "words") == counts["words"].tolist()
+
+def test_fan_out_reads_a_generator_once():
+    reads = []
+
+    def texts():
+        for i in range(10):
+            reads.append(i)
+            yield f"text {i}"
+
+    analyzer = make_analyzer({"a": WordTokenizer(), "b": FastCharTokenizer()})
+    counts = analyzer.fan_out(texts(), chunk_size=3)
+
+    assert reads == list(range(10))
+    assert len(counts["a"]) == len(counts["b"]) == 10
+
+def test_fan_out_drops_failing_tokenizer_when_collecting_errors():
+    analyzer = make_analyzer({"ok": WordTokenizer(), "broken": BrokenTokenizer()})
+    errors = {}
+
+    counts = analyzer.fan_out(["a b", "c"], errors=errors)
+
+    assert counts["ok"].tolist() == [2, 1]
+    assert "broken" not in counts
+    assert isinstance(errors["broken"], RuntimeError)
+
+def test_fan_out_raises_without_error_collection():
+    analyzer = make_analyzer({"broken": BrokenTokenizer()})
+    with pytest.raises(RuntimeError):
+        analyzer.fan_out(["a"])
+
+def test_fan_out_rejects_unknown_model():
+    analyzer = make_analyzer({"ok": WordTokenizer()})
+    with pytest.raises(ValueError):
+        analyzer.fan_out(["a"], models=["missing"])
+
+def test_summarize_counts_skips_empty_models():
+    summary = TokenAnalyzer.summarize_counts({
+        "a": np.array([1, 2, 3], dtype=np.int64),
+        "b": np.array([], dtype=np.int64),
+    })
+    assert set(summary) == {"a"}
+    assert summary["a"]["total_tokens"] == 6
+    assert summary["a"]["max_tokens"] == 3
+
+def test_index_is_opt_in():
+    assert TokenAnalyzer.__init__.__defaults__ == (None,)
+
+def test_benchmark_restores_index_dir_on_error(tmp_path):
+    analyzer = make_analyzer({"broken": BrokenTokenizer()}, index_dir=str(tmp_path))
+    with pytest.raises(RuntimeError):
+        analyzer.benchmark_performance(sample_size=2)
+    assert analyzer.index_dir == str(tmp_path)
+
+class NamedWordTokenizer(WordTokenizer):
+    """Word tokenizer with the attributes tokenizer_fingerprint reads"""
+
+    name_or_path = "words"
+
+    def __init__(self):
+        self.encoded = 0
+
+    def __len__(self):
+        return 100
+
+    def encode(self, text):
+        self.encoded += 1
+        return super().encode(text)
+
+def test_fan_out_serves_repeat_runs_from_index(tmp_path):
+    texts = [f"text {i} {'y ' * i}" for i in range(12)]
+    first = make_analyzer({"words": NamedWordTokenizer()}, index_dir=str(tmp_path))
+    expected = first.fan_out(texts, chunk_size=5)["words"].tolist()
+
+    tokenizer = NamedWordTokenizer()
+    second = make_analyzer({"words": tokenizer}, index_dir=str(tmp_path))
+    assert second.fan_out(texts, chunk_size=5)["words"].tolist() == expected
+    assert tokenizer.encoded == 0
+
+def test_prefix_cache_sorts_unsorted_timestamps(tmp_path):
+    import pandas as pd
+
+    rows = [
+        {"text": "shared prefix words " * 5 + f"tail {i}", "timestamp": f"2025-01-01T00:{minute:02d}:00Z"}
+        for i, minute in enumerate([0, 20, 1, 40, 2, 3])
+    ]
+    unsorted_csv, sorted_csv = tmp_path / "unsorted.csv", tmp_path / "sorted.csv"
+    pd.DataFrame(rows).to_csv(unsorted_csv, index=False)
+    pd.DataFrame(rows).sort_values("timestamp").to_csv(sorted_csv, index=False)
+
+    analyzer = make_analyzer({"words": VocabTokenizer()})
+    unsorted_report = analyzer.analyze_prefix_cache(str(unsorted_csv), model="words", min_prefix_tokens=0, chunk_size=2)
+    sorted_report = analyzer.analyze_prefix_cache(str(sorted_csv), model="words", min_prefix_tokens=0, chunk_size=2)
+
+    assert unsorted_report["timestamps"] is True
+    for tier in ("5m", "1h"):
+        assert unsorted_report["tiers"][tier]["saved"] == sorted_report["tiers"][tier]["saved"]
+
+def test_prefix_cache_rejects_missing_timestamps(tmp_path):
+    import pandas as pd
+
+    path = tmp_path / "prompts.csv"
+    pd.DataFrame({"text": ["a b", "a c"], "timestamp": ["2025-01-01T00:00:00Z", None]}).to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        make_analyzer({"words": WordTokenizer()}).analyze_prefix_cache(str(path), model="words")
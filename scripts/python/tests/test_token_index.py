@@ -0,0 +1,144 @@
+"""Tests for the persistent token count index"""
+
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import token_index
+from token_index import DELTA_DTYPE, TokenCountIndex, batch_token_lengths, hash_texts
+
+FINGERPRINT = "test/words/1"
+
+class WordTokenizer:
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, text):
+        self.encoded += 1
+        return text.split()
+
+def open_index(tmp_path, fingerprint=FINGERPRINT):
+    return TokenCountIndex("words", fingerprint, str(tmp_path))
+
+def count_with(index, tokenizer, texts):
+    return index.counts_for(texts, lambda missing: batch_token_lengths(tokenizer, missing))
+
+def test_counts_round_trip_through_delta_log(tmp_path):
+    texts = ["one", "two words", "three more words"]
+    index = open_index(tmp_path)
+    assert count_with(index, WordTokenizer(), texts) == [1, 2, 3]
+    index.flush()
+
+    tokenizer = WordTokenizer()
+    reopened = open_index(tmp_path)
+    assert count_with(reopened, tokenizer, texts) == [1, 2, 3]
+    assert tokenizer.encoded == 0
+    assert reopened.stats()["hits"] == 3
+
+def test_counts_round_trip_through_compaction(tmp_path):
+    texts = [f"text {'x ' * i}" for i in range(50)]
+    index = open_index(tmp_path)
+    expected = count_with(index, WordTokenizer(), texts)
+    index.compact()
+    assert not index.delta_path.exists()
+
+    reopened = open_index(tmp_path)
+    assert len(reopened) == 50
+    assert reopened.lookup(hash_texts(texts)).tolist() == expected
+
+def test_unflushed_entries_are_not_persisted(tmp_path):
+    index = open_index(tmp_path)
+    count_with(index, WordTokenizer(), ["a b"])
+    assert index.pending == 1
+    assert open_index(tmp_path).lookup(hash_texts(["a b"])).tolist() == [-1]
+
+def test_torn_tail_is_ignored_and_trimmed_on_next_append(tmp_path):
+    index = open_index(tmp_path)
+    count_with(index, WordTokenizer(), ["a", "b c"])
+    index.flush()
+    with open(index.delta_path, "ab") as f:
+        f.write(b"\x01\x02\x03")  # crashed mid-record
+
+    recovered = open_index(tmp_path)
+    assert recovered.lookup(hash_texts(["a", "b c"])).tolist() == [1, 2]
+    count_with(recovered, WordTokenizer(), ["d e f"])
+    recovered.flush()
+
+    assert index.delta_path.stat().st_size % DELTA_DTYPE.itemsize == 0
+    assert open_index(tmp_path).lookup(hash_texts(["a", "b c", "d e f"])).tolist() == [1, 2, 3]
+
+def test_fingerprint_change_discards_stale_counts(tmp_path):
+    index = open_index(tmp_path)
+    count_with(index, WordTokenizer(), ["a b"])
+    index.compact()
+
+    changed = open_index(tmp_path, fingerprint="test/words/2")
+    assert len(changed) == 0
+    assert changed.lookup(hash_texts(["a b"])).tolist() == [-1]
+
+def test_fingerprint_includes_count_policy():
+    class Tokenizer:
+        name_or_path = "tok"
+
+        def __len__(self):
+            return 10
+
+    assert token_index.COUNT_POLICY in token_index.tokenizer_fingerprint(Tokenizer())
+
+def test_compact_retain_drops_other_hashes(tmp_path):
+    index = open_index(tmp_path)
+    count_with(index, WordTokenizer(), ["keep me", "drop"])
+    index.compact(retain=hash_texts(["keep me"]))
+    assert index.lookup(hash_texts(["keep me", "drop"])).tolist() == [2, -1]
+
+def test_compaction_keeps_entries_from_another_writer(tmp_path):
+    first, second = open_index(tmp_path), open_index(tmp_path)
+    count_with(first, WordTokenizer(), ["from first"])
+    count_with(second, WordTokenizer(), ["from second writer"])
+    second.flush()
+
+    # `first` never saw the second writer's entry, but compaction re-reads under the lock
+    first.compact()
+    assert open_index(tmp_path).lookup(hash_texts(["from first", "from second writer"])).tolist() == [2, 3]
+
+def _write_entries(args):
+    index_dir, worker = args
+    index = TokenCountIndex("words", FINGERPRINT, index_dir)
+    for round_ in range(20):
+        texts = [f"w{worker} r{round_} {'x ' * i}" for i in range(25)]
+        count_with(index, WordTokenizer(), texts)
+        index.flush()
+        if round_ % 7 == 6:
+            index.compact()
+
+def test_concurrent_writers_do_not_lose_or_corrupt_entries(tmp_path):
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        pool.map(_write_entries, [(str(tmp_path), worker) for worker in range(4)])
+
+    index = open_index(tmp_path)
+    texts = [f"w{w} r{r} {'x ' * i}" for w in range(4) for r in range(20) for i in range(25)]
+    assert index.lookup(hash_texts(texts)).tolist() == [len(t.split()) for t in texts]
+
+def test_gpu_tokenizer_flushes_on_threshold_and_close(tmp_path, monkeypatch):
+    gpu_tokenizer = pytest.importorskip("gpu_tokenizer")
+    monkeypatch.setattr(gpu_tokenizer, "INDEX_FLUSH_RECORDS", 3)
+    monkeypatch.setattr(gpu_tokenizer, "tokenizer_fingerprint", lambda tokenizer: FINGERPRINT)
+
+    counter = gpu_tokenizer.GPUTokenizer.__new__(gpu_tokenizer.GPUTokenizer)
+    counter.model = "words"
+    counter.index_dir = str(tmp_path)
+    counter.indexes = {}
+    counter.tokenizers = {"words": WordTokenizer()}
+
+    assert counter.count_tokens_batch(["a", "b c"]) == [1, 2]
+    assert counter.indexes["words"].pending == 2
+    counter.count_tokens_batch(["d e f"])
+    assert counter.indexes["words"].pending == 0
+
+    counter.count_tokens_batch(["g"])
+    counter.close()
+    assert open_index(tmp_path).lookup(hash_texts(["a", "d e f", "g"])).tolist() == [1, 3, 1]
+
+    counter.count_tokens_batch(["never indexed"], use_index=False)
+    assert open_index(tmp_path).lookup(hash_texts(["never indexed"])).tolist() == [-1]
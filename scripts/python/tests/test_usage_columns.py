@@ -0,0 +1,91 @@
+"""Tests for the columnar usage export store"""
+
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from usage_columns import EXPORT_SCHEMAS, PROVIDERS, UsageColumns
+
+REPORTS = Path(__file__).resolve().parents[3] / 'data' / 'usage-reports'
+ANTHROPIC = REPORTS / 'claude_api_tokens_2025_08.csv'
+OPENAI = REPORTS / 'completions_usage_2025-07-16_2025-08-15.csv'
+
+def expected_rows(path: Path, provider: str) -> pd.DataFrame:
+    """The export's non-empty rows in normalized column names, read straight from the CSV"""
+    schema = EXPORT_SCHEMAS[provider]
+    df = pd.read_csv(path, dtype=str)
+    df = df[df[schema['columns']['model']].notna()]
+
+    time_col, kind = schema['time']
+    if kind == 'epoch':
+        ts = df[time_col].astype('int64')
+    else:
+        ts = pd.to_datetime(df[time_col], utc=True).dt.as_unit('s').astype('int64')
+    out = pd.DataFrame({'ts': ts.to_numpy(), 'provider': provider})
+    for column, source in schema['columns'].items():
+        values = df[source]
+        if column in ('model', 'workspace', 'api_key'):
+            out[column] = values.fillna('').to_numpy()
+        else:
+            out[column] = values.fillna('0').astype(float).astype('int64').to_numpy()
+    return out
+
+def decoded(store: UsageColumns, **filters) -> pd.DataFrame:
+    data = store.scan(**filters)
+    df = pd.DataFrame({column: np.asarray(values) for column, values in data.items()})
+    for column in ('model', 'workspace', 'api_key'):
+        df[column] = [store.dictionaries[column][code] for code in df[column]]
+    df['provider'] = [PROVIDERS[code] for code in df['provider']]
+    return df
+
+def assert_matches_csv(store: UsageColumns, path: Path, provider: str):
+    expected = expected_rows(path, provider)
+    actual = decoded(store, provider=provider)
+    assert len(actual) == len(expected)
+    for column in expected.columns:
+        assert actual[column].tolist() == expected[column].tolist(), column
+
+@pytest.fixture
+def store(tmp_path):
+    store = UsageColumns(str(tmp_path / 'columns'))
+    store.ingest(str(ANTHROPIC), chunk_rows=4)
+    store.ingest(str(OPENAI), chunk_rows=4)
+    return store
+
+def test_read_back_equals_csv(store):
+    assert len(store.manifest['segments']) > 2
+    assert_matches_csv(store, ANTHROPIC, 'anthropic')
+    assert_matches_csv(store, OPENAI, 'openai')
+
+def test_reopened_store_reads_the_same_rows(store):
+    reopened = UsageColumns(str(store.root))
+    assert len(reopened) == len(store)
+    assert_matches_csv(reopened, ANTHROPIC, 'anthropic')
+    assert_matches_csv(reopened, OPENAI, 'openai')
+
+def test_totals_match_csv_groupby(store):
+    expected = expected_rows(ANTHROPIC, 'anthropic').groupby('model')['output_tokens'].sum()
+    totals = store.totals('model', provider='anthropic').set_index('model')['output_tokens']
+    assert totals.sort_index().to_dict() == pytest.approx(expected.sort_index().to_dict())
+
+def test_time_filter_skips_rows_outside_range(store):
+    expected = expected_rows(ANTHROPIC, 'anthropic')
+    start = int(expected['ts'].min()) + 1
+    rows = store.scan(['ts'], start=start, provider='anthropic')['ts']
+    assert sorted(rows.tolist()) == sorted(t for t in expected['ts'] if t >= start)
+
+def test_unchanged_export_is_skipped_and_changed_one_replaced(store, tmp_path):
+    assert store.ingest(str(ANTHROPIC)) == 0
+    before = len(store)
+
+    copy = tmp_path / 'export.csv'
+    shutil.copy(ANTHROPIC, copy)
+    assert store.ingest(str(copy)) > 2
+
+    lines = copy.read_text(encoding='utf-8').splitlines(keepends=True)
+    copy.write_text(''.join(lines[:3]), encoding='utf-8')
+    assert store.ingest(str(copy)) == 2
+    assert len(store) == before + 2
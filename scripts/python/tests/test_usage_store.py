@@ -0,0 +1,98 @@
+"""Tests for the SQLite usage store and shared pricing"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from pricing import CACHE_PRICING, OPENAI_CACHED_INPUT, model_prices
+from usage_store import UsageStore
+
+ANTHROPIC_HEADER = (
+    'usage_date_utc,model_version,workspace,api_key,usage_input_tokens_no_cache,'
+    'usage_input_tokens_cache_write_5m,usage_input_tokens_cache_write_1h,'
+    'usage_input_tokens_cache_read,usage_output_tokens\n'
+)
+
+OPENAI_HEADER = 'start_time,model,project_id,api_key_id,input_tokens,input_cached_tokens,output_tokens,num_model_requests\n'
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+@pytest.fixture
+def store(tmp_path):
+    store = UsageStore(str(tmp_path / 'usage.db'))
+    yield store
+    store.conn.close()
+
+def test_model_prices_matches_longest_prefix():
+    assert model_prices('gpt-4o-mini-2024-07-18') == {'input': 0.00015, 'output': 0.0006}
+    assert model_prices('gpt-4o-2024-08-06')['input'] == 0.005
+    assert model_prices('gpt-4-0613')['input'] == 0.03
+    assert model_prices('unknown-model') == {'input': 0.0, 'output': 0.0}
+
+def test_records_roll_up_into_every_level(store):
+    base = utc(2024, 5, 1, 10, 0).timestamp()
+    records = [
+        {'timestamp': base + offset, 'model': 'gpt-4o', 'input_tokens': 100, 'output_tokens': 10, 'cost': 0.5}
+        for offset in (0, 30, 90, 3700)
+    ]
+    assert store.ingest_records(records) == 4
+
+    minutes = store.query('minute', utc(2024, 5, 1), utc(2024, 5, 2))
+    assert minutes['requests'].tolist() == [2, 1, 1]
+    hours = store.query('hour', utc(2024, 5, 1), utc(2024, 5, 2))
+    assert hours['requests'].tolist() == [3, 1]
+    days = store.query('day', utc(2024, 5, 1), utc(2024, 5, 2))
+    assert days['tokens'].tolist() == [440]
+    assert days['cost'].tolist() == pytest.approx([2.0])
+
+def test_anthropic_export_prices_cache_tokens(store, tmp_path):
+    path = tmp_path / 'anthropic.csv'
+    path.write_text(ANTHROPIC_HEADER + '2024-05-01,claude-3-5-sonnet-20241022,ws,key,1000,1000,0,1000,100\n')
+
+    assert store.ingest_csv(str(path)) == 1
+
+    days = store.query('day', utc(2024, 5, 1), utc(2024, 5, 2))
+    input_equivalent = 1000 + 1000 * CACHE_PRICING['5m']['write'] + 1000 * CACHE_PRICING['5m']['read']
+    assert days['cost'].tolist() == pytest.approx([(input_equivalent * 0.003 + 100 * 0.015) / 1000])
+    assert days['cached_tokens'].tolist() == [1000]
+    # Daily exports never land in the finer rollups
+    assert store.query('minute', utc(2024, 5, 1), utc(2024, 5, 2)).empty
+
+def test_reingesting_a_changed_export_replaces_it(store, tmp_path):
+    path = tmp_path / 'anthropic.csv'
+    path.write_text(ANTHROPIC_HEADER + '2024-05-01,claude-3-haiku,ws,key,1000,0,0,0,0\n')
+    store.ingest_csv(str(path))
+    assert store.ingest_csv(str(path)) == 0
+
+    path.write_text(ANTHROPIC_HEADER + '2024-05-01,claude-3-haiku,ws,key,3000,0,0,0,0\n')
+    assert store.ingest_csv(str(path)) == 1
+
+    days = store.query('day', utc(2024, 5, 1), utc(2024, 5, 2))
+    assert days['input_tokens'].tolist() == [3000]
+
+def test_openai_export_prices_cached_input(store, tmp_path):
+    path = tmp_path / 'openai.csv'
+    start = int(utc(2024, 5, 1).timestamp())
+    path.write_text(OPENAI_HEADER + f'{start},gpt-4o-2024-08-06,proj,key,1000,400,100,3\n')
+
+    assert store.ingest_csv(str(path)) == 1
+
+    days = store.query('day', utc(2024, 5, 1), utc(2024, 5, 2))
+    input_equivalent = 600 + 400 * OPENAI_CACHED_INPUT
+    assert days['cost'].tolist() == pytest.approx([(input_equivalent * 0.005 + 100 * 0.015) / 1000])
+    assert days['requests'].tolist() == [3]
+
+def test_reingest_after_dropping_raw_events_replaces_the_old_totals(store, tmp_path):
+    path = tmp_path / 'anthropic.csv'
+    path.write_text(ANTHROPIC_HEADER + '2024-05-01,claude-3-haiku,ws,key,1000,0,0,0,0\n'
+                    + '2024-06-01,claude-3-haiku,ws,key,500,0,0,0,0\n')
+    store.ingest_csv(str(path))
+    assert store.drop_events_before(utc(2024, 6, 1)) == ['events_202405']
+
+    path.write_text(ANTHROPIC_HEADER + '2024-05-01,claude-3-haiku,ws,key,3000,0,0,0,0\n'
+                    + '2024-06-01,claude-3-haiku,ws,key,700,0,0,0,0\n')
+    assert store.ingest_csv(str(path)) == 2
+
+    days = store.query('day', utc(2024, 5, 1), utc(2024, 7, 1))
+    assert days['input_tokens'].tolist() == [3000, 700]
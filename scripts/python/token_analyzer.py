@@ -9,17 +9,38 @@ from transformers import AutoTokenizer
 import tiktoken
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import json
 import argparse
 from pathlib import Path
 import time
 from tqdm import tqdm
 
+from token_index import (
+    TokenCountIndex, DEFAULT_INDEX_DIR, batch_encode, batch_token_lengths, hash_texts, tokenizer_fingerprint
+)
+from prefix_trie import PrefixTrie, DEFAULT_MAX_NODES, DEFAULT_MIN_PREFIX_TOKENS
+
+# Texts read and tokenized per fan-out step
+DEFAULT_CHUNK_SIZE = 2048
+
+def _chunked(texts: Iterable[str], size: int) -> Iterator[List[str]]:
+    """Yield lists of up to `size` texts"""
+    chunk = []
+    for text in texts:
+        chunk.append(text)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
 class TokenAnalyzer:
     """GPU-accelerated token analysis for multiple models"""
     
-    def __init__(self):
+    def __init__(self, index_dir: Optional[str] = None):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         print(f"🎮 Using device: {self.device}")
         
@@ -27,6 +48,10 @@ class TokenAnalyzer:
         self.tokenizers = {}
         self._load_tokenizers()
         
+        # Persistent token count indexes (opt-in), opened per model on first use
+        self.index_dir = index_dir
+        self.indexes: Dict[str, TokenCountIndex] = {}
+        
     def _load_tokenizers(self):
         """Load tokenizers for various models"""
         print("Loading tokenizers...")
@@ -49,94 +74,236 @@ class TokenAnalyzer:
         except Exception as e:
             print(f"⚠️ Could not load Llama2 tokenizer: {e}")
     
+    def get_index(self, model: str) -> Optional[TokenCountIndex]:
+        """Token count index for a model, or None when indexing is disabled"""
+        if self.index_dir is None:
+            return None
+        if model not in self.indexes:
+            fingerprint = tokenizer_fingerprint(self.tokenizers[model])
+            self.indexes[model] = TokenCountIndex(model, fingerprint, self.index_dir)
+        return self.indexes[model]
+    
+    def _counter(self, model: str, chunk: List[str], hashes: Optional[np.ndarray]) -> List[int]:
+        """Token counts for a chunk, served from the index where possible"""
+        encode = partial(batch_token_lengths, self.tokenizers[model])
+        index = self.get_index(model)
+        if index is None:
+            return encode(chunk)
+        return index.counts_for(chunk, encode, hashes)
+    
+    def flush_indexes(self):
+        """Persist index entries recorded since the last flush"""
+        for index in self.indexes.values():
+            index.flush()
+    
     def count_tokens(self, texts: List[str], model: str = 'gpt-4') -> List[int]:
         """Count tokens for a list of texts"""
         if model not in self.tokenizers:
             raise ValueError(f"Model {model} not available. Choose from: {list(self.tokenizers.keys())}")
         
-        tokenizer = self.tokenizers[model]
         counts = []
         
-        if self.device == 'cuda' and hasattr(tokenizer, 'encode_batch'):
-            # Batch processing on GPU if available
-            with torch.cuda.amp.autocast():
-                for text in tqdm(texts, desc="Counting tokens"):
-                    counts.append(len(tokenizer.encode(text)))
-        else:
-            # CPU processing
-            for text in tqdm(texts, desc="Counting tokens"):
-                if hasattr(tokenizer, 'encode'):
-                    counts.append(len(tokenizer.encode(text)))
-                else:
-                    # For HuggingFace tokenizers
-                    counts.append(len(tokenizer(text)['input_ids']))
+        for chunk in tqdm(list(_chunked(texts, DEFAULT_CHUNK_SIZE)), desc="Counting tokens"):
+            counts.extend(self._counter(model, chunk, None))
         
+        self.flush_indexes()
         return counts
     
+    def fan_out(
+        self,
+        texts: Iterable[str],
+        models: Optional[List[str]] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        errors: Optional[Dict[str, Exception]] = None
+    ) -> Dict[str, np.ndarray]:
+        """Tokenize texts with several tokenizers in a single pass
+        
+        Each chunk is read and hashed once and handed to every tokenizer
+        concurrently; only texts missing from the token count index are
+        encoded. If `errors` is given, a failing tokenizer is recorded there and
+        dropped instead of aborting the whole pass.
+        """
+        models = list(models or self.tokenizers.keys())
+        for model in models:
+            if model not in self.tokenizers:
+                raise ValueError(f"Model {model} not available. Choose from: {list(self.tokenizers.keys())}")
+        
+        counts = {model: [] for model in models}
+        active = list(models)
+        
+        with ThreadPoolExecutor(max_workers=max(len(models), 1)) as pool:
+            for chunk in _chunked(texts, chunk_size):
+                hashes = hash_texts(chunk) if self.index_dir is not None else None
+                futures = {
+                    model: pool.submit(self._counter, model, chunk, hashes)
+                    for model in active
+                }
+                for model, future in futures.items():
+                    try:
+                        counts[model].extend(future.result())
+                    except Exception as e:
+                        if errors is None:
+                            raise
+                        errors[model] = e
+                        active.remove(model)
+                        del counts[model]
+        
+        self.flush_indexes()
+        return {model: np.asarray(c, dtype=np.int64) for model, c in counts.items()}
+    
     def compare_models(self, text: str) -> pd.DataFrame:
         """Compare tokenization across different models"""
+        # Estimate costs (example rates)
+        cost_per_1k = {
+            'gpt-4': 0.03,
+            'gpt-3.5-turbo': 0.002,
+            'llama2': 0.0  # Local model
+        }
+        
+        errors = {}
+        counts = self.fan_out([text], errors=errors)
         results = {}
         
-        for model_name, tokenizer in self.tokenizers.items():
-            try:
-                if hasattr(tokenizer, 'encode'):
-                    token_count = len(tokenizer.encode(text))
-                else:
-                    token_count = len(tokenizer(text)['input_ids'])
-                
-                # Estimate costs (example rates)
-                cost_per_1k = {
-                    'gpt-4': 0.03,
-                    'gpt-3.5-turbo': 0.002,
-                    'llama2': 0.0  # Local model
-                }
-                
-                cost = (token_count / 1000) * cost_per_1k.get(model_name, 0)
-                
-                results[model_name] = {
-                    'tokens': token_count,
-                    'cost_per_1k': cost_per_1k.get(model_name, 0),
-                    'estimated_cost': f"${cost:.6f}"
-                }
-            except Exception as e:
+        for model_name in self.tokenizers:
+            if model_name in errors:
                 results[model_name] = {
                     'tokens': 'Error',
                     'cost_per_1k': 0,
-                    'estimated_cost': f"Error: {e}"
+                    'estimated_cost': f"Error: {errors[model_name]}"
                 }
+                continue
+            
+            token_count = int(counts[model_name][0])
+            cost = (token_count / 1000) * cost_per_1k.get(model_name, 0)
+            
+            results[model_name] = {
+                'tokens': token_count,
+                'cost_per_1k': cost_per_1k.get(model_name, 0),
+                'estimated_cost': f"${cost:.6f}"
+            }
         
         return pd.DataFrame(results).T
     
-    def analyze_dataset(self, file_path: str) -> Dict[str, Any]:
+    def analyze_dataset(self, file_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
         """Analyze a dataset of texts"""
-        df = pd.read_csv(file_path)
-        
         # Assuming the CSV has a 'text' column
-        if 'text' not in df.columns:
+        if 'text' not in pd.read_csv(file_path, nrows=0).columns:
             raise ValueError("CSV must have a 'text' column")
         
-        texts = df['text'].tolist()
+        def iter_texts():
+            reader = pd.read_csv(file_path, usecols=['text'], chunksize=chunk_size)
+            for frame in tqdm(reader, desc="Reading dataset"):
+                yield from frame['text'].fillna('').astype(str)
         
-        # Analyze with each model
-        results = {}
-        for model in self.tokenizers.keys():
-            print(f"\nAnalyzing with {model}...")
-            counts = self.count_tokens(texts, model)
+        # Analyze with every model in one pass over the file
+        print(f"\nAnalyzing with {', '.join(self.tokenizers.keys())}...")
+        counts = self.fan_out(iter_texts(), chunk_size=chunk_size)
+        
+        return self.summarize_counts(counts)
+    
+    def analyze_prefix_cache(
+        self,
+        file_path: str,
+        model: str = 'gpt-4',
+        cost_per_1k: float = 0.003,
+        max_nodes: int = DEFAULT_MAX_NODES,
+        breakpoints: int = 4,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        min_prefix_tokens: int = DEFAULT_MIN_PREFIX_TOKENS
+    ) -> Dict[str, Any]:
+        """Estimate prompt-cache savings from shared token prefixes
+        
+        Streams the CSV's 'text' column into a bounded prefix trie. An
+        optional 'timestamp' column drives the 5m/1h cache expiry simulation;
+        files not already in timestamp order are loaded and sorted first.
+        Without timestamps the report is flagged as an upper bound.
+        """
+        if model not in self.tokenizers:
+            raise ValueError(f"Model {model} not available. Choose from: {list(self.tokenizers.keys())}")
+        
+        columns = pd.read_csv(file_path, nrows=0).columns
+        if 'text' not in columns:
+            raise ValueError("CSV must have a 'text' column")
+        usecols = ['text', 'timestamp'] if 'timestamp' in columns else ['text']
+        
+        tokenizer = self.tokenizers[model]
+        trie = PrefixTrie(max_nodes=max_nodes, min_prefix_tokens=min_prefix_tokens)
+        
+        for frame in tqdm(self._prompt_frames(file_path, usecols, chunk_size), desc="Building prefix trie"):
+            texts = frame['text'].fillna('').astype(str).tolist()
+            if 'timestamp' in frame:
+                timestamps = frame['timestamp'].tolist()
+            else:
+                timestamps = [None] * len(texts)
             
+            for tokens, timestamp in zip(batch_encode(tokenizer, texts), timestamps):
+                trie.insert(tokens, timestamp)
+        
+        decode = getattr(tokenizer, 'decode', None)
+        return trie.report(cost_per_1k, decode=decode, breakpoints=breakpoints)
+    
+    @staticmethod
+    def _prompt_frames(file_path: str, usecols: List[str], chunk_size: int) -> Iterator[pd.DataFrame]:
+        """CSV chunks in timestamp order, with timestamps as float epoch seconds
+        
+        Files already in order are streamed; anything else is read whole and
+        sorted, since the cache expiry simulation depends on arrival order.
+        """
+        def seconds(column: pd.Series) -> pd.Series:
+            parsed = pd.to_datetime(column, utc=True)
+            return (parsed - pd.Timestamp(0, tz='UTC')).dt.total_seconds()
+        
+        if 'timestamp' not in usecols:
+            yield from pd.read_csv(file_path, usecols=usecols, chunksize=chunk_size)
+            return
+        
+        timestamps = seconds(pd.read_csv(file_path, usecols=['timestamp'])['timestamp'])
+        missing = int(timestamps.isna().sum())
+        if missing:
+            raise ValueError(f"{missing} rows have no timestamp; fill them or drop the column")
+        
+        if timestamps.is_monotonic_increasing:
+            for frame in pd.read_csv(file_path, usecols=usecols, chunksize=chunk_size):
+                frame['timestamp'] = seconds(frame['timestamp'])
+                yield frame
+            return
+        
+        print("⚠️ Timestamps are out of order; sorting the file in memory")
+        frame = pd.read_csv(file_path, usecols=usecols)
+        frame['timestamp'] = seconds(frame['timestamp'])
+        frame = frame.sort_values('timestamp', kind='stable')
+        for start in range(0, len(frame), chunk_size):
+            yield frame.iloc[start:start + chunk_size]
+    
+    @staticmethod
+    def summarize_counts(counts: Dict[str, np.ndarray]) -> Dict[str, Any]:
+        """Per-model token statistics from fan-out counts"""
+        results = {}
+        for model, model_counts in counts.items():
+            if len(model_counts) == 0:
+                continue
             results[model] = {
-                'total_tokens': sum(counts),
-                'avg_tokens': np.mean(counts),
-                'std_tokens': np.std(counts),
-                'min_tokens': min(counts),
-                'max_tokens': max(counts),
-                'percentile_50': np.percentile(counts, 50),
-                'percentile_95': np.percentile(counts, 95)
+                'total_tokens': int(model_counts.sum()),
+                'avg_tokens': np.mean(model_counts),
+                'std_tokens': np.std(model_counts),
+                'min_tokens': int(model_counts.min()),
+                'max_tokens': int(model_counts.max()),
+                'percentile_50': np.percentile(model_counts, 50),
+                'percentile_95': np.percentile(model_counts, 95)
             }
         
         return results
     
     def benchmark_performance(self, sample_size: int = 1000) -> Dict[str, float]:
         """Benchmark tokenization performance"""
+        # Measure raw tokenization rather than index lookups
+        index_dir, self.index_dir = self.index_dir, None
+        try:
+            return self._benchmark(sample_size)
+        finally:
+            self.index_dir = index_dir
+    
+    def _benchmark(self, sample_size: int) -> Dict[str, float]:
         # Generate sample texts
         sample_texts = [
             f"This is a sample text number {i} for benchmarking tokenization performance."
@@ -156,6 +323,17 @@ class TokenAnalyzer:
                 'ms_per_text': (elapsed * 1000) / sample_size
             }
         
+        # All tokenizers in a single fan-out pass
+        start_time = time.time()
+        _ = self.fan_out(sample_texts)
+        elapsed = time.time() - start_time
+        
+        results['all (fan-out)'] = {
+            'total_time': elapsed,
+            'texts_per_second': sample_size / elapsed,
+            'ms_per_text': (elapsed * 1000) / sample_size
+        }
+        
         return results
 
 def main():
@@ -165,10 +343,18 @@ def main():
     parser.add_argument('--benchmark', action='store_true', help='Run performance benchmark')
     parser.add_argument('--compare', action='store_true', help='Compare models')
     parser.add_argument('--model', type=str, default='gpt-4', help='Model to use')
+    parser.add_argument('--index', action='store_true', help=f'Reuse counts from a persistent token count index in {DEFAULT_INDEX_DIR}')
+    parser.add_argument('--index-dir', type=str, default=None, help='Token count index directory (implies --index)')
+    parser.add_argument('--compact-index', action='store_true', help='Compact the token count index after the run')
+    parser.add_argument('--prefix-cache', action='store_true', help='Estimate prompt-cache savings for --file')
+    parser.add_argument('--input-cost-per-1k', type=float, default=0.003, help='Base input price for --prefix-cache')
+    parser.add_argument('--max-trie-nodes', type=int, default=DEFAULT_MAX_NODES, help='Memory bound for --prefix-cache')
+    parser.add_argument('--min-prefix-tokens', type=int, default=DEFAULT_MIN_PREFIX_TOKENS, help="Provider's minimum cacheable prefix for --prefix-cache")
     
     args = parser.parse_args()
     
-    analyzer = TokenAnalyzer()
+    index_dir = args.index_dir or (DEFAULT_INDEX_DIR if args.index else None)
+    analyzer = TokenAnalyzer(index_dir=index_dir)
     
     if args.benchmark:
         print("\n🏃 Running performance benchmark...")
@@ -183,12 +369,40 @@ def main():
         print("\nComparison Results:")
         print(df.to_string())
     
+    elif args.file and args.prefix_cache:
+        print(f"\n🗂️ Analyzing prompt prefixes: {args.file}")
+        report = analyzer.analyze_prefix_cache(
+            args.file,
+            model=args.model,
+            cost_per_1k=args.input_cost_per_1k,
+            max_nodes=args.max_trie_nodes,
+            min_prefix_tokens=args.min_prefix_tokens
+        )
+        print(f"\nPrompts: {report['prompts']:,}  Tokens: {report['total_tokens']:,}")
+        print(f"Shared-prefix tokens: {report['shared_prefix_tokens']:,} ({report['shared_prefix_pct']:.1%})")
+        print(f"Uncached input cost: ${report['baseline_cost']:.4f}")
+        if report['upper_bound']:
+            print("⚠️ No timestamp column: every prompt is treated as arriving within one cache TTL, so savings are an upper bound")
+        if report['pruned_nodes']:
+            print(f"⚠️ Pruned {report['pruned_nodes']:,} low-frequency branches; savings are a lower bound")
+        
+        for tier, data in report['tiers'].items():
+            print(f"\n{tier} cache: saves ${data['saved']:.4f} ({data['saved_pct']:.1%} of input tokens)")
+            if data['breakpoints']:
+                print(pd.DataFrame(data['breakpoints']).to_string())
+    
     elif args.file:
         print(f"\n📁 Analyzing dataset: {args.file}")
         results = analyzer.analyze_dataset(args.file)
         df = pd.DataFrame(results).T
         print("\nDataset Analysis:")
         print(df.to_string())
+        
+        for model, index in analyzer.indexes.items():
+            stats = index.stats()
+            print(f"Index {model}: {stats['hits']:,} cached, {stats['misses']:,} encoded ({stats['hit_rate']:.1%} hit rate)")
+            if args.compact_index:
+                index.compact()
     
     elif args.text:
         print(f"\n💬 Analyzing text with {args.model}...")
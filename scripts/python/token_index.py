@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Token Count Index - persistent (tokenizer, content hash) -> token count store
+Shared by token_analyzer.py and scripts/gpu_tokenizer.py so reruns over
+mostly unchanged datasets only encode new or changed texts.
+
+Layout per tokenizer id under the index directory:
+    <id>.json        manifest (format version, tokenizer fingerprint)
+    <id>.keys.npy    sorted uint64 content hashes (memory-mapped)
+    <id>.counts.npy  uint32 token counts aligned with keys (memory-mapped)
+    <id>.delta       append-only log of (hash, count) records since last compaction
+    <id>.lock        writer lock; appends and compaction hold it exclusively
+
+Usage: python scripts/python/token_index.py --compact [--index-dir DIR]
+"""
+
+import os
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Bump when the on-disk layout changes; older indexes are rebuilt
+INDEX_FORMAT_VERSION = 1
+
+# How texts are counted; part of every fingerprint so indexes written under a
+# different policy are rebuilt. Special-token strings count as plain text.
+COUNT_POLICY = 'ordinary-v1'
+
+DEFAULT_INDEX_DIR = os.environ.get(
+    'METERR_TOKEN_INDEX_DIR',
+    str(Path.home() / '.cache' / 'meterr' / 'token-index')
+)
+
+# Compact once the delta log holds this many records
+AUTO_COMPACT_RECORDS = 1_000_000
+
+DELTA_DTYPE = np.dtype([('key', '<u8'), ('count', '<u4')])
+
+def batch_encode(tokenizer, texts: List[str]) -> List[List[int]]:
+    """Encode a batch of texts using the tokenizer's batched fast path"""
+    if hasattr(tokenizer, 'encode_ordinary_batch'):
+        # tiktoken encodes batches in Rust across its own thread pool
+        return tokenizer.encode_batch(texts, disallowed_special=())
+    if getattr(tokenizer, 'is_fast', False):
+        # HuggingFace fast tokenizers batch in Rust as well
+        return tokenizer(texts, return_attention_mask=False)['input_ids']
+    return [tokenizer.encode(text) for text in texts]
+
+def batch_token_lengths(tokenizer, texts: List[str]) -> List[int]:
+    """Token counts under COUNT_POLICY; every writer of an index counts with this"""
+    return [len(tokens) for tokens in batch_encode(tokenizer, texts)]
+
+def hash_texts(texts: List[str]) -> np.ndarray:
+    """64-bit content hashes for a list of texts"""
+    hashes = np.empty(len(texts), dtype=np.uint64)
+    for i, text in enumerate(texts):
+        digest = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+        hashes[i] = int.from_bytes(digest, 'little')
+    return hashes
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Version string that changes whenever the tokenizer's output could change"""
+    if hasattr(tokenizer, 'encode_ordinary_batch'):
+        import tiktoken
+        return f"{COUNT_POLICY}/tiktoken/{tiktoken.__version__}/{tokenizer.name}/{tokenizer.n_vocab}"
+
+    try:
+        import transformers
+        version = transformers.__version__
+    except ImportError:
+        version = 'unknown'
+
+    name = getattr(tokenizer, 'name_or_path', type(tokenizer).__name__)
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is not None:
+        # Fast tokenizers serialize their full vocab/merges/normalizer config
+        vocab_hash = hashlib.sha1(backend.to_str().encode('utf-8')).hexdigest()[:16]
+    else:
+        vocab_hash = str(len(tokenizer))
+    return f"{COUNT_POLICY}/hf/{version}/{name}/{vocab_hash}"
+
+def _safe_name(tokenizer_id: str) -> str:
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in tokenizer_id)
+
+class TokenCountIndex:
+    """Persistent token count index for a single tokenizer
+
+    Compacted entries live in sorted, memory-mapped arrays and are looked up
+    with a vectorized binary search. New entries are appended to a delta log
+    and folded into the sorted arrays by `compact()`. Several processes may
+    write the same tokenizer id: appends and compaction hold an exclusive
+    lock on `<id>.lock`, and compaction re-reads the files under that lock
+    so other writers' entries are kept.
+    """
+
+    def __init__(self, tokenizer_id: str, fingerprint: str, index_dir: str = DEFAULT_INDEX_DIR):
+        self.tokenizer_id = tokenizer_id
+        self.fingerprint = fingerprint
+        self.root = Path(index_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        base = self.root / _safe_name(tokenizer_id)
+        self.manifest_path = base.with_suffix('.json')
+        self.keys_path = Path(f"{base}.keys.npy")
+        self.counts_path = Path(f"{base}.counts.npy")
+        self.delta_path = Path(f"{base}.delta")
+        self.lock_path = Path(f"{base}.lock")
+
+        self.hits = 0
+        self.misses = 0
+
+        self._pending_keys: List[np.ndarray] = []
+        self._pending_counts: List[np.ndarray] = []
+        self._recent: Dict[int, int] = {}
+        with self._locked():
+            self._load()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the exclusive writer lock for this tokenizer id"""
+        with open(self.lock_path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _load(self):
+        """Check the manifest, then open the compacted arrays and replay the delta log"""
+        manifest = None
+        if self.manifest_path.exists():
+            try:
+                manifest = json.loads(self.manifest_path.read_text())
+            except (OSError, ValueError):
+                manifest = None
+
+        if (
+            manifest is None
+            or manifest.get('format') != INDEX_FORMAT_VERSION
+            or manifest.get('fingerprint') != self.fingerprint
+        ):
+            # New index, or the tokenizer changed: stale counts are useless
+            self._reset()
+        self._read()
+
+    def _read(self):
+        """Open the compacted arrays and replay the delta log"""
+        if self.keys_path.exists():
+            self._keys = np.load(self.keys_path, mmap_mode='r')
+            self._counts = np.load(self.counts_path, mmap_mode='r')
+        else:
+            self._keys = np.empty(0, dtype=np.uint64)
+            self._counts = np.empty(0, dtype=np.uint32)
+
+        if self.delta_path.exists():
+            raw = self.delta_path.read_bytes()
+            usable = len(raw) - len(raw) % DELTA_DTYPE.itemsize  # ignore a torn tail write
+            records = np.frombuffer(raw[:usable], dtype=DELTA_DTYPE)
+            self._recent = dict(zip(records['key'].tolist(), records['count'].tolist()))
+        else:
+            self._recent = {}
+
+    def _reset(self):
+        for path in (self.keys_path, self.counts_path, self.delta_path):
+            if path.exists():
+                path.unlink()
+        self._write_manifest(0)
+
+    def _write_manifest(self, entries: int):
+        tmp = self.manifest_path.with_suffix('.json.tmp')
+        tmp.write_text(json.dumps({
+            'format': INDEX_FORMAT_VERSION,
+            'tokenizer': self.tokenizer_id,
+            'fingerprint': self.fingerprint,
+            'entries': entries
+        }, indent=2))
+        os.replace(tmp, self.manifest_path)
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._recent)
+
+    @property
+    def pending(self) -> int:
+        """Entries recorded but not yet flushed to the delta log"""
+        return sum(len(keys) for keys in self._pending_keys)
+
+    def lookup(self, hashes: np.ndarray) -> np.ndarray:
+        """Token counts for hashes, -1 where the index has no entry"""
+        result = np.full(len(hashes), -1, dtype=np.int64)
+
+        if len(self._keys):
+            pos = np.searchsorted(self._keys, hashes)
+            pos_clipped = np.minimum(pos, len(self._keys) - 1)
+            found = self._keys[pos_clipped] == hashes
+            result[found] = self._counts[pos_clipped[found]]
+
+        if self._recent:
+            for i in np.flatnonzero(result < 0):
+                count = self._recent.get(int(hashes[i]))
+                if count is not None:
+                    result[i] = count
+
+        return result
+
+    def add(self, hashes: np.ndarray, counts: np.ndarray):
+        """Record new token counts; persisted on `flush()`"""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        counts = np.asarray(counts, dtype=np.uint32)
+        self._pending_keys.append(hashes)
+        self._pending_counts.append(counts)
+        self._recent.update(zip(hashes.tolist(), counts.tolist()))
+
+    def counts_for(
+        self,
+        texts: List[str],
+        encode_batch: Callable[[List[str]], List[int]],
+        hashes: Optional[np.ndarray] = None
+    ) -> List[int]:
+        """Token counts for texts, encoding only those missing from the index"""
+        if hashes is None:
+            hashes = hash_texts(texts)
+        counts = self.lookup(hashes)
+
+        missing = np.flatnonzero(counts < 0)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if len(missing):
+            # Encode each distinct missing text once
+            unique_hashes, first, inverse = np.unique(
+                hashes[missing], return_index=True, return_inverse=True
+            )
+            new_counts = np.asarray(
+                encode_batch([texts[missing[i]] for i in first]), dtype=np.int64
+            )
+            counts[missing] = new_counts[inverse]
+            self.add(unique_hashes, new_counts)
+
+        return counts.tolist()
+
+    def flush(self):
+        """Append pending entries to the delta log"""
+        if self._pending_keys:
+            with self._locked():
+                self._append_pending()
+
+        if len(self._recent) >= max(AUTO_COMPACT_RECORDS, len(self._keys) // 4):
+            self.compact()
+
+    def _append_pending(self):
+        keys = np.concatenate(self._pending_keys)
+        counts = np.concatenate(self._pending_counts)
+        self._pending_keys.clear()
+        self._pending_counts.clear()
+
+        records = np.empty(len(keys), dtype=DELTA_DTYPE)
+        records['key'] = keys
+        records['count'] = counts
+        with open(self.delta_path, 'ab') as f:
+            # Drop a torn tail left by a crashed writer so records stay aligned
+            torn = f.tell() % DELTA_DTYPE.itemsize
+            if torn:
+                f.truncate(f.tell() - torn)
+            f.write(records.tobytes())
+
+    def compact(self, retain: Optional[np.ndarray] = None):
+        """Fold the delta log into the sorted arrays
+
+        If `retain` is given, only those hashes are kept, dropping counts for
+        texts that are no longer part of any dataset.
+        """
+        with self._locked():
+            self._compact(retain)
+
+    def _compact(self, retain: Optional[np.ndarray]):
+        # Pick up what other writers appended or compacted since we loaded;
+        # our own entries, flushed or not, win on duplicate keys
+        own = self._recent
+        self._pending_keys.clear()
+        self._pending_counts.clear()
+        self._read()
+        self._recent.update(own)
+
+        keys = np.asarray(self._keys, dtype=np.uint64)
+        counts = np.asarray(self._counts, dtype=np.uint32)
+        if self._recent:
+            recent_keys = np.fromiter(self._recent.keys(), dtype=np.uint64, count=len(self._recent))
+            recent_counts = np.fromiter(self._recent.values(), dtype=np.uint32, count=len(self._recent))
+            # Later entries win on duplicate keys
+            keys = np.concatenate([recent_keys, keys])
+            counts = np.concatenate([recent_counts, counts])
+
+        keys, first = np.unique(keys, return_index=True)
+        counts = counts[first]
+
+        if retain is not None:
+            keep = np.isin(keys, np.asarray(retain, dtype=np.uint64))
+            keys, counts = keys[keep], counts[keep]
+
+        # Drop the mmaps before replacing the files underneath them
+        self._keys = keys
+        self._counts = counts
+
+        for path, array in ((self.keys_path, keys), (self.counts_path, counts)):
+            tmp = path.with_name(path.name + '.tmp')
+            with open(tmp, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp, path)
+
+        if self.delta_path.exists():
+            self.delta_path.unlink()
+        self._recent = {}
+        self._write_manifest(len(keys))
+
+        self._keys = np.load(self.keys_path, mmap_mode='r')
+        self._counts = np.load(self.counts_path, mmap_mode='r')
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters for the current process"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='Token Count Index')
+    parser.add_argument('--index-dir', type=str, default=DEFAULT_INDEX_DIR, help='Index directory')
+    parser.add_argument('--compact', action='store_true', help='Compact every index in the directory')
+
+    args = parser.parse_args()
+    root = Path(args.index_dir)
+
+    for manifest_path in sorted(root.glob('*.json')):
+        manifest = json.loads(manifest_path.read_text())
+        index = TokenCountIndex(manifest['tokenizer'], manifest['fingerprint'], args.index_dir)
+        if args.compact:
+            index.compact()
+        print(f"{manifest['tokenizer']}: {len(index):,} entries ({manifest['fingerprint']})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Usage Columns - columnar store for provider usage exports
+Normalizes Anthropic (claude_api_tokens_*) and OpenAI (completions_usage_*)
+CSV exports into one typed layout of memory-mappable .npy columns with
+dictionary-encoded model, workspace and api_key, queryable with
+vectorized filters.
+
+Layout under the store directory:
+    manifest.json         segments, their row counts/time ranges and sources
+    dictionaries.json     append-only code -> value lists per encoded column
+    seg-000001/<col>.npy  one file per column, never rewritten once written
+
+Usage: python scripts/python/usage_columns.py --ingest data/usage-reports/*.csv --summary
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import argparse
+from pathlib import Path
+from typing import List, Dict, Any, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_STORE_DIR = os.environ.get('METERR_USAGE_COLUMNS', 'data/usage-columns')
+
+# Rows parsed per chunk; bounds memory on multi-GB exports
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+PROVIDERS = ['anthropic', 'openai']
+
+# Dictionary-encoded string columns
+ENCODED_COLUMNS = ['model', 'workspace', 'api_key']
+
+# Normalized column -> dtype
+COLUMNS = {
+    'ts': np.int64,
+    'bucket_seconds': np.int32,
+    'provider': np.uint8,
+    'model': np.int32,
+    'workspace': np.int32,
+    'api_key': np.int32,
+    'input_uncached': np.int64,
+    'cache_write_5m': np.int64,
+    'cache_write_1h': np.int64,
+    'cache_read': np.int64,
+    'output_tokens': np.int64,
+    'requests': np.int64,
+    'web_search': np.int64,
+}
+
+TOKEN_COLUMNS = ['input_uncached', 'cache_write_5m', 'cache_write_1h', 'cache_read', 'output_tokens']
+
+# Source column per normalized column, and how each export encodes time
+EXPORT_SCHEMAS = {
+    'anthropic': {
+        'detect': 'usage_input_tokens_no_cache',
+        'time': ('usage_date_utc', 'date'),
+        'bucket_seconds': 86400,
+        'columns': {
+            'model': 'model_version',
+            'workspace': 'workspace',
+            'api_key': 'api_key',
+            'input_uncached': 'usage_input_tokens_no_cache',
+            'cache_write_5m': 'usage_input_tokens_cache_write_5m',
+            'cache_write_1h': 'usage_input_tokens_cache_write_1h',
+            'cache_read': 'usage_input_tokens_cache_read',
+            'output_tokens': 'usage_output_tokens',
+            'web_search': 'web_search_count',
+        },
+    },
+    'openai': {
+        'detect': 'num_model_requests',
+        'time': ('start_time', 'epoch'),
+        'bucket_end': 'end_time',
+        'columns': {
+            'model': 'model',
+            'workspace': 'project_id',
+            'api_key': 'api_key_id',
+            'input_uncached': 'input_uncached_tokens',
+            'cache_read': 'input_cached_tokens',
+            'output_tokens': 'output_tokens',
+            'requests': 'num_model_requests',
+        },
+    },
+}
+
+def detect_schema(path: str) -> str:
+    """Export format of a CSV, from its header"""
+    header = pd.read_csv(path, nrows=0).columns
+    for name, schema in EXPORT_SCHEMAS.items():
+        if schema['detect'] in header:
+            return name
+    raise ValueError(f"Unrecognized usage export format: {path}")
+
+class UsageColumns:
+    """Append-only columnar store of normalized usage export rows"""
+
+    def __init__(self, store_dir: str = DEFAULT_STORE_DIR):
+        self.root = Path(store_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.root / 'manifest.json'
+        self.dictionaries_path = self.root / 'dictionaries.json'
+
+        self.manifest = {'segments': [], 'sources': {}, 'next_segment': 1}
+        if self.manifest_path.exists():
+            self.manifest = json.loads(self.manifest_path.read_text())
+
+        self.dictionaries: Dict[str, List[str]] = {col: [] for col in ENCODED_COLUMNS}
+        if self.dictionaries_path.exists():
+            self.dictionaries.update(json.loads(self.dictionaries_path.read_text()))
+        self._codes = {
+            col: {value: code for code, value in enumerate(values)}
+            for col, values in self.dictionaries.items()
+        }
+        self._mapped: Dict[str, Dict[str, np.ndarray]] = {}
+
+    def _write_json(self, path: Path, data: Any):
+        tmp = path.with_name(path.name + '.tmp')
+        tmp.write_text(json.dumps(data, indent=2))
+        os.replace(tmp, path)
+
+    def _encode(self, column: str, values: pd.Series) -> np.ndarray:
+        """Map strings to stable dictionary codes, extending the dictionary as needed"""
+        local_codes, uniques = pd.factorize(values.fillna(''), sort=False)
+        codes = self._codes[column]
+        mapping = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques):
+            code = codes.get(value)
+            if code is None:
+                code = len(self.dictionaries[column])
+                self.dictionaries[column].append(value)
+                codes[value] = code
+            mapping[i] = code
+        return mapping[local_codes]
+
+    def _normalize(self, provider: str, chunk: pd.DataFrame) -> Dict[str, np.ndarray]:
+        schema = EXPORT_SCHEMAS[provider]
+        n = len(chunk)
+
+        time_col, time_kind = schema['time']
+        if time_kind == 'epoch':
+            ts = chunk[time_col].to_numpy(dtype=np.int64)
+        else:
+            ts = pd.to_datetime(chunk[time_col], utc=True).dt.as_unit('s').astype('int64').to_numpy()
+
+        if 'bucket_end' in schema:
+            bucket = chunk[schema['bucket_end']].to_numpy(dtype=np.int64) - ts
+        else:
+            bucket = np.full(n, schema['bucket_seconds'])
+
+        out = {
+            'ts': ts,
+            'bucket_seconds': bucket.astype(np.int32),
+            'provider': np.full(n, PROVIDERS.index(provider), dtype=np.uint8),
+        }
+        for column, dtype in COLUMNS.items():
+            if column in out:
+                continue
+            source = schema['columns'].get(column)
+            if column in ENCODED_COLUMNS:
+                values = chunk[source] if source else pd.Series([''] * n)
+                out[column] = self._encode(column, values.astype('string'))
+            elif source:
+                out[column] = chunk[source].fillna(0).to_numpy(dtype=np.float64).astype(dtype)
+            else:
+                out[column] = np.zeros(n, dtype=dtype)
+        return out
+
+    def _read_chunks(self, path: str, provider: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        """Stream an export, dropping empty buckets before normalization"""
+        schema = EXPORT_SCHEMAS[provider]
+        usecols = {schema['time'][0], *schema['columns'].values()}
+        if 'bucket_end' in schema:
+            usecols.add(schema['bucket_end'])
+        model_col = schema['columns']['model']
+
+        dtypes = {col: 'string' for col in (schema['columns'][c] for c in ENCODED_COLUMNS)}
+        for chunk in pd.read_csv(path, usecols=list(usecols), dtype=dtypes, chunksize=chunk_rows):
+            # OpenAI exports emit a row per bucket even when nothing was used
+            chunk = chunk[chunk[model_col].notna()]
+            if len(chunk):
+                yield chunk
+
+    def ingest(self, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, force: bool = False) -> int:
+        """Append an export as new segments; unchanged files are skipped"""
+        source = str(Path(path).resolve())
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest = digest.hexdigest()
+
+        previous = self.manifest['sources'].get(source)
+        if previous and previous['sha256'] == digest and not force:
+            return 0
+
+        # A re-downloaded export supersedes its earlier segments
+        superseded = [seg for seg in self.manifest['segments'] if seg['source'] == source]
+        self.manifest['segments'] = [
+            seg for seg in self.manifest['segments'] if seg['source'] != source
+        ]
+
+        provider = detect_schema(path)
+        rows = 0
+        for chunk in self._read_chunks(path, provider, chunk_rows):
+            columns = self._normalize(provider, chunk)
+            self._write_segment(columns, source)
+            rows += len(chunk)
+
+        self.manifest['sources'][source] = {'sha256': digest, 'provider': provider, 'rows': rows}
+        self._write_json(self.dictionaries_path, self.dictionaries)
+        self._write_json(self.manifest_path, self.manifest)
+        self._mapped.clear()
+
+        for segment in superseded:
+            shutil.rmtree(self.root / segment['name'], ignore_errors=True)
+        return rows
+
+    def _write_segment(self, columns: Dict[str, np.ndarray], source: str):
+        number = self.manifest['next_segment']
+        self.manifest['next_segment'] = number + 1
+        name = f"seg-{number:06d}"
+        seg_dir = self.root / name
+        seg_dir.mkdir(exist_ok=True)
+        for column, values in columns.items():
+            np.save(seg_dir / f"{column}.npy", values.astype(COLUMNS[column], copy=False))
+
+        self.manifest['segments'].append({
+            'id': number,
+            'name': name,
+            'source': source,
+            'rows': int(len(columns['ts'])),
+            'min_ts': int(columns['ts'].min()),
+            'max_ts': int(columns['ts'].max()),
+        })
+
+    def _segment(self, segment: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        name = segment['name']
+        if name not in self._mapped:
+            seg_dir = self.root / name
+            self._mapped[name] = {
+                column: np.load(seg_dir / f"{column}.npy", mmap_mode='r') for column in COLUMNS
+            }
+        return self._mapped[name]
+
+    def code(self, column: str, value: str) -> int:
+        """Dictionary code for a value, -1 if never seen"""
+        return self._codes[column].get(value, -1)
+
+    def scan(
+        self,
+        columns: Optional[List[str]] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        **equals: str
+    ) -> Dict[str, np.ndarray]:
+        """Rows in [start, end) matching encoded-column equality filters
+
+        Segments outside the time range are skipped via their min/max
+        timestamps; filters run as vectorized masks over memory-mapped
+        columns.
+        """
+        columns = columns or list(COLUMNS)
+        wanted = {}
+        for column, value in equals.items():
+            if column == 'provider':
+                wanted[column] = PROVIDERS.index(value) if value in PROVIDERS else -1
+            else:
+                wanted[column] = self.code(column, value)
+
+        parts: Dict[str, List[np.ndarray]] = {column: [] for column in columns}
+        for segment in self.manifest['segments']:
+            if start is not None and segment['max_ts'] < start:
+                continue
+            if end is not None and segment['min_ts'] >= end:
+                continue
+
+            data = self._segment(segment)
+            mask = np.ones(segment['rows'], dtype=bool)
+            if start is not None:
+                mask &= data['ts'] >= start
+            if end is not None:
+                mask &= data['ts'] < end
+            for column, code in wanted.items():
+                mask &= data[column] == code
+
+            for column in columns:
+                parts[column].append(data[column][mask])
+
+        return {
+            column: np.concatenate(arrays) if arrays else np.empty(0, dtype=COLUMNS[column])
+            for column, arrays in parts.items()
+        }
+
+    def totals(
+        self,
+        by: str = 'model',
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        **equals: str
+    ) -> pd.DataFrame:
+        """Token and request totals grouped by an encoded column"""
+        measures = TOKEN_COLUMNS + ['requests']
+        data = self.scan([by] + measures, start, end, **equals)
+
+        labels = PROVIDERS if by == 'provider' else self.dictionaries[by]
+        codes = data[by].astype(np.int64)
+        result = {by: labels}
+        for measure in measures:
+            result[measure] = np.bincount(codes, weights=data[measure], minlength=len(labels))
+
+        df = pd.DataFrame(result)
+        df['total_tokens'] = df[TOKEN_COLUMNS].sum(axis=1)
+        return df[df['total_tokens'] > 0].sort_values('total_tokens', ascending=False).reset_index(drop=True)
+
+    def __len__(self) -> int:
+        return sum(seg['rows'] for seg in self.manifest['segments'])
+
+def main():
+    parser = argparse.ArgumentParser(description='Usage Columns')
+    parser.add_argument('--store', type=str, default=DEFAULT_STORE_DIR, help='Store directory')
+    parser.add_argument('--ingest', nargs='+', help='Provider CSV exports to append')
+    parser.add_argument('--force', action='store_true', help='Re-ingest files even if unchanged')
+    parser.add_argument('--summary', action='store_true', help='Print totals by model')
+
+    args = parser.parse_args()
+    store = UsageColumns(args.store)
+
+    for path in args.ingest or []:
+        rows = store.ingest(path, force=args.force)
+        print(f"{path}: {rows} rows" if rows else f"{path}: unchanged, skipped")
+
+    if args.summary:
+        print(f"\n{len(store):,} rows in {len(store.manifest['segments'])} segments")
+        print(store.totals('model').to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Usage Store - embedded SQLite store with pre-aggregated rollups
+Ingests SDK UsageRecords and provider CSV exports, keeps raw events in
+monthly partitions and maintains minute/hour/day rollups incrementally so
+the dashboard never rescans raw events.
+Usage: python scripts/python/usage_store.py --ingest data/usage-reports/*.csv
+"""
+
+import os
+import csv
+import sqlite3
+import hashlib
+import argparse
+from pathlib import Path
+from dataclasses import asdict, is_dataclass
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+import pandas as pd
+
+from pricing import CACHE_PRICING, OPENAI_CACHED_INPUT, model_prices
+
+DEFAULT_DB_PATH = os.environ.get('METERR_USAGE_DB', 'data/usage.db')
+
+# Rollup levels and their bucket width in seconds
+ROLLUP_LEVELS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+# Summed measures stored on every event and rollup row
+MEASURES = [
+    'input_tokens', 'output_tokens', 'cached_tokens', 'tokens',
+    'cost', 'requests', 'errors', 'latency_ms'
+]
+
+def to_utc(value: datetime) -> datetime:
+    """Aware UTC datetime; naive values are taken to be in local time"""
+    if isinstance(value, pd.Timestamp):
+        value = value.to_pydatetime()
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return value.astimezone(timezone.utc)
+
+def _to_epoch(value) -> int:
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime):
+        return int(to_utc(value).timestamp())
+    # Export dates and SDK timestamps are UTC, with or without an offset
+    dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+def _num(value) -> float:
+    try:
+        return float(value) if value not in (None, '') else 0.0
+    except ValueError:
+        return 0.0
+
+class UsageStore:
+    """Time-partitioned usage events plus incrementally maintained rollups"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._partitions = set()
+        self._init_db()
+
+    def _init_db(self):
+        """Create rollup and bookkeeping tables"""
+        measures = ',\n'.join(f"{m} REAL NOT NULL DEFAULT 0" for m in MEASURES)
+        with self.conn:
+            for level in ROLLUP_LEVELS:
+                self.conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS rollup_{level} (
+                        bucket INTEGER NOT NULL,
+                        model TEXT NOT NULL,
+                        team TEXT NOT NULL DEFAULT '',
+                        project TEXT NOT NULL DEFAULT '',
+                        {measures},
+                        PRIMARY KEY (bucket, model, team, project)
+                    ) WITHOUT ROWID
+                """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingested_sources (
+                    source TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    granularity INTEGER NOT NULL,
+                    rows INTEGER NOT NULL,
+                    ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # What each export added to the rollups, at its own granularity, so a
+            # re-ingest can take it back out after the raw events are dropped
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS source_rollups (
+                    source TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    model TEXT NOT NULL,
+                    team TEXT NOT NULL DEFAULT '',
+                    project TEXT NOT NULL DEFAULT '',
+                    {measures},
+                    PRIMARY KEY (source, bucket, model, team, project)
+                ) WITHOUT ROWID
+            """)
+            # Bucket span each write touched, so readers can re-read late or backfilled buckets
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    level TEXT NOT NULL,
+                    first_bucket INTEGER NOT NULL,
+                    last_bucket INTEGER NOT NULL
+                )
+            """)
+        self._partitions = {
+            row[0] for row in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'events_%'"
+            )
+        }
+
+    def _partition(self, ts: int) -> str:
+        """Monthly raw-event table for a timestamp, created on first use"""
+        name = 'events_' + datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y%m')
+        if name not in self._partitions:
+            measures = ',\n'.join(f"{m} REAL NOT NULL DEFAULT 0" for m in MEASURES)
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {name} (
+                    ts INTEGER NOT NULL,
+                    model TEXT NOT NULL,
+                    team TEXT NOT NULL DEFAULT '',
+                    project TEXT NOT NULL DEFAULT '',
+                    {measures},
+                    source TEXT
+                )
+            """)
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_ts ON {name} (ts)")
+            self._partitions.add(name)
+        return name
+
+    def ingest_rows(self, rows: Iterable[Dict[str, Any]], granularity: int = 0, source: str = 'sdk') -> int:
+        """Store normalized rows and fold them into every rollup level
+
+        `granularity` is the bucket width the rows were reported at; rollups
+        finer than that are skipped so daily exports don't show up as a
+        spike in the first minute of the day.
+        """
+        events: Dict[str, List[Tuple]] = {}
+        normalized = []
+
+        for row in rows:
+            ts = row['ts']
+            key = (row['model'], row.get('team') or '', row.get('project') or '')
+            values = [row.get(m, 0) or 0 for m in MEASURES]
+            events.setdefault(self._partition(ts), []).append((ts, *key, *values, source))
+            normalized.append((ts, key, values))
+
+        columns = ', '.join(MEASURES)
+        placeholders = ', '.join('?' * (len(MEASURES) + 5))
+
+        with self.conn:
+            for table, table_rows in events.items():
+                self.conn.executemany(
+                    f"INSERT INTO {table} (ts, model, team, project, {columns}, source) VALUES ({placeholders})",
+                    table_rows
+                )
+            self._apply_rollups(normalized, granularity, sign=1)
+            if granularity:
+                self._record_contribution(source, normalized, granularity)
+
+        return len(normalized)
+
+    def _record_contribution(self, source: str, rows: List[Tuple[int, Tuple, List[float]]], granularity: int):
+        """Keep a source's rows summed per bucket at the width they were reported at"""
+        columns = ', '.join(MEASURES)
+        updates = ', '.join(f"{m} = {m} + excluded.{m}" for m in MEASURES)
+        acc: Dict[Tuple, List[float]] = {}
+        for ts, key, values in rows:
+            bucket_key = (ts - ts % granularity, *key)
+            current = acc.get(bucket_key)
+            if current is None:
+                acc[bucket_key] = list(values)
+            else:
+                for i, v in enumerate(values):
+                    current[i] += v
+        self.conn.executemany(
+            f"""
+            INSERT INTO source_rollups (source, bucket, model, team, project, {columns})
+            VALUES ({', '.join('?' * (len(MEASURES) + 5))})
+            ON CONFLICT (source, bucket, model, team, project) DO UPDATE SET {updates}
+            """,
+            [(source, *k, *v) for k, v in acc.items()]
+        )
+
+    def _apply_rollups(self, rows: List[Tuple[int, Tuple, List[float]]], granularity: int, sign: int):
+        """Pre-aggregate rows per bucket and upsert them into each rollup level"""
+        columns = ', '.join(MEASURES)
+        updates = ', '.join(f"{m} = {m} + excluded.{m}" for m in MEASURES)
+
+        for level, width in ROLLUP_LEVELS.items():
+            if width < granularity:
+                continue
+            acc: Dict[Tuple, List[float]] = {}
+            for ts, key, values in rows:
+                bucket_key = (ts - ts % width, *key)
+                current = acc.get(bucket_key)
+                if current is None:
+                    acc[bucket_key] = [sign * v for v in values]
+                else:
+                    for i, v in enumerate(values):
+                        current[i] += sign * v
+            self.conn.executemany(
+                f"""
+                INSERT INTO rollup_{level} (bucket, model, team, project, {columns})
+                VALUES ({', '.join('?' * (len(MEASURES) + 4))})
+                ON CONFLICT (bucket, model, team, project) DO UPDATE SET {updates}
+                """,
+                [(*k, *v) for k, v in acc.items()]
+            )
+            if acc:
+                buckets = [k[0] for k in acc]
+                self.conn.execute(
+                    "INSERT INTO rollup_changes (level, first_bucket, last_bucket) VALUES (?, ?, ?)",
+                    (level, min(buckets), max(buckets))
+                )
+
+    def _retract_source(self, source: str, granularity: int):
+        """Remove a previously ingested file's events and subtract them from the rollups
+
+        The subtraction uses the source's recorded contribution, which outlives
+        drop_events_before(); stores written before contributions were kept
+        fall back to the source's remaining raw events.
+        """
+        columns = ', '.join(MEASURES)
+        rows = [
+            (bucket, (model, team, project), values)
+            for bucket, model, team, project, *values in self.conn.execute(
+                f"SELECT bucket, model, team, project, {columns} FROM source_rollups WHERE source = ?", (source,)
+            )
+        ]
+        self.conn.execute("DELETE FROM source_rollups WHERE source = ?", (source,))
+        recorded = bool(rows)
+        for table in sorted(self._partitions):
+            if not recorded:
+                for ts, model, team, project, *values in self.conn.execute(
+                    f"SELECT ts, model, team, project, {columns} FROM {table} WHERE source = ?", (source,)
+                ):
+                    rows.append((ts, (model, team, project), values))
+            self.conn.execute(f"DELETE FROM {table} WHERE source = ?", (source,))
+        self._apply_rollups(rows, granularity, sign=-1)
+
+    def ingest_records(self, records: Iterable[Any]) -> int:
+        """Ingest SDK UsageRecords (dataclasses or dicts)"""
+        def normalize():
+            for record in records:
+                r = asdict(record) if is_dataclass(record) else dict(record)
+                input_tokens = r.get('input_tokens', 0) or 0
+                output_tokens = r.get('output_tokens', 0) or 0
+                status = r.get('status', 'success')
+                # Cache hits and coalesced requests cost nothing; their tokens show up as cached savings
+                cached_tokens = r.get('cached_tokens', 0) or 0
+                if status in ('cache_hit', 'coalesced'):
+                    cached_tokens = input_tokens + output_tokens
+                yield {
+                    'ts': _to_epoch(r['timestamp']),
+                    'model': r['model'],
+                    'team': r.get('team'),
+                    'project': r.get('project'),
+                    'input_tokens': input_tokens,
+                    'output_tokens': output_tokens,
+                    'cached_tokens': cached_tokens,
+                    'tokens': r.get('total_tokens') or r.get('tokens') or input_tokens + output_tokens,
+                    'cost': r.get('cost', 0.0) or 0.0,
+                    'requests': r.get('requests', 1),
+                    'errors': 1 if status == 'error' else 0,
+                    'latency_ms': r.get('latency_ms', 0.0) or 0.0,
+                }
+        return self.ingest_rows(normalize(), source='sdk')
+
+    def ingest_csv(self, path: str, force: bool = False) -> int:
+        """Ingest an Anthropic or OpenAI usage export, skipping files already loaded"""
+        digest = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+        source = str(Path(path).resolve())
+
+        existing = self.conn.execute(
+            "SELECT sha256, granularity FROM ingested_sources WHERE source = ?", (source,)
+        ).fetchone()
+        if existing and existing[0] == digest and not force:
+            return 0
+        if existing:
+            # The export was re-downloaded with new data: replace, don't double count
+            with self.conn:
+                self._retract_source(source, existing[1])
+
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            header = set(reader.fieldnames or [])
+            if 'usage_input_tokens_no_cache' in header:
+                rows, granularity = self._anthropic_rows(reader), ROLLUP_LEVELS['day']
+            elif 'num_model_requests' in header:
+                rows, granularity = self._openai_rows(reader), ROLLUP_LEVELS['day']
+            else:
+                raise ValueError(f"Unrecognized usage export format: {path}")
+            count = self.ingest_rows(rows, granularity=granularity, source=source)
+
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ingested_sources (source, sha256, granularity, rows) VALUES (?, ?, ?, ?)",
+                (source, digest, granularity, count)
+            )
+        return count
+
+    @staticmethod
+    def _anthropic_rows(reader: csv.DictReader) -> Iterable[Dict[str, Any]]:
+        for row in reader:
+            model = row['model_version']
+            prices = model_prices(model)
+            uncached = _num(row['usage_input_tokens_no_cache'])
+            write_5m = _num(row['usage_input_tokens_cache_write_5m'])
+            write_1h = _num(row['usage_input_tokens_cache_write_1h'])
+            read = _num(row['usage_input_tokens_cache_read'])
+            output = _num(row['usage_output_tokens'])
+
+            input_equivalent = (
+                uncached
+                + write_5m * CACHE_PRICING['5m']['write']
+                + write_1h * CACHE_PRICING['1h']['write']
+                + read * CACHE_PRICING['5m']['read']
+            )
+            input_tokens = uncached + write_5m + write_1h + read
+            yield {
+                'ts': _to_epoch(row['usage_date_utc']),
+                'model': model,
+                'team': row.get('workspace'),
+                'project': row.get('api_key'),
+                'input_tokens': input_tokens,
+                'output_tokens': output,
+                'cached_tokens': read,
+                'tokens': input_tokens + output,
+                'cost': (input_equivalent * prices['input'] + output * prices['output']) / 1000,
+                'requests': 0,  # Anthropic exports don't report request counts
+                'errors': 0,
+                'latency_ms': 0.0,
+            }
+
+    @staticmethod
+    def _openai_rows(reader: csv.DictReader) -> Iterable[Dict[str, Any]]:
+        for row in reader:
+            if not row.get('model'):
+                continue  # empty bucket
+            model = row['model']
+            prices = model_prices(model)
+            input_tokens = _num(row['input_tokens'])
+            cached = _num(row.get('input_cached_tokens'))
+            output = _num(row['output_tokens'])
+            yield {
+                'ts': int(_num(row['start_time'])),
+                'model': model,
+                'team': row.get('project_id'),
+                'project': row.get('api_key_id'),
+                'input_tokens': input_tokens,
+                'output_tokens': output,
+                'cached_tokens': cached,
+                'tokens': input_tokens + output,
+                'cost': ((input_tokens - cached + cached * OPENAI_CACHED_INPUT) * prices['input'] + output * prices['output']) / 1000,
+                'requests': _num(row['num_model_requests']),
+                'errors': 0,
+                'latency_ms': 0.0,
+            }
+
+    @staticmethod
+    def pick_level(start: datetime, end: datetime, max_points: int = 2000) -> str:
+        """Finest rollup level that keeps a time range under `max_points` buckets"""
+        span = max((end - start).total_seconds(), 1)
+        for level, width in ROLLUP_LEVELS.items():
+            if span / width <= max_points:
+                return level
+        return 'day'
+
+    def query(
+        self,
+        level: str,
+        start: datetime,
+        end: datetime,
+        models: Optional[List[str]] = None,
+        group_by: Tuple[str, ...] = ('model',)
+    ) -> pd.DataFrame:
+        """Rollup rows in [start, end) at one level, summed over non-grouped keys
+
+        Naive `start`/`end` are local time; the returned timestamps are naive UTC.
+        """
+        if level not in ROLLUP_LEVELS:
+            raise ValueError(f"Unknown rollup level {level}. Choose from: {list(ROLLUP_LEVELS)}")
+
+        keys = ', '.join(('bucket',) + tuple(group_by))
+        sums = ', '.join(f"SUM({m}) AS {m}" for m in MEASURES)
+        sql = f"SELECT {keys}, {sums} FROM rollup_{level} WHERE bucket >= ? AND bucket < ?"
+        params: List[Any] = [_to_epoch(start), _to_epoch(end)]
+        if models:
+            sql += f" AND model IN ({', '.join('?' * len(models))})"
+            params.extend(models)
+        sql += f" GROUP BY {keys} ORDER BY bucket"
+
+        df = pd.read_sql_query(sql, self.conn, params=params)
+        df.insert(0, 'timestamp', pd.to_datetime(df.pop('bucket'), unit='s'))
+        return df
+
+    def changes_since(self, seq: int) -> Tuple[int, Dict[str, Tuple[int, int]]]:
+        """Latest change sequence and, per level, the bucket span rewritten after `seq`"""
+        latest = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM rollup_changes").fetchone()[0]
+        spans = {
+            level: (first, last) for level, first, last in self.conn.execute(
+                """
+                SELECT level, MIN(first_bucket), MAX(last_bucket) FROM rollup_changes
+                WHERE seq > ? AND seq <= ? GROUP BY level
+                """,
+                (seq, latest)
+            )
+        }
+        return latest, spans
+
+    def models(self) -> List[str]:
+        """Models present in the store"""
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT model FROM rollup_day ORDER BY model")]
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM rollup_day LIMIT 1").fetchone() is None
+
+    def drop_events_before(self, cutoff: datetime) -> List[str]:
+        """Drop whole raw-event partitions older than `cutoff`; rollups are kept"""
+        limit = 'events_' + to_utc(cutoff).strftime('%Y%m')
+        dropped = sorted(name for name in self._partitions if name < limit)
+        with self.conn:
+            for name in dropped:
+                self.conn.execute(f"DROP TABLE {name}")
+        self._partitions.difference_update(dropped)
+        return dropped
+
+def main():
+    parser = argparse.ArgumentParser(description='Usage Store')
+    parser.add_argument('--db', type=str, default=DEFAULT_DB_PATH, help='SQLite database path')
+    parser.add_argument('--ingest', nargs='+', help='Provider CSV exports to ingest')
+    parser.add_argument('--force', action='store_true', help='Re-ingest files even if unchanged')
+
+    args = parser.parse_args()
+    store = UsageStore(args.db)
+
+    for path in args.ingest or []:
+        count = store.ingest_csv(path, force=args.force)
+        print(f"{path}: {count} rows" if count else f"{path}: unchanged, skipped")
+
+    print(f"Models: {', '.join(store.models()) or '(none)'}")
+
+if __name__ == "__main__":
+    main()